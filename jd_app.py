@@ -5,26 +5,76 @@ Flask application providing a RESTful API to do boring stuff.
 
 Flask listens to http://127.0.0.1:5000/
 API entry point is /api/v1/
+
+    $ python3 jd_app.py                     # gunicorn (if installed)
+    $ python3 jd_app.py --workers 4 --bind 0.0.0.0:5000
+    $ python3 jd_app.py --dev               # development server, debugger
+    $ python3 jd_app.py --benchmark         # time startup and requests
+    $ gunicorn -k gthread --threads 8 'jd_app:create_app(threads=8)'
 """
 
 import os
 import sys
+import base64
+import signal
+import argparse
+import threading
+from time import perf_counter
 from pprint import pprint
+from werkzeug.serving import make_server
 from werkzeug.utils import redirect
 from werkzeug.security import check_password_hash
-from flask import Flask, jsonify, make_response, request
+from functools import wraps
+from flask import Flask, g, jsonify, make_response, request
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
 from flask_restx import Resource, Api
 
-from jd_lib import AuthDB, DataDB, TaskMgr
-from jd_modules import Items
+from jd_lib import AuthCache, AuthDB, DataDB, TaskMgr, get_pool
+from jd_modules import Items, ItemsBatch, ItemsExport, Tasks, TaskOutput
+from jd_modules.encoding import Compression, output_json
 # from jd_modules import Podman
 from jd_modules.podman import Images as PodmanImages
+from jd_modules.podman import EngineClient, ImageArchive, ImageJobs, Inventory
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:         # optional, production server
+    BaseApplication = None
 
 
 DB = 'file:app.db'
 TOKENKEY = 'eyJhbGciOiJIUzUxMiIsImlhdCI6MTU5MzM0MzQxMSwiZXhwIjoxNTkzMzQ3MDEx9Q'
 DEBUGIT = False  # True # False
+DBPRAGMAS = {                   # see jd_lib/connpool.py for the defaults
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16384,
+    'mmap_size': 67108864,
+}
+GROUPCOMMIT = None              # seconds to batch writes (e.g. 0.005), opt-in
+AUTHCACHE = {'size': 1024, 'ttl': 300}   # verified credentials cache
+TOKENTTL = None                 # seconds a token is valid, None: forever
+TASKLIMITS = {'max_running': 8, 'max_queue': 256}   # task scheduler
+PODMANENGINE = None             # API socket path, None: use the podman CLI
+TASKCACHE = {'ttl': 10, 'stale': 60}    # read-only command results
+INVENTORYTTL = 30               # seconds until the image list is reloaded
+BUILDROOT = './contexts'        # image build contexts must be below
+TASKRETENTION = {               # see jd_lib/retention.py, None: keep all
+    'max_age': 7 * 86400,
+    'max_count': 1000,
+    'max_bytes': 268435456,
+    'archive': None,            # directory for tar.gz archives
+}
+BIND = '127.0.0.1:5000'         # listen address of the production server
+WORKERS = 1                     # worker processes (each has its own TaskMgr)
+THREADS = 8                     # request threads per worker
+POOLSPARE = 6                   # DB connections for background threads
+SHUTDOWNWAIT = 30               # seconds running tasks get on shutdown
+BENCHREQUESTS = 200             # requests timed by --benchmark
+MUTATIONS = ('POST', 'PUT', 'PATCH', 'DELETE')  # run in one transaction
+COMPRESSION = {                 # see jd_modules/encoding.py, None disables
+    'min_size': 1024,           # bytes, smaller replies aren't compressed
+    'codings': ('zstd', 'br', 'gzip'),  # zstd/br if the module's installed
+}
 
 
 # --------- debug ------------------------------------------------------------
@@ -40,6 +90,8 @@ def mydebug(*data):
 # --------- authentication handlers and callbacks ----------------------------
 
 
+authdb = None                   # set by create_app()
+authcache = None
 basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth('Bearer')
 multi_auth = MultiAuth(basic_auth, token_auth)
@@ -50,10 +102,14 @@ def verify_password(username, password):
     """Verify provided password credentials are valid for user."""
     authdata = None
     mydebug('username/password provided', username)
+    key = authcache.password_key(username, password)
+    if authcache.get(key):
+        return username
     if username:
         authdata = authdb.user_get(username)
     if authdata:
         if check_password_hash(authdata['password'], password):
+            authcache.put(key, username)
             return username
     return False
 
@@ -62,8 +118,13 @@ def verify_password(username, password):
 def verify_token(token):
     """Verify provided token credential is valid."""
     mydebug('token provided', token)
+    key = authcache.token_key(token)
+    username = authcache.get(key)
+    if username:
+        return username
     data = authdb.token_get(token)
     if data and 'username' in data:
+        authcache.put(key, data['username'], authdb.token_remaining(data))
         return data['username']
     return False
 
@@ -75,6 +136,45 @@ def unauthorized():
     return make_response(jsonify({'error': 'Unauthorized access'}), 401)
 
 
+# --------- request scoped database access -----------------------------------
+
+
+def open_unit_of_work():
+    """All DB access of a request shares one pooled connection."""
+    g.unit_of_work = get_pool(DB).unit_of_work()
+
+
+def close_unit_of_work(response):
+    """Commit the request's transaction, roll back on error replies."""
+    unit = g.pop('unit_of_work', None)
+    if unit is not None:
+        # before a streamed body is sent, streams borrow connections again
+        unit.end(commit=response.status_code < 400)
+    return response
+
+
+def abort_unit_of_work(exc=None):
+    """Roll back if the request failed before close_unit_of_work()."""
+    unit = g.pop('unit_of_work', None)
+    if unit is not None:
+        unit.end(commit=False)
+
+
+def transactional(func):
+    """
+    Run a mutating request in one write transaction.
+
+    List it before login_required in 'decorators', so the write lock is
+    taken after authentication.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if request.method in MUTATIONS and 'unit_of_work' in g:
+            g.unit_of_work.begin()
+        return func(*args, **kwargs)
+    return wrapper
+
+
 # --------- restful resource classes -----------------------------------------
 
 
@@ -168,31 +268,45 @@ class ApiTop(Resource):
         return {'message': 'denied'}
 
 
-# --------- main -------------------------------------------------------------
-
+# --------- application factory ----------------------------------------------
 
-# creating the flask app
-app = Flask(__name__)
-# creating authentication objects
-app.config['SECRET_KEY'] = TOKENKEY
 
+def create_app(threads=THREADS) -> Flask:
+    """
+    Create the Flask app with its databases, task manager and resources.
 
-# @app.route('/')
-# @multi_auth.login_required
-# def index():
-#     return "Hello, {}!".format(multi_auth.current_user())
+    Called once per server worker process (gunicorn 'jd_app:create_app()'),
+    so every worker has its own connections, threads and caches.
 
+    :param threads:  request threads per worker, every request may hold a
+                     DB connection until it ends, so the pool gets one per
+                     thread plus POOLSPARE for the background threads
+    """
+    global authdb, authcache    # used by the authentication callbacks
+    # creating the flask app
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = TOKENKEY
+    app.before_request(open_unit_of_work)
+    app.after_request(close_unit_of_work)
+    app.teardown_request(abort_unit_of_work)
 
-# --------- main -------------------------------------------------------------
-
-
-if __name__ == '__main__':
-    authdb = AuthDB(DB)
+    dbpool = get_pool(DB)
+    dbpool.configure(pragmas=DBPRAGMAS, size=threads + POOLSPARE)
+    if GROUPCOMMIT:
+        dbpool.group_commit(window=GROUPCOMMIT)
+    authdb = AuthDB(DB, token_ttl=TOKENTTL)
+    authcache = AuthCache(version=authdb.version, **AUTHCACHE)
     datadb = DataDB(DB, 'resource')
-    taskmgr = TaskMgr()
+    taskmgr = TaskMgr(retention=TASKRETENTION, cache=TASKCACHE, uri=DB,
+                      **TASKLIMITS)
+    engine = EngineClient(PODMANENGINE) if PODMANENGINE else None
+    inventory = Inventory(taskmgr, engine, ttl=INVENTORYTTL)
 
     # creating an API object
     api = Api(app)
+    api.representation('application/json')(output_json)
+    if COMPRESSION:
+        app.after_request(Compression(**COMPRESSION).response)
     # adding the defined resources along with their corresponding urls
     api.add_resource(TopLevel,
                      '/', '/<path:subpath>',
@@ -202,6 +316,22 @@ if __name__ == '__main__':
     api.add_resource(Items,
                      '/api/v1.0/items',
                      '/api/v1.0/items/<int:item_id>',
+                     resource_class_kwargs={
+                         'datadb': datadb,
+                         'decorators': [transactional,
+                                        multi_auth.login_required]
+                         }
+                     )
+    api.add_resource(ItemsBatch,
+                     '/api/v1.0/items/batch',
+                     resource_class_kwargs={
+                         'datadb': datadb,
+                         'decorators': [transactional,
+                                        multi_auth.login_required]
+                         }
+                     )
+    api.add_resource(ItemsExport,
+                     '/api/v1.0/items/export',
                      resource_class_kwargs={
                          'datadb': datadb,
                          'decorators': [multi_auth.login_required]
@@ -214,14 +344,202 @@ if __name__ == '__main__':
     #                      'decorators': [multi_auth.login_required]
     #                      }
     #                  )
+    api.add_resource(Tasks,
+                     '/api/v1.0/tasks',
+                     '/api/v1.0/tasks/<string:uuid>',
+                     resource_class_kwargs={
+                         'taskmgr': taskmgr,
+                         'decorators': [multi_auth.login_required]
+                         }
+                     )
+    api.add_resource(TaskOutput,
+                     '/api/v1.0/tasks/<string:uuid>/output',
+                     resource_class_kwargs={
+                         'taskmgr': taskmgr,
+                         'decorators': [multi_auth.login_required]
+                         }
+                     )
+    api.add_resource(ImageArchive,
+                     '/api/v1.0/podman/images/archive',
+                     resource_class_kwargs={
+                         'decorators': [multi_auth.login_required],
+                         'taskmgr': taskmgr,
+                         'engine': engine
+                         }
+                     )
+    api.add_resource(ImageJobs,
+                     '/api/v1.0/podman/images/jobs/<string:uuid>',
+                     resource_class_kwargs={
+                         'decorators': [multi_auth.login_required],
+                         'taskmgr': taskmgr
+                         }
+                     )
     api.add_resource(PodmanImages,
                      '/api/v1.0/podman/images',
                      '/api/v1.0/podman/images/<string:item_id>',
                      resource_class_kwargs={
                          'decorators': [multi_auth.login_required],
                          'taskmgr': taskmgr,
+                         'engine': engine,
+                         'inventory': inventory,
+                         'buildroot': BUILDROOT,
                          'verbose': 3
                          }
                      )
 
-    app.run(debug=True)
+    app.extensions['jd_app'] = {
+        'dbpool': dbpool,
+        'taskmgr': taskmgr,
+        'engine': engine,
+    }
+    return app
+
+
+def shutdown_app(app, timeout=SHUTDOWNWAIT) -> None:
+    """Let running tasks finish, flush pending writes, close connections."""
+    objects = app.extensions.pop('jd_app', None)
+    if objects is None:
+        return
+    if not objects['taskmgr'].close(timeout=timeout):
+        print("Tasks still running, adopted after restart.")
+    if objects['engine'] is not None:
+        objects['engine'].close()
+    objects['dbpool'].close()
+
+
+# --------- serving ----------------------------------------------------------
+
+
+def serve_gunicorn(bind, workers, threads, timeout) -> None:
+    """Pre-forking gunicorn server, one app per worker process."""
+
+    class Application(BaseApplication):
+        """Embedded gunicorn application."""
+
+        def load_config(self):
+            """Pass our settings instead of reading the command line."""
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            """Build the app in the worker, after the fork."""
+            return create_app(threads=threads)
+
+    def worker_exit(server, worker):
+        shutdown_app(worker.wsgi, timeout)
+
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'graceful_timeout': int(timeout),
+        'timeout': 0,           # event streams are long requests
+        'worker_exit': worker_exit,
+        'accesslog': '-',
+    }
+    Application().run()
+
+
+def bounded(wsgi_app, threads):
+    """Let at most *threads* requests into the app at the same time."""
+    slots = threading.BoundedSemaphore(threads)
+
+    @wraps(wsgi_app)
+    def wrapper(environ, start_response):
+        with slots:
+            return wsgi_app(environ, start_response)
+    return wrapper
+
+
+def serve_threaded(bind, workers, threads, timeout) -> None:
+    """Threaded werkzeug server in this process (without gunicorn)."""
+    host, _, port = bind.rpartition(':')
+    app = create_app(threads=threads)
+    # werkzeug starts a thread per request, the DB pool is sized for threads
+    app.wsgi_app = bounded(app.wsgi_app, threads)
+    server = make_server(host or '127.0.0.1', int(port), app, threaded=True)
+    if workers > 1:
+        print("gunicorn not installed, serving with one worker.")
+    print("Serving on http://{}/".format(bind))
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    shutdown_app(app, timeout)
+
+
+def benchmark(requests=BENCHREQUESTS, auth=None) -> dict:
+    """
+    Time app creation and requests through the test client.
+
+    :param requests:  number of requests to GET /api/v1.0
+    :param auth:      'user:password' for basic auth, None: unauthorized
+    """
+    headers = {}
+    if auth:
+        headers['Authorization'] = 'Basic ' + \
+            base64.b64encode(auth.encode('utf8')).decode('ascii')
+    start = perf_counter()
+    app = create_app()
+    created = perf_counter() - start
+    client = app.test_client()
+    times = []
+    for _ in range(requests):
+        start = perf_counter()
+        resp = client.get('/api/v1.0', headers=headers)
+        times.append(perf_counter() - start)
+    first = times[0]
+    start = perf_counter()
+    shutdown_app(app, 0)
+    stopped = perf_counter() - start
+    times.sort()
+    return {
+        'create_app': created,
+        'first_request': first,
+        'requests': requests,
+        'status': resp.status_code,
+        'avg': sum(times) / requests,
+        'p50': times[requests // 2],
+        'p95': times[int(requests * 0.95)],
+        'shutdown': stopped,
+    }
+
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--dev', action='store_true',
+                        help='flask development server with debugger')
+    parser.add_argument('--bind', default=BIND, help='host:port')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('JD_WORKERS', WORKERS)),
+                        help='worker processes (gunicorn)')
+    parser.add_argument('--threads', type=int,
+                        default=int(os.environ.get('JD_THREADS', THREADS)),
+                        help='threads per worker')
+    parser.add_argument('--timeout', type=float, default=SHUTDOWNWAIT,
+                        help='seconds running tasks get on shutdown')
+    parser.add_argument('--benchmark', type=int, nargs='?',
+                        const=BENCHREQUESTS, metavar='REQUESTS',
+                        help='time startup and requests, then exit')
+    parser.add_argument('--auth', help='user:password for --benchmark')
+    opts = parser.parse_args()
+
+    if opts.benchmark:
+        for key, value in benchmark(opts.benchmark, opts.auth).items():
+            if isinstance(value, float):
+                value = '{:.2f} ms'.format(value * 1000)
+            print('{:14s} {}'.format(key + ':', value))
+    elif opts.dev:
+        create_app().run(debug=True)
+    elif BaseApplication is not None:
+        serve_gunicorn(opts.bind, opts.workers, opts.threads, opts.timeout)
+    else:
+        serve_threaded(opts.bind, opts.workers, opts.threads, opts.timeout)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+"""
+ASGI application for the task and podman image endpoints.
+
+Same API as jd_app.py for these endpoints, but requests are coroutines
+and commands run through AsyncTaskMgr: a request waiting for podman (or
+for a task, GET /tasks/<uuid>?wait=) doesn't hold a worker thread, so one
+process can keep thousands of operations in flight.
+
+    $ python3 -m pip install uvicorn
+    $ python3 jd_asgi.py --bind 127.0.0.1:5001
+    $ uvicorn --factory jd_asgi:create_app --port 5001
+"""
+
+import re
+import json
+import shlex
+import base64
+import asyncio
+import argparse
+from urllib.parse import parse_qs
+from werkzeug.http import parse_etags, quote_etag
+from werkzeug.security import check_password_hash
+
+from jd_lib import AsyncTaskMgr, AuthCache, AuthDB, QueueFullError
+from jd_modules.conditional import make_etag
+from jd_modules.podman.images import BUILDROOT, IMAGENAME, LABELFILTER, \
+    build_context, registry_reference
+try:
+    import uvicorn
+except ImportError:         # optional, any ASGI server will do
+    uvicorn = None
+
+DB = 'file:app.db'
+BIND = '127.0.0.1:5001'
+AUTHCACHE = {'size': 1024, 'ttl': 300}   # verified credentials cache
+TOKENTTL = None     # seconds a token is valid, None: forever
+TASKLIMITS = {'max_running': 256, 'max_queue': 4096}
+CMDTIMEOUT = 30     # seconds to wait for a command run in the foreground
+MAXWAIT = 60        # max. seconds a status request may wait for a task
+SHUTDOWNWAIT = 30   # seconds running tasks get on shutdown
+MAXBODY = 1048576   # bytes of a request body, larger ones get 413
+PREFIX = '/api/v1.0'
+
+# --------- request / response helpers ---------------------------------------
+
+
+class HTTPError(Exception):
+    """Error reply: status code and message."""
+
+    def __init__(self, status, message, headers=None):
+        """Keep status and extra headers for the reply."""
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Request():
+    """The parts of an ASGI http scope the handlers need."""
+
+    def __init__(self, scope, body=b''):
+        """Decode path, query string, headers and body."""
+        self.method = scope['method']
+        self.path = scope['path']
+        self.multiargs = parse_qs(scope['query_string'].decode('latin1'))
+        self.args = {key: values[-1]
+                     for key, values in self.multiargs.items()}
+        self.headers = {key.decode('latin1').lower(): value.decode('latin1')
+                        for key, value in scope['headers']}
+        self.body = body
+        self.user = None
+
+    def json(self) -> dict:
+        """Request body as JSON object, 400 if it isn't one."""
+        try:
+            data = json.loads(self.body or b'{}')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Bad request")
+        return data
+
+    def number(self, name, default=0) -> float:
+        """Numeric query parameter."""
+        try:
+            return float(self.args.get(name, default))
+        except ValueError as err:
+            raise HTTPError(400, "Bad request") from err
+
+
+async def send_json(send, status, data, headers=None) -> None:
+    """Send a complete JSON reply (no body with 304)."""
+    body = json.dumps(data).encode('utf8') if status != 304 else b''
+    header_list = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode('ascii'))]
+    for key, value in (headers or {}).items():
+        header_list.append((key.lower().encode('latin1'),
+                            str(value).encode('latin1')))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': header_list})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive, limit=MAXBODY) -> bytes:
+    """Collect the request body, 413 if it's longer than limit bytes."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if len(body) > limit:
+            raise HTTPError(413, "Request body too large, max. {} bytes"
+                            .format(limit))
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+# --------- application ------------------------------------------------------
+
+
+class App():
+    """Minimal ASGI application, objects are created on lifespan startup."""
+
+    def __init__(self, verbose=0):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:  set verbosity level for debug and logging
+        """
+        self.verbose = verbose
+        self.taskmgr = None
+        self.authdb = None
+        self.authcache = None
+        self._starting = asyncio.Lock()
+        self.routes = [
+            ('GET', r'/tasks', self.tasks),
+            ('GET', r'/tasks/(?P<uuid>[\w-]+)', self.task),
+            ('GET', r'/tasks/(?P<uuid>[\w-]+)/output', self.task_output),
+            ('GET', r'/podman/images', self.images),
+            ('GET', r'/podman/images/(?P<item_id>[^/]+)', self.images),
+            ('POST', r'/podman/images', self.image_job),
+        ]
+        self.routes = [(method, re.compile(PREFIX + pattern + '$'), handler)
+                       for method, pattern, handler in self.routes]
+
+    async def startup(self) -> None:
+        """Create databases and the task manager on the event loop."""
+        self.authdb = await asyncio.to_thread(AuthDB, DB, TOKENTTL)
+        self.authcache = AuthCache(version=self.authdb.version, **AUTHCACHE)
+        self.taskmgr = AsyncTaskMgr(verbose=self.verbose, uri=DB,
+                                    **TASKLIMITS)
+
+    async def shutdown(self) -> None:
+        """Give running tasks time to finish."""
+        if self.taskmgr is not None and \
+           not await self.taskmgr.close(timeout=SHUTDOWNWAIT):
+            print("Tasks still running, adopted after restart.")
+
+    async def __call__(self, scope, receive, send):
+        """ASGI entry point."""
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send) -> None:
+        try:
+            if self.taskmgr is None:
+                # server without lifespan support, start up only once
+                async with self._starting:
+                    if self.taskmgr is None:
+                        await self.startup()
+            request = Request(scope)
+            handler, params = self._route(request)
+            request.user = await self._authenticate(request)
+            # only authenticated requests get their body read
+            request.body = await read_body(receive, MAXBODY)
+            status, data, headers = await handler(request, **params)
+        except HTTPError as err:
+            status, data, headers = err.status, {"error": str(err)}, \
+                err.headers
+        except Exception as err:     # e.g. sqlite3.OperationalError
+            print("Request failed:", repr(err))
+            status, data, headers = 500, {"error": "Internal server error"}, \
+                None
+        await send_json(send, status, data, headers)
+
+    def _route(self, request) -> tuple:
+        """Handler and path parameters of a request."""
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if match:
+                if method == request.method:
+                    return handler, match.groupdict()
+                allowed = True
+        if allowed:
+            raise HTTPError(405, "Method Not Allowed")
+        raise HTTPError(404, "Not found " + request.path)
+
+    async def _authenticate(self, request) -> str:
+        """Basic or bearer token authentication, as in jd_app.py."""
+        auth = request.headers.get('authorization', '')
+        scheme, _, credentials = auth.partition(' ')
+        username = None
+        if scheme.lower() == 'basic':
+            try:
+                username, _, password = base64.b64decode(
+                    credentials).decode('utf8').partition(':')
+            except ValueError:
+                username = None
+            if username:
+                username = await self._verify_password(username, password)
+        elif scheme.lower() == 'bearer':
+            username = await self._verify_token(credentials)
+        if not username:
+            raise HTTPError(401, "Unauthorized access")
+        return username
+
+    async def _cached(self, key):
+        """Cache lookup, off the loop: it checks the auth table version."""
+        return await asyncio.to_thread(self.authcache.get, key)
+
+    async def _verify_password(self, username, password) -> str:
+        key = self.authcache.password_key(username, password)
+        if await self._cached(key):
+            return username
+        authdata = await asyncio.to_thread(self.authdb.user_get, username)
+        # password hashing is slow on purpose, keep it off the event loop
+        if authdata and await asyncio.to_thread(
+                check_password_hash, authdata['password'], password):
+            self.authcache.put(key, username)
+            return username
+        return None
+
+    async def _verify_token(self, token) -> str:
+        key = self.authcache.token_key(token)
+        username = await self._cached(key)
+        if username:
+            return username
+        data = await asyncio.to_thread(self.authdb.token_get, token)
+        if data and 'username' in data:
+            self.authcache.put(key, data['username'],
+                               self.authdb.token_remaining(data))
+            return data['username']
+        return None
+
+# --------- handlers ---------------------------------------------------------
+
+    async def tasks(self, request) -> tuple:
+        """GET /tasks: running tasks and scheduler statistics."""
+        return 200, {"tasks": await self.taskmgr.status(),
+                     "scheduler": self.taskmgr.stats()}, None
+
+    async def task(self, request, uuid) -> tuple:
+        """GET /tasks/<uuid>: status, *wait* seconds for the task to end."""
+        timeout = max(0.0, min(request.number('wait'), MAXWAIT))
+        verbose = bool(request.number('verbose'))
+        if timeout:
+            status = await self.taskmgr.wait(uuid, timeout=timeout,
+                                             verbose=verbose)
+        else:
+            status = await self.taskmgr.status(uuid, verbose=verbose)
+        if status is None:
+            raise HTTPError(404, "Not found " + request.path)
+        return 200, {"task": status}, None
+
+    async def task_output(self, request, uuid) -> tuple:
+        """GET /tasks/<uuid>/output: output from a byte offset on."""
+        stream = request.args.get('stream', 'stdout')
+        if stream not in ('stdout', 'stderr'):
+            raise HTTPError(400, "Bad request")
+        chunk = self.taskmgr.output(uuid, stream,
+                                    max(0, int(request.number('offset'))))
+        if chunk is None:
+            raise HTTPError(404, "Not found " + request.path)
+        return 200, {"output": chunk}, None
+
+    async def images(self, request, item_id=None) -> tuple:
+        """GET /podman/images: image list, by id and ?label= filters."""
+        labels = request.multiargs.get('label', [])
+        if (item_id is not None and not re.match(IMAGENAME, item_id)) or \
+           not all(re.match(LABELFILTER, label) for label in labels):
+            raise HTTPError(400, "Bad request")
+        options = "image list --format json"
+        if item_id is not None:
+            options += " --filter id={}".format(item_id)
+        for label in labels:
+            options += " --filter label={}".format(label)
+        try:
+            status = await self.taskmgr.run(
+                {"command": "podman", "options": options},
+                timeout=CMDTIMEOUT, readonly=True)
+        except QueueFullError as err:
+            raise HTTPError(429, "Too many requests",
+                            {"Retry-After": "1"}) from err
+        if status is None:
+            raise HTTPError(400, "Bad request")
+        if status['RC'] == '':
+            return 200, {"images": [{'error': 'command still running'}]}, \
+                None
+        if status['RC'] != '0':
+            return 200, {"images": [{'error': 'command failed',
+                                     'RC': status['RC']}]}, None
+        try:
+            images = json.loads(status['output'] or '[]')
+        except ValueError:
+            return 200, {"images": [{'error': 'invalid output',
+                                     'output': status['output']}]}, None
+        etag = make_etag(images)
+        headers = {"ETag": quote_etag(etag)}
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(
+                etag):
+            return 304, {}, headers
+        return 200, {"images": images}, headers
+
+    async def image_job(self, request) -> tuple:
+        """POST /podman/images: pull, push or build in the background."""
+        args = request.json()
+        action = args.get('action')
+        name = registry_reference(args.get('name'))
+        destination = registry_reference(args.get('destination'))
+        if action not in ('pull', 'push', 'build') or name is None or \
+           (args.get('destination') and destination is None):
+            raise HTTPError(400, "Bad request")
+        if action == 'pull':
+            options = "pull {}".format(name)
+        elif action == 'push':
+            options = "push {} {}".format(
+                name, 'docker://' + destination if destination else '')
+        else:
+            context = build_context(args.get('context'), BUILDROOT)
+            if context is None:
+                raise HTTPError(400, "Bad request")
+            options = "build -t {} {}".format(name, shlex.quote(context))
+        try:
+            uuid = await self.taskmgr.add({"command": "podman",
+                                           "options": options})
+        except QueueFullError as err:
+            raise HTTPError(429, "Too many requests",
+                            {"Retry-After": "1"}) from err
+        if uuid is None:
+            raise HTTPError(400, "Bad request")
+        location = '{}/tasks/{}'.format(PREFIX, uuid)
+        return 202, {"task": uuid, "action": action,
+                     "progress": location}, {"Location": location}
+
+
+def create_app(verbose=0) -> App:
+    """ASGI application factory (uvicorn --factory jd_asgi:create_app)."""
+    return App(verbose=verbose)
+
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--bind', default=BIND, help='host:port')
+    opts = parser.parse_args()
+    if uvicorn is None:
+        parser.exit(1, "uvicorn is not installed, run 'jd_asgi:create_app' "
+                       "with any ASGI server.\n")
+    host, _, port = opts.bind.rpartition(':')
+    uvicorn.run(create_app(), host=host or '127.0.0.1', port=int(port),
+                lifespan='on', timeout_graceful_shutdown=SHUTDOWNWAIT)
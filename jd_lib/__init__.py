@@ -2,14 +2,32 @@
 
 """Import submodules into one namespace."""
 from .authdb import AuthDB
+from .authcache import AuthCache
 from .datadb import DataDB
 from .keyvaluedb import KeyValueDB
-from .taskmgr import TaskMgr
+from .jobdb import JobDB
+from .taskmgr import TaskMgr, QueueFullError
+from .asynctaskmgr import AsyncTaskMgr
 from .cmdtask import CmdTask
+from .retention import Retention
+from .resultcache import ResultCache
+from .supervisor import Supervisor
+from .connpool import ConnPool, UnitOfWork, get_pool, pool_stats
 
 if True is False:
     TestInit = AuthDB()
+    TestInit = AuthCache()
     TestInit = DataDB()
     TestInit = KeyValueDB()
+    TestInit = JobDB()
     TestInit = TaskMgr()
+    TestInit = QueueFullError(0)
+    TestInit = AsyncTaskMgr()
     TestInit = CmdTask()
+    TestInit = Retention()
+    TestInit = ResultCache()
+    TestInit = Supervisor()
+    TestInit = ConnPool()
+    TestInit = UnitOfWork(None)
+    TestInit = get_pool()
+    TestInit = pool_stats()
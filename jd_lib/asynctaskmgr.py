@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+"""
+Task manager for asyncio applications.
+
+Same jobs, job table and status reports as TaskMgr, but the commands run
+through asyncio.create_subprocess_exec and waiting for a task is a
+coroutine: no thread is blocked per running or waited for task, so one
+process can keep thousands of tasks in flight. Only 'cmd' tasks with
+output captured through pipes are supported.
+"""
+
+import os
+import json
+import shlex
+import signal
+import asyncio
+from time import time
+from uuid import uuid4
+from .jobdb import JobDB
+from .cmdtask import CmdTask, READSIZE
+from .ringbuffer import RingBuffer, BUFSIZE
+from .taskmgr import QueueFullError
+
+MAXRUNNING = 256    # max. number of tasks running at the same time
+MAXQUEUE = 4096     # max. number of tasks waiting for a free slot
+KEEPDONE = 256      # finished tasks kept in memory (captured output)
+
+# --------- task manager -----------------------------------------------------
+
+
+class AsyncTaskMgr():
+    """Start, watch and wait for command tasks on an event loop."""
+
+    verbose = 0
+
+    def __init__(self, verbose=None, max_running=MAXRUNNING,
+                 max_queue=MAXQUEUE, uri=None):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:      set verbosity level for debug and logging
+        :param max_running:  max. number of concurrently running tasks
+        :param max_queue:    max. number of queued tasks, then add() fails
+        :param uri:          database DSN of the job table
+        """
+        if verbose:
+            self.verbose = verbose
+        self.joblist = JobDB(table='jobs', uri=uri)
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(max_running)
+        self._tasks = {}        # uuid -> CmdTask
+        self._done = {}         # uuid -> asyncio.Event
+        self._finished = []     # uuids of finished tasks, oldest first
+        self._inflight = {}     # read-only commands -> Future
+        self._runners = set()   # asyncio tasks running _execute()
+        self._waiting = 0
+        self._running = 0
+        self._stats = {'queued': 0, 'started': 0, 'finished': 0,
+                       'failed': 0, 'coalesced': 0}
+        self.taskdir = os.sep.join(['.', 'tasks'])
+        os.makedirs(self.taskdir, exist_ok=True)
+
+    async def _job_update(self, job) -> None:
+        """Store/update job in DB, without blocking the event loop."""
+        if job['status'] not in ('created', 'running') and \
+           not job.get('finished'):
+            job['finished'] = time()
+        await asyncio.to_thread(self.joblist.set, dict(job))
+
+    async def add(self, params=None) -> str:
+        """
+        Add new task, it starts as soon as there's a free slot.
+
+        :param params:  task parameters (command, options, ...)
+        :returns str:   task uuid, None if the task is invalid
+        :raises QueueFullError: if max_queue tasks are waiting already
+        """
+        if params is None:
+            return None
+        job = {
+            "uuid": str(uuid4()),
+            "type": 'cmd',
+            "params": dict(params),
+            "status": 'created',
+            "created": time(),
+            "owner": os.getpid()
+        }
+        job["location"] = os.sep.join([self.taskdir, job['uuid']])
+        cmd_task = CmdTask(job)
+        if not cmd_task.check():
+            return None
+        if self._waiting >= self.max_queue:
+            raise QueueFullError(self._waiting)
+        self._waiting += 1
+        self._stats['queued'] += 1
+        self._tasks[job['uuid']] = cmd_task
+        self._done[job['uuid']] = asyncio.Event()
+        await self._job_update(job)
+        runner = asyncio.create_task(self._execute(cmd_task))
+        # the event loop only keeps weak references to tasks
+        self._runners.add(runner)
+        runner.add_done_callback(self._runners.discard)
+        return job['uuid']
+
+    async def _execute(self, cmd_task) -> None:
+        """Wait for a slot, run the task and record its result."""
+        job = cmd_task.task
+        exitcode = None
+        try:
+            try:
+                await self._slots.acquire()
+            finally:
+                # also when cancelled while waiting for the slot
+                self._waiting -= 1
+            self._running += 1
+            try:
+                exitcode = await self._spawn(cmd_task)
+            except Exception as err:
+                # finished as failed below, the slot must be freed
+                print("Task start failed:", repr(err))
+            finally:
+                self._running -= 1
+                self._slots.release()
+        finally:
+            if exitcode is None:
+                # cancelled (e.g. on shutdown)
+                for buf in (cmd_task.stdout, cmd_task.stderr):
+                    if buf is not None:
+                        buf.close()
+            else:
+                cmd_task._result(exitcode)
+            if exitcode is None:
+                job['status'] = 'failed'
+            elif job['status'] == 'running':
+                job['status'] = cmd_task.status()['status']
+            else:
+                # not started (command not found), RC 127 as from a shell
+                job['status'] = 'finished'
+            self._stats['finished' if job['status'] == 'finished'
+                        else 'failed'] += 1
+            await self._job_update(job)
+            self._retire(job['uuid'])
+
+    async def _spawn(self, cmd_task) -> int:
+        """Run the command, capture its output, return the exit code."""
+        job = cmd_task.task
+        cmd_task._defaults()
+        params = job['params']
+        cmd_task.stdout = RingBuffer(int(params.get('spill', BUFSIZE)),
+                                     spill=job['out'])
+        cmd_task.stderr = RingBuffer(int(params.get('spill', BUFSIZE)),
+                                     spill=job['err'])
+        env = dict(os.environ)
+        path = ":{}".format(params['path']) if 'path' in params else ""
+        env['PATH'] = '/usr/bin{}:/bin:{}'.format(path, env.get('PATH', ''))
+        argv = [params['command']] + shlex.split(params['options'])
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *argv, env=env, stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        except OSError as err:
+            # same exit code as a shell for 'command not found'
+            cmd_task.stderr.write(str(err).encode('utf8'))
+            return 127
+        job['status'] = 'running'
+        job['pid'] = proc.pid
+        job['started'] = time()
+        self._stats['started'] += 1
+        await self._job_update(job)
+        pumps = asyncio.gather(
+            self._pump(proc.stdout, cmd_task.stdout),
+            self._pump(proc.stderr, cmd_task.stderr),
+            self._feed(proc.stdin, params['input']))
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.shield(proc.wait()),
+                                   float(params['timeout']))
+        except asyncio.TimeoutError:
+            timed_out = True
+            self._signal(proc, params['signal'])
+            grace = float(params['kill']) - float(params['timeout'])
+            try:
+                await asyncio.wait_for(asyncio.shield(proc.wait()),
+                                       max(grace, 0))
+            except asyncio.TimeoutError:
+                self._signal(proc, 'KILL')
+        exitcode = await proc.wait()
+        await pumps
+        if timed_out:
+            return 124
+        if exitcode < 0:
+            return 128 - exitcode
+        return exitcode
+
+    @staticmethod
+    def _signal(proc, signame) -> None:
+        try:
+            proc.send_signal(signal.Signals['SIG' + signame])
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    async def _pump(stream, buf) -> None:
+        """Copy a pipe into an output buffer until EOF."""
+        while True:
+            chunk = await stream.read(READSIZE)
+            if not chunk:
+                break
+            buf.write(chunk)
+
+    @staticmethod
+    async def _feed(stream, data) -> None:
+        """Write task input to the process and close its stdin."""
+        try:
+            if data:
+                stream.write(data.encode('utf8'))
+                await stream.drain()
+            stream.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _retire(self, uuid) -> None:
+        """Wake waiters, keep only the last KEEPDONE tasks in memory."""
+        self._done[uuid].set()
+        self._finished.append(uuid)
+        while len(self._finished) > KEEPDONE:
+            old = self._finished.pop(0)
+            self._tasks.pop(old, None)
+            self._done.pop(old, None)
+
+    async def wait(self, uuid=None, timeout=None, verbose=False) -> dict:
+        """
+        Wait until a task has finished, then fetch its status.
+
+        :param uuid:     task id
+        :param timeout:  max. seconds to wait, None waits forever
+        :param verbose:  include output and job description
+        :returns dict:   task status as from status()
+        """
+        done = self._done.get(uuid)
+        if done is not None:
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.status(uuid, verbose=verbose)
+
+    async def run(self, params=None, timeout=None, readonly=False) -> dict:
+        """
+        Run a task, wait for it and return its status.
+
+        Concurrent identical read-only commands share one task.
+
+        :param params:    task parameters (command, options, ...)
+        :param timeout:   max. seconds to wait for the task
+        :param readonly:  command has no side effects, may be shared
+        :returns dict:    task status as from status(verbose=True)
+        :raises QueueFullError: if max_queue tasks are waiting already
+        """
+        if not readonly:
+            return await self._run(params, timeout)
+        key = json.dumps(params, sort_keys=True)
+        future = self._inflight.get(key)
+        if future is not None:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._run(params, timeout))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _run(self, params, timeout) -> dict:
+        uuid = await self.add(params)
+        if uuid is None:
+            return None
+        return await self.wait(uuid, timeout=timeout, verbose=True)
+
+    async def status(self, uuid=None, verbose=False) -> dict:
+        """Status of a task, without uuid the uuids of running tasks."""
+        if uuid is None:
+            return [uuid for uuid, cmd_task in self._tasks.items()
+                    if cmd_task.task['status'] == 'running']
+        cmd_task = self._tasks.get(uuid)
+        if cmd_task is not None:
+            job = cmd_task.task
+        else:
+            job = await asyncio.to_thread(self.joblist.get, uuid)
+            if job is None:
+                return None
+            cmd_task = CmdTask(job)
+        taskstate = cmd_task.status(verbose=verbose)
+        if verbose:
+            taskstate['job'] = dict(job)
+        return taskstate
+
+    def output(self, uuid=None, stream='stdout', offset=0,
+               size=READSIZE) -> dict:
+        """Captured output of a task held in memory, None if unknown."""
+        cmd_task = self._tasks.get(uuid)
+        if cmd_task is None or cmd_task.stdout is None:
+            return None
+        return cmd_task.output(stream, offset, size)
+
+    def stats(self) -> dict:
+        """Report queue length, running tasks and counters."""
+        stats = dict(self._stats)
+        stats.update({
+            'running': self._running,
+            'queued': self._waiting,
+            'max_running': self.max_running,
+            'max_queue': self.max_queue,
+        })
+        return stats
+
+    async def close(self, timeout=None) -> bool:
+        """Refuse new tasks, wait up to timeout seconds for running ones."""
+        self.max_queue = 0
+        pending = [done.wait() for done in self._done.values()
+                   if not done.is_set()]
+        if not pending:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.gather(*pending), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    from time import perf_counter
+
+    async def demo():
+        """Run many sleeping commands concurrently."""
+        x = AsyncTaskMgr()
+        start = perf_counter()
+        uuids = [await x.add({'command': 'sleep', 'options': '1'})
+                 for _ in range(200)]
+        results = await asyncio.gather(*[x.wait(uuid) for uuid in uuids])
+        print("200 tasks:  {:.2f} s".format(perf_counter() - start))
+        print("status:    ", {r['status'] for r in results})
+        print("echo:      ", (await x.run({'command': 'echo',
+                                           'options': 'hello world'},
+                                          readonly=True))['output'])
+        print("stats:     ", x.stats())
+
+    asyncio.run(demo())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+Credential cache for the authentication callbacks.
+
+Verifying a password runs the deliberately slow PBKDF2 hash, verifying a
+token runs a DB query. Successful verifications are kept in a bounded LRU
+cache with a time to live. Passwords and tokens are never stored, entries
+are keyed by a salted digest. The whole cache is dropped as soon as the
+version of the auth table changes.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+CACHESIZE = 1024    # max. number of cached credentials
+CACHETTL = 300      # seconds a verified credential stays valid
+CHECKTIME = 1.0     # seconds between auth table version checks
+
+# --------- credential cache -------------------------------------------------
+
+
+class AuthCache():
+    """Bounded LRU/TTL cache of verified credentials."""
+
+    def __init__(self, size=CACHESIZE, ttl=CACHETTL, version=None,
+                 check=CHECKTIME):
+        """
+        Update internal class default values if needed.
+
+        :param size:     max. number of entries
+        :param ttl:      seconds until an entry expires
+        :param version:  callable returning the auth table version
+        :param check:    seconds between calls of *version*
+        """
+        self._size = size
+        self._ttl = ttl
+        self._version = version
+        self._check = check
+        self._checked = 0.0
+        self._seen = None
+        self._salt = os.urandom(16)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def _digest(self, *parts) -> str:
+        """Salted digest of the credential parts."""
+        hasher = hashlib.sha256(self._salt)
+        for part in parts:
+            hasher.update((part or '').encode('utf8'))
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def password_key(self, username, password) -> tuple:
+        """Cache key for a username/password pair."""
+        return ('password', username, self._digest(username, password))
+
+    def token_key(self, token) -> tuple:
+        """Cache key for a bearer token."""
+        return ('token', self._digest(token))
+
+    def _validate(self) -> None:
+        """Drop all entries if the auth table changed meanwhile."""
+        if self._version is None:
+            return
+        now = monotonic()
+        if now - self._checked < self._check:
+            return
+        self._checked = now
+        current = self._version()
+        if current != self._seen:
+            if self._seen is not None:
+                self.clear()
+            self._seen = current
+
+    def get(self, key):
+        """Return cached value for key or None."""
+        self._validate()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value, ttl=None) -> None:
+        """
+        Store a verified credential.
+
+        :param ttl:  seconds the credential itself stays valid (e.g. a
+                     token about to expire), caps the cache TTL
+        """
+        if ttl is None or ttl > self._ttl:
+            ttl = self._ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def clear(self) -> None:
+        """Invalidate all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._counters['invalidations'] += 1
+
+    def stats(self) -> dict:
+        """Report hit/miss counters and current size."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+        return stats
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    x = AuthCache(size=2, ttl=60)
+    x.put(x.password_key('admin', 'password'), 'admin')
+    print("hit:     ", x.get(x.password_key('admin', 'password')))
+    print("miss:    ", x.get(x.password_key('admin', 'wrong')))
+    print("stats:   ", x.stats())
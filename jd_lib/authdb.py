@@ -3,13 +3,18 @@
 """
 Simple interface to a minimalistic authentication database store.
 
-Data is stored in a table in SQLite3.
+Data is stored in a table in SQLite3. Tokens are looked up through an
+index on (token, token_ts); with a token TTL set, expired tokens are
+filtered out by the query itself.
 """
 
 import sqlite3
 import datetime
+import secrets
 from pprint import pprint
 from werkzeug.security import generate_password_hash
+from .connpool import get_pool
+from . import tableversion
 
 DEBUGIT = False  # True # False
 TOKENKEY = 'eyJhbGciOiJIUzUxMiIsImlhdCI6MTU5MzM0MzQxMSwiZXhwIjoxNTkzMzQ3MDEx9Q'
@@ -38,54 +43,67 @@ def dict_factory(cursor, row) -> dict:
 class AuthDB():
     """Extremely simple authentication DB object class."""
 
-    def __init__(self, uri=None):
-        """Update internal class default values if needed."""
+    def __init__(self, uri=None, token_ttl=None):
+        """
+        Update internal class default values if needed.
+
+        :param uri:        database DSN
+        :param token_ttl:  seconds a token is valid after token_ts,
+                           None for tokens that never expire
+        """
         self._db = uri or 'app.db'
         self._table = "auth"
-        try:
-            conn = sqlite3.connect(self._db, uri=True, timeout=1000)
-            mydebug("SQLite version", sqlite3.version)
-        except sqlite3.OperationalError as err:
-            print('Database does not exist, creating it.')
-            mydebug(err)
-        finally:
-            if conn:
-                conn.close()
+        self._token_ttl = token_ttl
+        self._pool = get_pool(self._db)
+        mydebug("SQLite version", sqlite3.sqlite_version)
         self._create()
 
     def _create(self) -> bool:
         """Create table (if needed) and add at least one 'admin' user."""
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = '''CREATE TABLE IF NOT EXISTS auth (
-                    username TEXT PRIMARY KEY NOT NULL,
-                    password TEXT,
-                    token TEXT,
-                    token_ts timestamp
-                );'''
-        cur.execute(query)
-        query = 'SELECT username FROM auth;'
-        user = cur.execute(query).fetchone()
-        if not user:
-            default = '''INSERT INTO auth (username,password,token,token_ts)
-                            VALUES (?,?,?,?);'''
-            param = ["admin",
-                     generate_password_hash("password"),
-                     str(TOKENKEY),
-                     datetime.datetime.now()
-                     ]
-            cur.execute(default, param)
-        conn.commit()
-        conn.close()
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            query = '''CREATE TABLE IF NOT EXISTS auth (
+                        username TEXT PRIMARY KEY NOT NULL,
+                        password TEXT,
+                        token TEXT,
+                        token_ts timestamp
+                    );'''
+            cur.execute(query)
+            query = 'SELECT username FROM auth;'
+            user = cur.execute(query).fetchone()
+            if not user:
+                default = '''INSERT INTO auth
+                                (username,password,token,token_ts)
+                                VALUES (?,?,?,?);'''
+                param = ["admin",
+                         generate_password_hash("password"),
+                         str(TOKENKEY),
+                         self._timestamp()
+                         ]
+                cur.execute(default, param)
+            # also migrates existing databases, index is created on startup
+            query = '''CREATE INDEX IF NOT EXISTS auth_token_idx
+                        ON auth (token, token_ts);'''
+            cur.execute(query)
+            tableversion.track(conn, self._table)
         return True
 
+    @staticmethod
+    def _timestamp(delta=0) -> str:
+        """Timestamp string as stored in token_ts (now - delta seconds)."""
+        stamp = datetime.datetime.now() - datetime.timedelta(seconds=delta)
+        return stamp.isoformat(sep=' ')
+
+    def version(self) -> int:
+        """Fetch change counter of the auth table (for caches)."""
+        with self._pool.connection() as conn:
+            return tableversion.version(conn, self._table)
+
     def user_list(self) -> list:
         """Get full list of user names from DB."""
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = 'SELECT DISTINCT username FROM auth;'
-        users = cur.execute(query).fetchall()[0]
-        conn.close()
+        with self._pool.connection() as conn:
+            query = 'SELECT DISTINCT username FROM auth;'
+            users = conn.execute(query).fetchall()[0]
         # mydebug("users",users)
         if users:
             return users
@@ -93,27 +111,64 @@ class AuthDB():
 
     def user_get(self, username) -> dict:
         """Fetch credentals for given user from DB."""
-        conn = sqlite3.connect(self._db, uri=True)
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
-        query = 'SELECT * FROM auth WHERE username=?;'
-        authdata = cur.execute(query, [username, ]).fetchone()
-        conn.close()
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            query = 'SELECT * FROM auth WHERE username=?;'
+            authdata = cur.execute(query, [username, ]).fetchone()
         mydebug("authdata", authdata)
         return authdata
 
-    def token_get(self, token) -> dict:
-        """Fetch user info for given token from DB."""
-        conn = sqlite3.connect(self._db, uri=True)
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
-        # we don't check the token timestamp
-        query = 'SELECT * FROM auth WHERE token=?;'
-        authdata = cur.execute(query, [token, ]).fetchone()
-        conn.close()
+    def token_get(self, token, max_age=None) -> dict:
+        """
+        Fetch user info for given token from DB.
+
+        :param token:    bearer token
+        :param max_age:  seconds since token_ts, defaults to the token TTL
+        :returns dict:   auth entry or None if unknown or expired
+        """
+        if max_age is None:
+            max_age = self._token_ttl
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            if max_age is None:
+                query = 'SELECT * FROM auth WHERE token=?;'
+                param = [token, ]
+            else:
+                query = 'SELECT * FROM auth WHERE token=? AND token_ts>=?;'
+                param = [token, self._timestamp(max_age)]
+            authdata = cur.execute(query, param).fetchone()
         mydebug("authdata", authdata)
         return authdata
 
+    def token_remaining(self, authdata) -> float:
+        """
+        Seconds until the token of an auth entry (from token_get) expires.
+
+        :returns float:  None for tokens that never expire, 0 if the
+                         timestamp can't be read
+        """
+        if self._token_ttl is None:
+            return None
+        try:
+            stamp = datetime.datetime.fromisoformat(str(authdata['token_ts']))
+        except (KeyError, ValueError):
+            return 0.0
+        age = (datetime.datetime.now() - stamp).total_seconds()
+        return max(0.0, self._token_ttl - age)
+
+    def token_set(self, username, token=None) -> str:
+        """Issue (or renew) the token of a user, returns the token."""
+        if token is None:
+            token = secrets.token_urlsafe(48)
+        with self._pool.connection() as conn:
+            query = 'UPDATE auth SET token=?, token_ts=? WHERE username=?;'
+            cur = conn.execute(query, [token, self._timestamp(), username])
+            if not cur.rowcount:
+                return None
+        return token
+
 
 # --------- main -------------------------------------------------------------
 
@@ -4,13 +4,32 @@
 Task for running command strings (Lunux CLI).
 
 CmdTask is executing tasks and fetching results.
+
+Two execution modes are supported (task parameter 'capture'):
+- 'pipe' (default) runs the command directly and captures stdout/stderr
+  through pipes into bounded in-memory buffers. Files are only written
+  for output above the buffer limit ('spill' bytes) or when 'durable'
+  is requested.
+- 'file' writes a shell wrapper script and redirects stdin, stdout,
+  stderr and the exit code to files under the task location.
+
+output() returns captured output from a byte offset on, so clients can
+tail a task without fetching the same output again and again.
 """
 
 import os
+import re
 import stat
+import shlex
+import signal
 import subprocess
-import re
-from time import sleep
+import threading
+from .ringbuffer import RingBuffer, BUFSIZE, read_file, utf8_cut
+
+CAPTURE = 'pipe'    # default execution mode, 'pipe' or 'file'
+READSIZE = 65536    # bytes read from a pipe at a time
+POLLTIME = 0.5      # seconds between checks of file based output
+STREAMS = ('stdout', 'stderr')
 
 # --------- task object ------------------------------------------------------
 
@@ -20,8 +39,14 @@ class CmdTask():
 
     badchars = {
         'command': r"[^\d\w\t /.,]",
-        'options': r"[^\d\w\t /.,'\"]",
+        'options': r"[^\d\w\t /.,'\"=:@-]",
     }
+    verbose = 0
+    task = None
+    proc = None
+    rc = None
+    stdout = None
+    stderr = None
 
     def __init__(self, newtask=None, verbose=None):
         """Update internal class default values if needed."""
@@ -37,6 +62,10 @@ class CmdTask():
         self.task['err'] = '.'.join([self.task["location"], 'stderr'])
         self.task['res'] = '.'.join([self.task["location"], 'result'])
         self.task['cmdfile'] = '.'.join([self.task["location"], 'cmd'])
+        self.done = threading.Event()
+        self.timed_out = False
+        self._threads = []
+        self._timers = []
 
     def readfile(self, file) -> str:
         """Read from file return contents or empty string."""
@@ -65,10 +94,10 @@ class CmdTask():
                 return False
         return True
 
-    def run(self) -> int:
-        """Run a task."""
+    def check(self) -> bool:
+        """Sanity check of command and options, before queueing a task."""
         if 'command' not in self.task['params']:
-            return None
+            return False
         if ('options' not in self.task['params']) or \
            (self.task['params']['options'] is None):
             self.task['params']['options'] = ''
@@ -78,17 +107,25 @@ class CmdTask():
         if match is not None:
             print("Error: <command> pos: {}, ".format(match.start())
                   + "invalid char '{}'".format(match.group(0)))
-            return None
+            return False
         match = re.search(self.badchars['options'],
                           self.task['params']['options'])
         if match is not None:
             print("Error: <options> pos: {}, ".format(match.start())
                   + "invalid char '{}'".format(match.group(0)))
-            return None
-        # set some fallback values
+            return False
+        try:
+            shlex.split(self.task['params']['options'])
+        except ValueError as err:
+            # e.g. unbalanced quotes, pipe mode couldn't start the task
+            print("Error: <options> {}".format(err))
+            return False
+        return True
+
+    def _defaults(self) -> None:
+        """Set some fallback values."""
         if 'input' not in self.task['params']:
             self.task['params']['input'] = ''
-        self.writefile(self.task['in'], self.task['params']['input'])
         if 'timeout' not in self.task['params']:
             self.task['params']['timeout'] = 3600
         if 'kill' not in self.task['params']:
@@ -96,6 +133,25 @@ class CmdTask():
             self.task['params']['kill'] = ktmout
         if 'signal' not in self.task['params']:
             self.task['params']['signal'] = 'TERM'
+        if 'capture' not in self.task['params']:
+            self.task['params']['capture'] = CAPTURE
+
+    def run(self) -> int:
+        """Run a task."""
+        if not self.check():
+            return None
+        self._defaults()
+        if self.task['params']['capture'] == 'file':
+            cmd_pid = self._run_file()
+        else:
+            cmd_pid = self._run_pipe()
+        if self.verbose:
+            print("Pid: {}".format(cmd_pid))
+        return cmd_pid
+
+    def _run_file(self) -> int:
+        """Run task through a shell wrapper, all I/O goes to files."""
+        self.writefile(self.task['in'], self.task['params']['input'])
         tmout = '-s {} -k {}s {}s'.format(self.task['params']['signal'],
                                           self.task['params']['kill'],
                                           self.task['params']['timeout'])
@@ -121,11 +177,107 @@ class CmdTask():
         os.chmod(self.task['cmdfile'], file_mode)
         if self.verbose:
             print("Job", self.task)
-        cmd_pid = subprocess.Popen([self.task['cmdfile'], ]).pid
+        self.proc = subprocess.Popen([self.task['cmdfile'], ])
+        return self.proc.pid
+
+    def _run_pipe(self) -> int:
+        """Run task directly, capture output in memory."""
+        params = self.task['params']
+        durable = bool(params.get('durable'))
+        limit = int(params.get('spill', BUFSIZE))
+        self.stdout = RingBuffer(limit, spill=self.task['out'],
+                                 durable=durable)
+        self.stderr = RingBuffer(limit, spill=self.task['err'],
+                                 durable=durable)
+        env = dict(os.environ)
+        path = ":{}".format(params['path']) if 'path' in params else ""
+        env['PATH'] = '/usr/bin{}:/bin:{}'.format(path, env.get('PATH', ''))
+        argv = [params['command']] + shlex.split(params['options'])
         if self.verbose:
-            print("Pid: {}".format(cmd_pid))
-        sleep(0.5)
-        return cmd_pid
+            print("Job", self.task)
+        try:
+            self.proc = subprocess.Popen(argv, env=env,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        except OSError as err:
+            # same exit code as a shell for 'command not found'
+            self.stderr.write(str(err).encode('utf8'))
+            self._result(127)
+            return None
+        self._threads = [
+            threading.Thread(target=self._pump, daemon=True,
+                             args=(self.proc.stdout, self.stdout)),
+            threading.Thread(target=self._pump, daemon=True,
+                             args=(self.proc.stderr, self.stderr)),
+            threading.Thread(target=self._feed, daemon=True,
+                             args=(self.proc.stdin, params['input'])),
+        ]
+        self._timers = [
+            threading.Timer(float(params['timeout']), self._expire,
+                            [params['signal']]),
+            threading.Timer(float(params['kill']), self._expire, ['KILL']),
+        ]
+        for thread in self._threads + self._timers:
+            thread.daemon = True
+            thread.start()
+        return self.proc.pid
+
+    @staticmethod
+    def _pump(pipe, buf) -> None:
+        """Copy a pipe into an output buffer until EOF."""
+        for chunk in iter(lambda: pipe.read1(READSIZE), b''):
+            buf.write(chunk)
+        pipe.close()
+
+    @staticmethod
+    def _feed(pipe, data) -> None:
+        """Write task input to the process and close its stdin."""
+        try:
+            if data:
+                pipe.write(data.encode('utf8'))
+            pipe.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def _expire(self, signame) -> None:
+        """Timeout hit, signal the process."""
+        if self.proc.poll() is None:
+            self.timed_out = True
+            self.proc.send_signal(signal.Signals['SIG' + signame])
+
+    def _result(self, exitcode) -> None:
+        """Record exit code, close buffers (and write the result file)."""
+        self.rc = exitcode
+        self.task['rc'] = exitcode
+        for buf in (self.stdout, self.stderr):
+            if buf is not None:
+                buf.close()
+        if self.task['params'].get('durable'):
+            self.writefile(self.task['res'], '{}\n'.format(exitcode))
+
+    def reap(self) -> int:
+        """Block until the task process exits, collect its exit code."""
+        if self.proc is None:
+            self.done.set()
+            return self.rc
+        exitcode = self.proc.wait()
+        if self.stdout is not None:
+            for thread in self._threads:
+                thread.join()
+            for timer in self._timers:
+                timer.cancel()
+            if self.timed_out:
+                exitcode = 124
+            elif exitcode < 0:
+                exitcode = 128 - exitcode
+            self._result(exitcode)
+        self.done.set()
+        return exitcode
+
+    def wait(self, timeout=None) -> bool:
+        """Wait for the task to finish, return False on timeout."""
+        return self.done.wait(timeout)
 
     def status(self, verbose=False) -> dict:
         """Determine status of a task."""
@@ -135,16 +287,93 @@ class CmdTask():
                 print("invalid status")
             return status
         status['status'] = self.task['status']
+        if status['status'] in ('created', 'cancelled'):
+            # still waiting in the queue, or never started
+            status['RC'] = ''
+            return status
         if verbose:
-            status['output'] = self.readfile(self.task['out'])
-            status['errors'] = self.readfile(self.task['err'])
-        status['RC'] = self.readfile(self.task['res']).rstrip()
-        if status['RC'] == 124:
-            status['status'] = 'timed out'
+            status['output'] = self._output(self.stdout, self.task['out'])
+            status['errors'] = self._output(self.stderr, self.task['err'])
+        if self.rc is not None:
+            status['RC'] = str(self.rc)
+        elif self.task.get('rc') is not None:
+            status['RC'] = str(self.task['rc'])
         else:
+            status['RC'] = self.readfile(self.task['res']).rstrip()
+        if status['RC'] == '124':
+            status['status'] = 'timed out'
+        elif status['RC'] != '':
             status['status'] = 'finished'
+        elif self.task['status'] == 'failed' or \
+                (self.proc is not None and self.proc.poll() is not None):
+            # never started, or wrapper died without writing a result
+            status['status'] = 'failed'
+        else:
+            status['status'] = 'running'
         return status
 
+    def _finished(self) -> bool:
+        """True if the task won't write more output."""
+        if self.rc is not None or self.task.get('rc') is not None:
+            return True
+        if self.task['status'] not in ('created', 'running'):
+            return True
+        if self.proc is not None and self.proc.poll() is not None:
+            return True
+        return os.path.exists(self.task['res'])
+
+    def _stream(self, stream) -> tuple:
+        """Output buffer (None for file based output) and file of a stream."""
+        if stream == 'stderr':
+            return self.stderr, self.task['err']
+        return self.stdout, self.task['out']
+
+    def output(self, stream='stdout', offset=0, size=READSIZE) -> dict:
+        """
+        Fetch captured output from an absolute byte offset on.
+
+        :param stream:   'stdout' or 'stderr'
+        :param offset:   first byte wanted, usually *next* of the last call
+        :param size:     max. number of bytes
+        :returns dict:   *offset* of the returned data (larger than asked
+                         for if older output was dropped), *data*, *next*
+                         offset and *complete* once all output was read
+        """
+        buf, file = self._stream(stream)
+        if buf is not None:
+            done = buf.closed
+            offset, data = buf.read(offset, size)
+            complete = done and offset + len(data) >= buf.total
+        else:
+            done = self.task.get('status') != 'created' and self._finished()
+            data = read_file(file, offset, size)
+            complete = done and len(data) < size
+        if not complete:
+            # don't split multibyte characters between two calls
+            data = utf8_cut(data)
+        return {
+            'stream': stream,
+            'offset': offset,
+            'next': offset + len(data),
+            'data': data.decode('utf8', 'replace'),
+            'complete': complete,
+        }
+
+    def wait_output(self, stream='stdout', offset=0, timeout=None) -> bool:
+        """Wait until there is output beyond offset or the task finished."""
+        buf = self._stream(stream)[0]
+        if buf is not None:
+            return buf.wait(offset, timeout)
+        if timeout is None or timeout > POLLTIME:
+            timeout = POLLTIME
+        return self.done.wait(timeout)
+
+    def _output(self, buf, file) -> str:
+        """Captured output from memory buffer, or from file."""
+        if buf is not None:
+            return buf.getvalue().decode('utf8', 'replace')
+        return self.readfile(file)
+
 
 # --------- main -------------------------------------------------------------
 
@@ -153,11 +382,12 @@ if __name__ == '__main__':
         "command": "echo",            # safe command only! sanity checks first!
         "options": "hello world"      # sofe options/parameters only!
     }
-    x = CmdTask(task)
+    x = CmdTask({"params": task, "status": "running"})
     pid = x.run()
     # always check return value!
     if pid is None:
         print("Task aborted")
     if pid is not None:
         print("Task status:   {}".format(x.status()))
+        x.reap()
         print("Task verbose status:\n{}".format(x.status(verbose=True)))
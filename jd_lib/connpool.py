@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+"""
+Shared connection pool for the SQLite3 backed stores.
+
+DataDB, AuthDB and KeyValueDB share one pool per database file. A thread
+borrows a connection for the duration of a `with pool.connection()` block,
+nested blocks in the same thread reuse the borrowed connection and only the
+outermost block commits (or rolls back) and hands it back to the pool.
+
+A UnitOfWork (e.g. one per web request) keeps the borrowed connection
+until it ends, so all stores share one connection, and can turn the rest
+of the unit into one write transaction.
+
+New connections are tuned with the PRAGMAS below: WAL journal so readers
+don't block the writer, relaxed fsync, bigger page cache and memory mapped
+I/O. Writes can optionally be funneled through a group commit writer.
+
+Size the pool above the number of threads which may hold a connection at
+the same time (e.g. request threads with a unit of work), so background
+threads (group commit writer, task supervisor) still get one.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from time import monotonic
+from .groupcommit import GroupCommit, WINDOW, MAXBATCH
+
+POOLSIZE = 8        # max. number of open connections per database
+TIMEOUT = 30        # seconds to wait for a free connection / a DB lock
+PRAGMAS = {
+    'journal_mode': 'WAL',      # readers don't block the writer
+    'synchronous': 'NORMAL',    # no fsync per commit, safe in WAL mode
+    'cache_size': -16384,       # page cache in KiB (negative) or pages
+    'mmap_size': 67108864,      # bytes of the DB file mapped into memory
+    'temp_store': 'MEMORY',
+}
+
+# --------- pool registry ----------------------------------------------------
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def normalize_uri(uri=None) -> str:
+    """Turn a file name or 'file:' DSN into the DSN used as pool key."""
+    uri = uri or 'app.db'
+    if not uri.startswith('file:'):
+        uri = 'file:' + uri
+    return uri
+
+
+def get_pool(uri=None, **kwargs):
+    """Return the shared pool for a database, create it on first use."""
+    key = normalize_uri(uri)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnPool(key, **kwargs)
+            _pools[key] = pool
+    return pool
+
+
+def pool_stats() -> dict:
+    """Collect statistics of all registered pools."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {key: pool.stats() for key, pool in pools}
+
+
+# --------- connection pool --------------------------------------------------
+
+
+class ConnPool():
+    """Thread-safe pool of SQLite3 connections to one database."""
+
+    def __init__(self, uri=None, size=POOLSIZE, timeout=TIMEOUT,
+                 pragmas=None):
+        """Update internal class default values if needed."""
+        self._uri = normalize_uri(uri)
+        self._size = size
+        self._timeout = timeout
+        self._pragmas = dict(PRAGMAS)
+        if pragmas:
+            self._pragmas.update(pragmas)
+        self._writer = None
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._opened = 0
+        self._counters = {
+            'acquired': 0,
+            'created': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'wait_max': 0.0,
+        }
+
+    @property
+    def uri(self) -> str:
+        """DSN of the pooled database."""
+        return self._uri
+
+    def _connect(self):
+        """Open a new connection, usable from any thread of this process."""
+        conn = sqlite3.connect(self._uri, uri=True, timeout=self._timeout,
+                               check_same_thread=False)
+        for pragma, value in self._pragmas.items():
+            if value is not None:
+                conn.execute('PRAGMA {}={};'.format(pragma, value))
+        with self._lock:
+            self._counters['created'] += 1
+        return conn
+
+    def _checkout(self):
+        """Get an idle connection, open a new one or wait for a free one."""
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            create = self._opened < self._size
+            if create:
+                self._opened += 1
+        if create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        start = monotonic()
+        try:
+            conn = self._idle.get(timeout=self._timeout)
+        except Empty as err:
+            raise sqlite3.OperationalError(
+                'no free connection for {}'.format(self._uri)) from err
+        waited = monotonic() - start
+        with self._lock:
+            self._counters['waits'] += 1
+            self._counters['wait_time'] += waited
+            self._counters['wait_max'] = max(self._counters['wait_max'],
+                                             waited)
+        return conn
+
+    def _discard(self, conn) -> None:
+        """Close a broken connection and free its slot."""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def acquire(self):
+        """Borrow the connection of the current thread."""
+        if getattr(self._local, 'depth', 0):
+            self._local.depth += 1
+            return self._local.conn
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        unit = getattr(self._local, 'unit', None)
+        if unit is not None and not unit.held:
+            # keep the connection until the unit of work ends
+            unit.held = True
+            self._local.depth += 1
+        with self._lock:
+            self._counters['acquired'] += 1
+        return conn
+
+    @staticmethod
+    def _finish(conn, commit) -> None:
+        if conn.in_transaction:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+
+    def _holding(self) -> bool:
+        """True inside a connection() block or a unit holding a connection."""
+        return getattr(self._local, 'depth', 0) > 0
+
+    def release(self, commit=True) -> None:
+        """Return the borrowed connection, finish open transactions."""
+        self._local.depth -= 1
+        unit = getattr(self._local, 'unit', None)
+        held = unit is not None and unit.held
+        if self._local.depth > int(held):
+            return
+        conn = self._local.conn
+        if self._local.depth:
+            # outermost block in a unit of work: keep the connection, the
+            # block commits on its own unless the unit is a transaction
+            if not unit.transaction:
+                self._finish(conn, commit)
+            return
+        self._local.conn = None
+        try:
+            self._finish(conn, commit)
+        except sqlite3.Error:
+            self._discard(conn)
+            raise
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager handing out the thread's pooled connection."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(commit=False)
+            raise
+        self.release(commit=True)
+
+    def unit_of_work(self):
+        """Start a unit of work in the current thread, see UnitOfWork."""
+        unit = UnitOfWork(self)
+        self._local.unit = unit
+        return unit
+
+    def _end_unit(self, unit, commit) -> None:
+        if getattr(self._local, 'unit', None) is unit:
+            self._local.unit = None
+        if unit.held:
+            unit.held = False
+            unit.transaction = False
+            self.release(commit=commit)
+
+    def configure(self, pragmas=None, size=None) -> dict:
+        """Change pragmas and pool size, applies to new connections."""
+        with self._lock:
+            if pragmas:
+                self._pragmas.update(pragmas)
+            if size:
+                self._size = size
+        # reconnect idle connections, busy ones keep their old settings
+        self.close()
+        return dict(self._pragmas)
+
+    def group_commit(self, window=WINDOW, max_batch=MAXBATCH):
+        """Send writes through a group commit writer thread."""
+        with self._lock:
+            if self._writer is None:
+                self._writer = GroupCommit(self, window=window,
+                                           max_batch=max_batch)
+        return self._writer
+
+    def write(self, query, params=()) -> dict:
+        """
+        Execute a single write statement and commit it.
+
+        A thread holding a connection writes on it: waiting for the group
+        commit writer, which needs a connection of its own, could starve
+        the pool.
+        """
+        writer = self._writer
+        if writer is not None and not self._holding():
+            return writer.execute(query, params)
+        with self.connection() as conn:
+            cur = conn.execute(query, params)
+            return {'rowcount': cur.rowcount, 'lastrowid': cur.lastrowid}
+
+    def close(self) -> None:
+        """Flush group commits, close all idle connections (on shutdown)."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        """Report pool size, usage and wait time statistics."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = self._size
+            stats['opened'] = self._opened
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['opened'] - stats['idle']
+        if stats['waits']:
+            stats['wait_avg'] = stats['wait_time'] / stats['waits']
+        else:
+            stats['wait_avg'] = 0.0
+        if self._writer is not None:
+            stats['group_commit'] = self._writer.stats()
+        return stats
+
+
+# --------- unit of work -----------------------------------------------------
+
+
+class UnitOfWork():
+    """
+    Connection (and transaction) shared by everything a thread does until
+    end(), e.g. while handling one request.
+
+    The connection is borrowed on first use only. begin() starts a write
+    transaction, so checks and the writes depending on them are atomic.
+    """
+
+    def __init__(self, pool):
+        """Use ConnPool.unit_of_work() to start a unit."""
+        self._pool = pool
+        self.held = False
+        self.transaction = False
+
+    def begin(self) -> None:
+        """Take the write lock, the rest of the unit is one transaction."""
+        with self._pool.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            self.transaction = True
+
+    def end(self, commit=True) -> None:
+        """Commit (or roll back) and hand the connection back."""
+        self._pool._end_unit(self, commit)
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    x = get_pool('file:app.db')
+    with x.connection() as c:
+        print("SQLite version", sqlite3.sqlite_version)
+        with x.connection() as c2:
+            print("nested reuse: ", c is c2)
+    before = x.stats()['acquired']
+    u = x.unit_of_work()
+    for _ in range(3):
+        with x.connection() as c:
+            c.execute('SELECT 1;')
+    u.end()
+    print("unit borrows: ", x.stats()['acquired'] - before)
+    print("stats:   ", x.stats())
@@ -3,13 +3,25 @@
 """
 Simple interface to a minimalistic data store.
 
-Data is stored in a table in SQLite3.
+Data is stored in a table in SQLite3. Every row carries its modification
+time (mtime), the table a version counter (see tableversion) for caches and
+HTTP validators.
 """
 
+import sys
+import json
+import base64
 import sqlite3
+from time import time
 from pprint import pprint
+from .connpool import get_pool
+from . import tableversion
 
 DEBUGIT = False  # True # False
+PAGESIZE = 100      # default number of rows per page
+MAXPAGESIZE = 1000  # upper limit for rows per page
+SORTKEYS = {'id': int, 'name': str}    # sort columns and their types
+CHUNKSIZE = 500     # max. number of SQL variables in one IN (...) list
 
 # --------- debug ------------------------------------------------------------
 
@@ -31,6 +43,52 @@ def dict_factory(cursor, row) -> dict:
     return data
 
 
+def encode_cursor(sortkey, key_id) -> str:
+    """Pack the position of the last row of a page into a cursor string."""
+    raw = json.dumps([sortkey, key_id]).encode('utf8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor, sort='id') -> list:
+    """Unpack a cursor of a page sorted by sort, ValueError if invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        sortkey, key_id = json.loads(raw.decode('utf8'))
+    except (TypeError, ValueError) as err:
+        raise ValueError('invalid cursor') from err
+    if not isinstance(key_id, int) or isinstance(key_id, bool) or \
+       not isinstance(sortkey, SORTKEYS[sort]) or isinstance(sortkey, bool):
+        raise ValueError('invalid cursor')
+    return [sortkey, key_id]
+
+
+def chunks(values, size=CHUNKSIZE):
+    """Split a list into slices of at most size entries."""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def begin(conn) -> None:
+    """Start a write transaction unless one is running already."""
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def prefix_range(prefix) -> list:
+    """
+    Lower and upper bound of all strings starting with prefix.
+
+    The upper bound is None if there is none (prefix of U+10FFFF only).
+    """
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return [prefix, None]
+    point = ord(stem[-1]) + 1
+    if 0xD800 <= point <= 0xDFFF:
+        point = 0xE000      # no surrogates in (UTF-8 encoded) text
+    return [prefix, stem[:-1] + chr(point)]
+
+
 class DataDB():
     """Database class to contain all the necessary parameters and functions."""
 
@@ -38,101 +96,357 @@ class DataDB():
         """Update internal class default values."""
         self._db = uri or 'app.db'
         self._table = table or 'resource'
-        try:
-            conn = sqlite3.connect(self._db, uri=True, timeout=1000)
-            mydebug("SQLite version", sqlite3.version)
-        except sqlite3.OperationalError as err:
-            print('Database does not exist, creating it.')
-            mydebug(err)
-        finally:
-            if conn:
-                conn.close()
+        self._pool = get_pool(self._db)
+        mydebug("SQLite version", sqlite3.sqlite_version)
         self._create()
 
     def _create(self) -> bool:
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = '''CREATE TABLE IF NOT EXISTS {} (
-                    id      INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name    TEXT NOT NULL,
-                    value   TEXT NOT NULL
-                );'''.format(self._table)
-        cur.execute(query)
-        query = 'SELECT id FROM {};'.format(self._table)
-        row = cur.execute(query).fetchone()
-        if not row:
-            query = 'INSERT INTO {} (id, name, value) '.format(self._table) + \
-                      'VALUES (?,?,?)'
-            cur.execute(query, [0, 'dummy name', 'dummy value'])
-        conn.commit()
-        conn.close()
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            query = '''CREATE TABLE IF NOT EXISTS {} (
+                        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name    TEXT NOT NULL,
+                        value   TEXT NOT NULL,
+                        mtime   REAL
+                    );'''.format(self._table)
+            cur.execute(query)
+            # tables of older versions lack the mtime column
+            query = 'PRAGMA table_info({});'.format(self._table)
+            if 'mtime' not in [row[1] for row in cur.execute(query)]:
+                query = 'ALTER TABLE {} ADD COLUMN mtime REAL;'.format(
+                    self._table)
+                cur.execute(query)
+            query = 'SELECT id FROM {};'.format(self._table)
+            row = cur.execute(query).fetchone()
+            if not row:
+                query = 'INSERT INTO {} (id, name, value) '.format(
+                    self._table) + 'VALUES (?,?,?)'
+                cur.execute(query, [0, 'dummy name', 'dummy value'])
+            tableversion.track(conn, self._table)
+        self._unique = self._create_unique()
+        return True
+
+    def version(self) -> int:
+        """Fetch change counter of the table (for caches and ETags)."""
+        with self._pool.connection() as conn:
+            return tableversion.version(conn, self._table)
+
+    def _create_unique(self) -> bool:
+        """Enforce unique names, migrate the plain index of older DBs."""
+        with self._pool.connection() as conn:
+            query = 'CREATE UNIQUE INDEX IF NOT EXISTS {0}_name_uidx ' \
+                    'ON {0} (name);'.format(self._table)
+            try:
+                conn.execute(query)
+            except sqlite3.IntegrityError as err:
+                print('Duplicate names in table {}, '.format(self._table)
+                      + 'not enforcing unique names.')
+                mydebug(err)
+                query = 'CREATE INDEX IF NOT EXISTS {0}_name_idx ' \
+                        'ON {0} (name);'.format(self._table)
+                conn.execute(query)
+                return False
+            query = 'DROP INDEX IF EXISTS {}_name_idx;'.format(self._table)
+            conn.execute(query)
         return True
 
     def data_get_byid(self, key_id=None) -> dict:
         """Fetch a specific row or all rows from the database."""
-        conn = sqlite3.connect(self._db, uri=True)
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
-        if key_id is None:
-            query = 'SELECT * FROM {};'.format(self._table)
-            data = cur.execute(query).fetchall()
-        else:
-            query = 'SELECT * FROM {} WHERE id=?;'.format(self._table)
-            data = cur.execute(query, [key_id, ]).fetchone()
-        conn.close()
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            if key_id is None:
+                query = 'SELECT * FROM {};'.format(self._table)
+                data = cur.execute(query).fetchall()
+            else:
+                query = 'SELECT * FROM {} WHERE id=?;'.format(self._table)
+                data = cur.execute(query, [key_id, ]).fetchone()
         mydebug("data", data)
         return data
 
+    def data_list(self, limit=PAGESIZE, after=None, prefix=None,
+                  sort='id', desc=False) -> tuple:
+        """
+        Fetch one page of rows using keyset pagination.
+
+        :param limit:   max. number of rows
+        :param after:   cursor returned with the previous page
+        :param prefix:  only rows with a name starting with prefix
+        :param sort:    sort column, 'id' or 'name'
+        :param desc:    sort descending
+        :returns tuple: list of rows, cursor of the next page (or None)
+        """
+        if sort not in SORTKEYS:
+            raise ValueError('invalid sort key {}'.format(sort))
+        limit = max(1, min(int(limit or PAGESIZE), MAXPAGESIZE))
+        where = []
+        param = []
+        if prefix:
+            lower, upper = prefix_range(prefix)
+            where.append('name>=?')
+            param.append(lower)
+            if upper is not None:
+                where.append('name<?')
+                param.append(upper)
+        compare = '<' if desc else '>'
+        order = 'DESC' if desc else 'ASC'
+        if after:
+            sortkey, key_id = decode_cursor(after, sort)
+            if sort == 'id':
+                where.append('id{}?'.format(compare))
+                param.append(key_id)
+            else:
+                where.append('(name, id){}(?, ?)'.format(compare))
+                param.extend([sortkey, key_id])
+        query = 'SELECT * FROM {}'.format(self._table)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        if sort == 'id':
+            query += ' ORDER BY id {}'.format(order)
+        else:
+            query += ' ORDER BY name {0}, id {0}'.format(order)
+        query += ' LIMIT ?;'
+        param.append(limit + 1)
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            data = cur.execute(query, param).fetchall()
+        mydebug("data", data)
+        if len(data) <= limit:
+            return data, None
+        data = data[:limit]
+        last = data[-1]
+        return data, encode_cursor(last[sort], last['id'])
+
+    def data_iter(self, chunk=CHUNKSIZE):
+        """
+        Stream all rows of the table ordered by id.
+
+        Rows are read from one cursor with fetchmany(), memory use depends
+        on the chunk size only.
+
+        :param chunk:   number of rows fetched at a time
+        :returns:       generator yielding lists of rows
+        """
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            query = 'SELECT * FROM {} ORDER BY id;'.format(self._table)
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    break
+                yield rows
+            cur.close()
+
     def data_get_byname(self, name=None) -> dict:
         """Fetch a specific row or all rows from the database."""
         if name is None:
             mydebug("No name supplied to data_get_byname")
             return None
-        conn = sqlite3.connect(self._db, uri=True)
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
-        query = 'SELECT * FROM {} WHERE name=?;'.format(self._table)
-        data = cur.execute(query, [name, ]).fetchone()
-        conn.close()
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            query = 'SELECT * FROM {} WHERE name=?;'.format(self._table)
+            data = cur.execute(query, [name, ]).fetchone()
         mydebug("data", data)
         if data and 'id' in data:
             return data['id']
         return None
 
+    def data_create(self, data) -> int:
+        """
+        Insert a data row unless the name is taken already.
+
+        A single statement relying on the unique index on name, no
+        check-then-insert race.
+
+        :param data:    dict with 'name' and 'value'
+        :returns int:   id of the new row, None on name conflict
+        """
+        param = [data['name'], data['value'], time()]
+        if not self._unique:
+            # no unique index (duplicates in old DB), check in transaction
+            with self._pool.connection() as conn:
+                begin(conn)
+                query = 'SELECT id FROM {} WHERE name=?;'.format(self._table)
+                if conn.execute(query, param[:1]).fetchone():
+                    return None
+                query = 'INSERT INTO {} (name, value, mtime) ' \
+                    'VALUES (?,?,?);'.format(self._table)
+                return conn.execute(query, param).lastrowid
+        query = 'INSERT INTO {} (name, value, mtime) VALUES (?,?,?) '.format(
+            self._table) + 'ON CONFLICT(name) DO NOTHING;'
+        res = self._pool.write(query, param)
+        mydebug("create", res)
+        if not res['rowcount']:
+            return None
+        return res['lastrowid']
+
     def data_add(self, data) -> dict:
         """Insert a data row ."""
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = 'INSERT INTO {} (name, value) VALUES (?,?)'.format(self._table)
-        param = [data['name'], data['value']]
-        cur.execute(query, param)
-        conn.commit()
-        conn.close()
+        query = 'INSERT INTO {} (name, value, mtime) VALUES (?,?,?)'.format(
+            self._table)
+        param = [data['name'], data['value'], time()]
+        self._pool.write(query, param)
         return data
 
     def data_update(self, data) -> dict:
         """Update a data row, use id provided in data set."""
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = 'UPDATE {} SET name=?, value=? WHERE id=?'.format(self._table)
-        param = [data['name'], data['value'], data['id']]
-        cur.execute(query, param)
-        conn.commit()
-        conn.close()
+        query = 'UPDATE {} SET name=?, value=?, mtime=? WHERE id=?'.format(
+            self._table)
+        param = [data['name'], data['value'], time(), data['id']]
+        try:
+            self._pool.write(query, param)
+        except sqlite3.IntegrityError as err:
+            mydebug("update conflict", err)
+            return None
         return data
 
     def data_delete(self, key_id) -> bool:
         """Delete data row indicated by key_id."""
         if key_id is None:
             return False
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
         query = 'DELETE FROM {} WHERE id=?'.format(self._table)
-        cur.execute(query, [key_id, ])
-        conn.commit()
-        conn.close()
+        self._pool.write(query, [key_id, ])
         return True
 
+    def _select_in(self, cur, column, values) -> list:
+        """Fetch all rows where column matches one of the values."""
+        rows = []
+        for part in chunks(list(values)):
+            query = 'SELECT * FROM {} WHERE {} IN ({});'.format(
+                self._table, column, ','.join('?' * len(part)))
+            rows.extend(cur.execute(query, part).fetchall())
+        return rows
+
+    def data_add_many(self, items) -> list:
+        """
+        Insert many data rows in one transaction.
+
+        :param items:   list of dicts with 'name' and 'value'
+        :returns list:  per item status dict: index, status, id or error
+        """
+        result = []
+        valid = {}
+        for idx, data in enumerate(items):
+            if not isinstance(data, dict) or \
+               not isinstance(data.get('name'), str) or \
+               not isinstance(data.get('value'), str):
+                result.append({'index': idx, 'status': 400,
+                               'error': 'Bad request'})
+            elif data['name'] in valid:
+                result.append({'index': idx, 'status': 409,
+                               'error': 'Conflict'})
+            else:
+                valid[data['name']] = idx
+                result.append(None)
+        with self._pool.connection() as conn:
+            begin(conn)
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            for row in self._select_in(cur, 'name', valid):
+                idx = valid.pop(row['name'])
+                result[idx] = {'index': idx, 'status': 409,
+                               'error': 'Conflict'}
+            query = 'INSERT INTO {} (name, value, mtime) ' \
+                'VALUES (?,?,?)'.format(self._table)
+            now = time()
+            cur.executemany(query, [[name, items[idx]['value'], now]
+                                    for name, idx in valid.items()])
+            for row in self._select_in(cur, 'name', valid):
+                idx = valid[row['name']]
+                result[idx] = {'index': idx, 'status': 201, 'id': row['id']}
+        mydebug("batch add", result)
+        return result
+
+    def data_update_many(self, items) -> list:
+        """
+        Update many data rows in one transaction.
+
+        Missing (or None) 'name' or 'value' keep their current value, given
+        ones must be strings, '' included.
+
+        :param items:   list of dicts with 'id' and 'name' and/or 'value'
+        :returns list:  per item status dict: index, status, id or error
+        """
+        result = []
+        valid = {}
+        for idx, data in enumerate(items):
+            if not isinstance(data, dict) or \
+               not isinstance(data.get('id'), int) or \
+               not all(isinstance(data.get(key), (str, type(None)))
+                       for key in ('name', 'value')):
+                result.append({'index': idx, 'status': 400,
+                               'error': 'Bad request'})
+            elif data['id'] in valid:
+                result.append({'index': idx, 'status': 409, 'id': data['id'],
+                               'error': 'Conflict'})
+            else:
+                valid[data['id']] = idx
+                result.append({'index': idx, 'status': 404, 'id': data['id'],
+                               'error': 'Not found'})
+        with self._pool.connection() as conn:
+            begin(conn)
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            param = {}
+            now = time()
+            for row in self._select_in(cur, 'id', valid):
+                idx = valid[row['id']]
+                data = items[idx]
+                # '' is a value like any other, only None/missing keeps
+                param[row['id']] = [
+                    row[key] if data.get(key) is None else data[key]
+                    for key in ('name', 'value')] + [now, row['id']]
+                result[idx] = {'index': idx, 'status': 200, 'id': row['id']}
+            # renames onto taken names are skipped and reported below
+            query = 'UPDATE OR IGNORE {} '.format(self._table) \
+                + 'SET name=?, value=?, mtime=? WHERE id=?'
+
+            cur.executemany(query, list(param.values()))
+            for row in self._select_in(cur, 'id', param):
+                if [row['name'], row['value']] != param[row['id']][:2]:
+                    idx = valid[row['id']]
+                    result[idx] = {'index': idx, 'status': 409,
+                                   'id': row['id'], 'error': 'Conflict'}
+        mydebug("batch update", result)
+        return result
+
+    def data_delete_many(self, key_ids) -> list:
+        """
+        Delete many data rows in one transaction.
+
+        :param key_ids: list of row ids
+        :returns list:  per id status dict: index, status, id or error
+        """
+        result = []
+        valid = {}
+        for idx, key_id in enumerate(key_ids):
+            if not isinstance(key_id, int):
+                result.append({'index': idx, 'status': 400,
+                               'error': 'Bad request'})
+            elif key_id in valid:
+                result.append({'index': idx, 'status': 409, 'id': key_id,
+                               'error': 'Conflict'})
+            else:
+                valid[key_id] = idx
+                result.append({'index': idx, 'status': 404, 'id': key_id,
+                               'error': 'Not found'})
+        with self._pool.connection() as conn:
+            begin(conn)
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            found = [row['id'] for row in self._select_in(cur, 'id', valid)]
+            query = 'DELETE FROM {} WHERE id=?'.format(self._table)
+            cur.executemany(query, [[key_id] for key_id in found])
+            for key_id in found:
+                idx = valid[key_id]
+                result[idx] = {'index': idx, 'status': 204, 'id': key_id}
+        mydebug("batch delete", result)
+        return result
+
 # --------- main -------------------------------------------------------------
 
 
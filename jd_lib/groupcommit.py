@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Group commit writer for the SQLite3 backed stores.
+
+Write statements arriving within a short time window are collected by one
+writer thread and executed in a single transaction, so concurrent writers
+share one commit (and one fsync) instead of paying for one each. Every
+statement runs inside its own savepoint, a failing statement is rolled back
+without affecting the rest of the batch.
+"""
+
+import sqlite3
+import threading
+from concurrent.futures import Future
+from queue import Queue, Empty
+from time import monotonic
+
+WINDOW = 0.005      # seconds to collect writes before committing
+MAXBATCH = 256      # max. number of statements per transaction
+
+# --------- writer -----------------------------------------------------------
+
+
+class GroupCommit():
+    """Background writer combining statements into shared transactions."""
+
+    def __init__(self, pool=None, window=WINDOW, max_batch=MAXBATCH):
+        """Update internal class default values if needed."""
+        self._pool = pool
+        self._window = window
+        self._max_batch = max_batch
+        self._queue = Queue()
+        self._counters = {'statements': 0, 'batches': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._loop,
+                                        name='groupcommit', daemon=True)
+        self._thread.start()
+
+    def submit(self, query, params=()) -> Future:
+        """Queue a write statement, the future resolves after commit."""
+        future = Future()
+        self._queue.put((query, params, future))
+        return future
+
+    def execute(self, query, params=()) -> dict:
+        """Queue a write statement and wait for its commit."""
+        return self.submit(query, params).result()
+
+    def close(self) -> None:
+        """Flush pending writes and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        """Report number of statements, batches and failed statements."""
+        stats = dict(self._counters)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def _collect(self, first) -> list:
+        """Gather statements arriving within the commit window."""
+        batch = [first]
+        deadline = monotonic() + self._window
+        while len(batch) < self._max_batch:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _commit(self, batch) -> None:
+        """Run one batch of statements in a single transaction."""
+        results = []
+        try:
+            with self._pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for query, params, future in batch:
+                    conn.execute('SAVEPOINT groupcommit')
+                    try:
+                        cur = conn.execute(query, params)
+                    except sqlite3.Error as err:
+                        conn.execute('ROLLBACK TO groupcommit')
+                        results.append((future, None, err))
+                    else:
+                        result = {'rowcount': cur.rowcount,
+                                  'lastrowid': cur.lastrowid}
+                        results.append((future, result, None))
+                    conn.execute('RELEASE groupcommit')
+        except sqlite3.Error as err:
+            for _query, _params, future in batch:
+                future.set_exception(err)
+            self._counters['errors'] += len(batch)
+            return
+        self._counters['batches'] += 1
+        for future, result, err in results:
+            self._counters['statements'] += 1
+            if err is None:
+                future.set_result(result)
+            else:
+                self._counters['errors'] += 1
+                future.set_exception(err)
+
+    def _loop(self) -> None:
+        """Writer thread main loop."""
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            self._commit(self._collect(entry))
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    from .connpool import get_pool
+    x = get_pool('file:app.db').group_commit()
+    x.execute('CREATE TABLE IF NOT EXISTS gc_demo (n INTEGER)')
+    futures = [x.submit('INSERT INTO gc_demo (n) VALUES (?)', [n])
+               for n in range(100)]
+    print("results: ", [f.result()['rowcount'] for f in futures][:5])
+    print("stats:   ", x.stats())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+Job table for the task manager.
+
+Jobs are stored in a table in SQLite3 with real columns for the fields
+used in queries (uuid, type, status, pid, timestamps) and an index on
+status, the complete job description is kept as JSON next to them.
+"""
+
+import json
+import sqlite3
+from .connpool import get_pool
+
+COLUMNS = ('uuid', 'type', 'status', 'pid', 'created', 'started', 'finished')
+ACTIVE = ('created', 'running')
+CHUNKSIZE = 500     # max. number of uuids per DELETE statement
+
+# --------- database interactions --------------------------------------------
+
+
+def job_factory(cursor, row) -> dict:
+    """Map function. Merge the JSON job description and the columns."""
+    data = {}
+    for idx, col in enumerate(cursor.description):
+        data[col[0]] = row[idx]
+    job = json.loads(data.pop('job') or '{}')
+    job.update(data)
+    return job
+
+
+class JobDB():
+    """Database class to contain all the necessary parameters and functions."""
+
+    def __init__(self, table=None, uri=None, legacy='tasks', verbose=0):
+        """
+        Update internal class default values if needed.
+
+        :param table:    job table name
+        :param uri:      database DSN
+        :param legacy:   KeyValueDB table of older versions to import
+        :param verbose:  set verbosity level for debug and logging
+        """
+        self._verbose = verbose or 0
+        self._db = uri or 'app.db'
+        self._table = table or 'jobs'
+        self._pool = get_pool(self._db)
+        self._create()
+        if legacy:
+            self._migrate(legacy)
+
+    def _create(self) -> bool:
+        with self._pool.connection() as conn:
+            query = '''CREATE TABLE IF NOT EXISTS {} (
+                        uuid     TEXT PRIMARY KEY NOT NULL,
+                        type     TEXT NOT NULL,
+                        status   TEXT NOT NULL,
+                        pid      INTEGER,
+                        created  REAL,
+                        started  REAL,
+                        finished REAL,
+                        job      TEXT
+                    );'''.format(self._table)
+            conn.execute(query)
+            query = 'CREATE INDEX IF NOT EXISTS {0}_status_idx ' \
+                    'ON {0} (status, created);'.format(self._table)
+            conn.execute(query)
+        return True
+
+    def _migrate(self, legacy) -> int:
+        """Move jobs from a KeyValueDB table (JSON values) to this table."""
+        with self._pool.connection() as conn:
+            query = "SELECT name FROM sqlite_master " \
+                    "WHERE type='table' AND name=?;"
+            if not conn.execute(query, [legacy, ]).fetchone():
+                return 0
+            query = 'SELECT key, value FROM {};'.format(legacy)
+            try:
+                rows = conn.execute(query).fetchall()
+            except sqlite3.OperationalError as err:
+                if self._verbose:
+                    print('Table {} is no job list: {}'.format(legacy, err))
+                return 0
+            jobs = [json.loads(row[1]) for row in rows if row[1]]
+            for key, job in zip([row[0] for row in rows if row[1]], jobs):
+                job['uuid'] = key
+                job.setdefault('type', 'cmd')
+                job.setdefault('status', 'unknown')
+                self.set(job)
+            conn.execute('DROP TABLE {};'.format(legacy))
+        if self._verbose:
+            print('Migrated {} jobs from table {}.'.format(len(jobs), legacy))
+        return len(jobs)
+
+    def set(self, job) -> str:
+        """Insert or update a job, keyed by job['uuid']."""
+        param = [job.get(col) for col in COLUMNS]
+        param.append(json.dumps(
+            {k: v for k, v in job.items() if k not in COLUMNS}))
+        query = 'INSERT OR REPLACE INTO {} ({}, job) VALUES ({});'.format(
+            self._table, ', '.join(COLUMNS), ','.join('?' * len(param)))
+        self._pool.write(query, param)
+        return job['uuid']
+
+    def get(self, uuid) -> dict:
+        """Fetch a job by uuid, None if unknown."""
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = job_factory
+            query = 'SELECT * FROM {} WHERE uuid=?;'.format(self._table)
+            job = cur.execute(query, [uuid, ]).fetchone()
+        if self._verbose > 1:
+            print("job", job)
+        return job
+
+    def uuids(self, status='running') -> list:
+        """List uuids of all jobs in the given state (oldest first)."""
+        with self._pool.connection() as conn:
+            if status is None:
+                query = 'SELECT uuid FROM {} ORDER BY created;'.format(
+                    self._table)
+                rows = conn.execute(query).fetchall()
+            else:
+                query = 'SELECT uuid FROM {} WHERE status=? ' \
+                        'ORDER BY created;'.format(self._table)
+                rows = conn.execute(query, [status, ]).fetchall()
+        return [row[0] for row in rows]
+
+    def finished(self) -> list:
+        """List (uuid, end time) of all finished jobs, oldest first."""
+        with self._pool.connection() as conn:
+            query = 'SELECT uuid, COALESCE(finished, started, created) ' \
+                    'AS ended FROM {} WHERE status NOT IN ({}) ' \
+                    'ORDER BY ended;'.format(self._table,
+                                             ','.join('?' * len(ACTIVE)))
+            return conn.execute(query, ACTIVE).fetchall()
+
+    def delete(self, uuids) -> int:
+        """Delete jobs by uuid, return number of deleted rows."""
+        uuids = list(uuids)
+        deleted = 0
+        for pos in range(0, len(uuids), CHUNKSIZE):
+            chunk = uuids[pos:pos + CHUNKSIZE]
+            query = 'DELETE FROM {} WHERE uuid IN ({});'.format(
+                self._table, ','.join('?' * len(chunk)))
+            deleted += self._pool.write(query, chunk)['rowcount']
+        return deleted
+
+    def list(self, status=None) -> list:
+        """Fetch all jobs, or all jobs in the given state."""
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = job_factory
+            if status is None:
+                query = 'SELECT * FROM {} ORDER BY created;'.format(
+                    self._table)
+                cur.execute(query)
+            else:
+                query = 'SELECT * FROM {} WHERE status=? ' \
+                        'ORDER BY created;'.format(self._table)
+                cur.execute(query, [status, ])
+            return cur.fetchall()
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    x = JobDB(uri='file:app.db')
+    print("running: ", x.uuids('running'))
+    print("all:     ", len(x.list()))
@@ -8,6 +8,7 @@ Data is stored in a table in SQLite3.
 
 import sqlite3
 import datetime
+from .connpool import get_pool
 
 # --------- database interactions --------------------------------------------
 
@@ -31,61 +32,47 @@ class KeyValueDB():
             self._verbose = 0
         self._db = uri or 'app.db'
         self._table = table or 'kv'
-        try:
-            conn = sqlite3.connect(self._db, uri=True, timeout=1000)
-            if self._verbose:
-                print("SQLite version", sqlite3.version)
-        except sqlite3.OperationalError as err:
-            if self._verbose:
-                print('Database does not exist, creating it.')
-            if self._verbose > 1:
-                print(err)
-        cur = conn.cursor()
-        try:
-            query = 'SELECT key FROM {} LIMIT 1;'.format(self._table)
-            entry = cur.execute(query).fetchone()
-            if self._verbose > 1:
-                print(entry)
-        except sqlite3.OperationalError as err:
-            if self._verbose:
-                print('Table does not exist, creating it.')
+        self._pool = get_pool(self._db)
+        if self._verbose:
+            print("SQLite version", sqlite3.sqlite_version)
+        with self._pool.connection() as conn:
+            try:
+                query = 'SELECT key FROM {} LIMIT 1;'.format(self._table)
+                entry = conn.execute(query).fetchone()
                 if self._verbose > 1:
-                    print(err)
-            self._create()
-        if conn:
-            conn.close()
+                    print(entry)
+            except sqlite3.OperationalError as err:
+                if self._verbose:
+                    print('Table does not exist, creating it.')
+                    if self._verbose > 1:
+                        print(err)
+                self._create()
 
     def _create(self) -> bool:
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = '''CREATE TABLE IF NOT EXISTS {} (
-                    key   TEXT PRIMARY KEY NOT NULL,
-                    value TEXT,
-                    ts    timestamp
-                );'''.format(self._table)
-        cur.execute(query)
-        conn.commit()
-        conn.close()
+        with self._pool.connection() as conn:
+            query = '''CREATE TABLE IF NOT EXISTS {} (
+                        key   TEXT PRIMARY KEY NOT NULL,
+                        value TEXT,
+                        ts    timestamp
+                    );'''.format(self._table)
+            conn.execute(query)
         return True
 
     def get(self, key=None) -> dict:
         """Fetch a specific row from the database or a list of all keys."""
-        conn = sqlite3.connect(self._db, uri=True)
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
-        if key is None:
-            # Query for list of keys.
-            query = 'SELECT key FROM {};'.format(self._table)
-            cur.execute(query)
-            entry = [r['key'] for r in cur.fetchall()]
-            conn.close()
-            if self._verbose > 1:
-                print("entry", entry)
-            return entry
-        # Query full entry matching key.
-        query = 'SELECT value FROM {} WHERE key=?;'.format(self._table)
-        entry = cur.execute(query, [key, ]).fetchone()
-        conn.close()
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            cur.row_factory = dict_factory
+            if key is None:
+                # Query for list of keys.
+                query = 'SELECT key FROM {};'.format(self._table)
+                cur.execute(query)
+                entry = [r['key'] for r in cur.fetchall()]
+            else:
+                # Query full entry matching key.
+                query = 'SELECT value FROM {} WHERE key=?;'.format(
+                    self._table)
+                entry = cur.execute(query, [key, ]).fetchone()
         if self._verbose > 1:
             print("entry", entry)
         return entry
@@ -94,22 +81,15 @@ class KeyValueDB():
         """Insert or update a specific row defined by key."""
         if (key is None) or (value is None):
             return None
-        conn = sqlite3.connect(self._db, uri=True)
-        cur = conn.cursor()
-        query = 'SELECT key FROM {} WHERE key=?;'.format(self._table)
-        entry = cur.execute(query, [key, ]).fetchone()
-        if self._verbose > 2:
-            print("ENTRY: ", entry)
-        if not entry:
-            query = 'INSERT INTO {} '.format(self._table) \
-                    + '(value,ts,key) VALUES (?,?,?);'
-        else:
-            query = 'UPDATE {} '.format(self._table) \
-                    + 'SET value=?, ts=? WHERE key=?;'
+        # single upsert statement, so it can share a group commit
+        query = 'INSERT INTO {} (value,ts,key) VALUES (?,?,?) '.format(
+            self._table) \
+            + 'ON CONFLICT(key) DO UPDATE SET value=excluded.value, ' \
+            + 'ts=excluded.ts;'
         param = [value, datetime.datetime.now(), key]
-        cur.execute(query, param)
-        conn.commit()
-        conn.close()
+        res = self._pool.write(query, param)
+        if self._verbose > 2:
+            print("ROWS: ", res['rowcount'])
         return key
 
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Result cache for read-only commands.
+
+Results are kept for a time to live. After that they are served stale for
+a while longer while one background reload fetches a fresh result. Callers
+asking for the same key while a load is running wait for that load instead
+of starting another one (request coalescing).
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import monotonic
+
+CACHESIZE = 256     # max. number of cached results
+CACHETTL = 10       # seconds a result is fresh
+STALETIME = 60      # seconds a result may be served stale while reloading
+
+# --------- result cache -----------------------------------------------------
+
+
+class ResultCache():
+    """Bounded TTL cache with stale-while-revalidate and coalescing."""
+
+    def __init__(self, ttl=CACHETTL, stale=STALETIME, size=CACHESIZE,
+                 valid=None):
+        """
+        Update internal class default values if needed.
+
+        :param ttl:    seconds a result is fresh
+        :param stale:  seconds an expired result is served during reload
+        :param size:   max. number of entries
+        :param valid:  callable telling if a result may be cached
+                       (e.g. not for failed commands), default: all
+        """
+        self._ttl = ttl
+        self._stale = stale
+        self._size = size
+        self._valid = valid or (lambda value: True)
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'reloads': 0,
+            'errors': 0,
+        }
+
+    def get(self, key, loader):
+        """
+        Return cached result for key, call loader() to fetch a new one.
+
+        Exceptions of loader() are passed on to all waiting callers.
+        """
+        reload = None
+        owner = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = monotonic() - entry[0]
+                if age < self._ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return entry[1]
+                if age >= self._ttl + self._stale:
+                    entry = None
+            future = self._loading.get(key)
+            if entry is not None:
+                self._counters['stale_hits'] += 1
+                if future is not None:
+                    return entry[1]
+                self._counters['reloads'] += 1
+                reload = self._loading[key] = Future()
+            elif future is not None:
+                self._counters['coalesced'] += 1
+            else:
+                self._counters['misses'] += 1
+                future = self._loading[key] = Future()
+                owner = True
+        if reload is not None:
+            # serve the stale result, reload in the background
+            threading.Thread(target=self._load, daemon=True,
+                             args=(key, loader, reload)).start()
+            return entry[1]
+        if owner:
+            self._load(key, loader, future)
+        return future.result()
+
+    def _load(self, key, loader, future) -> None:
+        """Run loader, store its result and wake up waiting callers."""
+        try:
+            value = loader()
+        except Exception as err:
+            with self._lock:
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+                self._counters['errors'] += 1
+            future.set_exception(err)
+            return
+        with self._lock:
+            # not stored if invalidated meanwhile
+            current = self._loading.get(key) is future
+            if current:
+                del self._loading[key]
+            if current and self._valid(value):
+                self._entries[key] = (monotonic(), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._size:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+
+    def invalidate(self, key=None) -> None:
+        """Drop one cached result, or all of them (and running loads)."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._loading.clear()
+            else:
+                self._entries.pop(key, None)
+                self._loading.pop(key, None)
+
+    def stats(self) -> dict:
+        """Report hit/miss counters and current size."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+            stats['loading'] = len(self._loading)
+        return stats
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    x = ResultCache(ttl=1, stale=5)
+    print("first:   ", x.get('key', lambda: 'value'))
+    print("cached:  ", x.get('key', lambda: 'other'))
+    print("stats:   ", x.stats())
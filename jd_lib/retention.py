@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+"""
+Retention for finished tasks.
+
+Every task leaves a row in the job table and a handful of files under the
+task directory (<uuid>.stdin, .stdout, .stderr, .result, .cmd). A sweeper
+thread removes finished tasks once they exceed one of the policies:
+
+- max_age:    seconds since the task finished
+- max_count:  number of finished tasks kept, the oldest go first
+- max_bytes:  total size of the task directory, the oldest go first
+
+Files without a job row (e.g. from a deleted database) are removed after
+max_age as well. Removed tasks can be archived to a compressed tar file
+(job description and files) before deletion.
+"""
+
+import io
+import os
+import json
+import sqlite3
+import tarfile
+import threading
+from time import time, monotonic, strftime
+from uuid import UUID
+
+MAXAGE = 7 * 86400          # seconds a finished task is kept
+MAXCOUNT = 1000             # max. number of finished tasks kept
+MAXBYTES = 268435456        # max. bytes of task files kept
+INTERVAL = 300              # seconds between sweeps
+BATCHSIZE = 100             # tasks removed per batch
+GRACE = 60                  # min. age in seconds of orphaned files
+
+# --------- helpers ----------------------------------------------------------
+
+
+def scan(taskdir) -> dict:
+    """Map uuid to (bytes, newest mtime, file paths) of the task files."""
+    tasks = {}
+    try:
+        entries = list(os.scandir(taskdir))
+    except FileNotFoundError:
+        return tasks
+    for entry in entries:
+        uuid = entry.name.split('.', 1)[0]
+        try:
+            UUID(uuid)
+        except ValueError:
+            continue        # not a task file
+        try:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            info = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        size, mtime, paths = tasks.get(uuid, (0, 0.0, []))
+        paths.append(entry.path)
+        tasks[uuid] = (size + info.st_size, max(mtime, info.st_mtime), paths)
+    return tasks
+
+# --------- sweeper ----------------------------------------------------------
+
+
+class Retention():
+    """Apply retention policies to the job list and the task directory."""
+
+    def __init__(self, joblist=None, taskdir=None, max_age=MAXAGE,
+                 max_count=MAXCOUNT, max_bytes=MAXBYTES, archive=None,
+                 interval=INTERVAL, batch=BATCHSIZE, keep=None, verbose=0):
+        """
+        Update internal class default values if needed.
+
+        :param joblist:    JobDB of the task manager
+        :param taskdir:    directory of the task files
+        :param max_age:    seconds a finished task is kept, None: forever
+        :param max_count:  number of finished tasks kept, None: all
+        :param max_bytes:  size limit of the task directory, None: none
+        :param archive:    directory for tar.gz archives of removed tasks,
+                           None deletes without archiving
+        :param interval:   seconds between sweeps of the background thread
+        :param batch:      number of tasks removed at a time
+        :param keep:       callable returning uuids which must not be
+                           removed (e.g. tasks still held in memory)
+        :param verbose:    set verbosity level for debug and logging
+        """
+        self.joblist = joblist
+        self.taskdir = taskdir or 'tasks'
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.archive = archive
+        self.interval = interval
+        self.batch = batch
+        self.keep = keep
+        self.verbose = verbose
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {
+            'sweeps': 0,
+            'jobs_removed': 0,
+            'files_removed': 0,
+            'orphans_removed': 0,
+            'bytes_reclaimed': 0,
+            'archives': 0,
+            'errors': 0,
+            'last_sweep': None,
+            'last_duration': 0.0,
+        }
+
+    def start(self) -> None:
+        """Start the background sweeper."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True,
+                                        name='retention')
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background sweeper."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except (OSError, sqlite3.Error, tarfile.TarError) as err:
+                with self._lock:
+                    self._counters['errors'] += 1
+                if self.verbose:
+                    print("Retention sweep failed:", err)
+
+    def _expired(self, finished, sizes, now) -> list:
+        """Select finished jobs violating a policy, oldest first."""
+        keep = set(self.keep()) if self.keep else set()
+        finished = [job for job in finished if job[0] not in keep]
+        expired = set()
+        if self.max_age is not None:
+            expired.update(uuid for uuid, ended in finished
+                           if ended is None or ended < now - self.max_age)
+        if self.max_count is not None and len(finished) > self.max_count:
+            expired.update(uuid for uuid, _ in
+                           finished[:len(finished) - self.max_count])
+        if self.max_bytes is not None:
+            total = sum(size for size, _, _ in sizes.values())
+            total -= sum(sizes[uuid][0] for uuid in expired if uuid in sizes)
+            for uuid, _ in finished:
+                if total <= self.max_bytes:
+                    break
+                if uuid not in expired:
+                    expired.add(uuid)
+                    total -= sizes.get(uuid, (0, ))[0]
+        return [uuid for uuid, _ in finished if uuid in expired]
+
+    def sweep(self) -> dict:
+        """
+        Remove expired tasks and orphaned files once.
+
+        :returns dict:  number of removed jobs, files and reclaimed bytes
+        """
+        start = monotonic()
+        now = time()
+        sizes = scan(self.taskdir)
+        # scan before listing jobs: files of new tasks have a job row
+        known = set(self.joblist.uuids(None))
+        expired = self._expired(self.joblist.finished(), sizes, now)
+        orphans = [uuid for uuid, (_, mtime, _) in sizes.items()
+                   if uuid not in known and
+                   mtime < now - max(self.max_age or 0, GRACE)]
+        result = {'jobs': 0, 'files': 0, 'orphans': len(orphans),
+                  'bytes': 0, 'archive': None}
+        todo = expired + orphans
+        if todo and self.archive:
+            result['archive'] = self._archive(todo, sizes)
+        for pos in range(0, len(todo), self.batch):
+            chunk = todo[pos:pos + self.batch]
+            result['jobs'] += self.joblist.delete(
+                [uuid for uuid in chunk if uuid in known])
+            for uuid in chunk:
+                size, _, paths = sizes.get(uuid, (0, 0.0, []))
+                for path in paths:
+                    try:
+                        os.unlink(path)
+                        result['files'] += 1
+                    except FileNotFoundError:
+                        pass
+                result['bytes'] += size
+        with self._lock:
+            self._counters['sweeps'] += 1
+            self._counters['jobs_removed'] += result['jobs']
+            self._counters['files_removed'] += result['files']
+            self._counters['orphans_removed'] += result['orphans']
+            self._counters['bytes_reclaimed'] += result['bytes']
+            self._counters['archives'] += bool(result['archive'])
+            self._counters['last_sweep'] = now
+            self._counters['last_duration'] = monotonic() - start
+        if self.verbose and todo:
+            print("Retention:", result)
+        return result
+
+    def _archive(self, uuids, sizes) -> str:
+        """Write job descriptions and files of tasks to a tar.gz file."""
+        os.makedirs(self.archive, exist_ok=True)
+        stamp = strftime('%Y%m%d-%H%M%S')
+        name = os.path.join(self.archive, 'tasks-{}.tar.gz'.format(stamp))
+        seq = 0
+        while os.path.exists(name):
+            seq += 1
+            name = os.path.join(self.archive, 'tasks-{}-{}.tar.gz'.format(
+                stamp, seq))
+        with tarfile.open(name, 'x:gz') as tar:
+            for uuid in uuids:
+                job = self.joblist.get(uuid)
+                if job is not None:
+                    data = json.dumps(job, indent=2).encode('utf8')
+                    info = tarfile.TarInfo('{}/job.json'.format(uuid))
+                    info.size = len(data)
+                    info.mtime = job.get('finished') or time()
+                    tar.addfile(info, io.BytesIO(data))
+                for path in sizes.get(uuid, (0, 0.0, []))[2]:
+                    try:
+                        tar.add(path, arcname='{}/{}'.format(
+                            uuid, os.path.basename(path)))
+                    except FileNotFoundError:
+                        pass
+        return name
+
+    def stats(self) -> dict:
+        """Report policies and what was removed so far."""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['policy'] = {
+            'max_age': self.max_age,
+            'max_count': self.max_count,
+            'max_bytes': self.max_bytes,
+            'archive': self.archive,
+        }
+        return stats
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    from .jobdb import JobDB
+    x = Retention(JobDB(uri='file:app.db'), 'tasks', archive='archive')
+    print("sweep:   ", x.sweep())
+    print("stats:   ", x.stats())
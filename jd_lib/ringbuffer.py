@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""
+Bounded output buffer for task output captured through pipes.
+
+Output is kept in memory up to a size limit. Beyond the limit it is either
+spilled to a file (nothing gets lost, memory stays bounded) or, without a
+spill file, the oldest bytes are dropped like in a ring buffer.
+
+Readers address output by absolute byte offsets, so a client can fetch
+only the bytes it hasn't seen yet and wait for more to arrive.
+"""
+
+import threading
+
+BUFSIZE = 262144    # bytes kept in memory before spilling / dropping
+READSIZE = 65536    # default max. bytes returned by read()
+
+# --------- helpers ----------------------------------------------------------
+
+
+def read_file(file, offset=0, size=READSIZE) -> bytes:
+    """Read size bytes starting at offset from a file, b'' if missing."""
+    try:
+        with open(file, 'rb') as file_handle:
+            file_handle.seek(offset)
+            return file_handle.read(size)
+    except FileNotFoundError:
+        return b''
+
+
+def utf8_cut(data) -> bytes:
+    """Strip an incomplete UTF-8 sequence from the end of data."""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 == 0x80:
+            continue        # continuation byte, look further back
+        if byte < 0x80:
+            need = 1
+        elif byte >= 0xF0:
+            need = 4
+        elif byte >= 0xE0:
+            need = 3
+        else:
+            need = 2
+        return data if need <= back else data[:-back]
+    return data
+
+# --------- output buffer ----------------------------------------------------
+
+
+class RingBuffer():
+    """Bounded in-memory buffer with optional spill file."""
+
+    def __init__(self, limit=BUFSIZE, spill=None, durable=False):
+        """
+        Update internal class default values if needed.
+
+        :param limit:    max. bytes kept in memory
+        :param spill:    file name for output beyond the limit, None drops
+                         the oldest bytes instead
+        :param durable:  write everything to the spill file right away
+        """
+        self._limit = limit
+        self._spill = spill
+        self._file = None
+        self._buf = bytearray()
+        self._start = 0         # absolute offset of the first byte in _buf
+        self._total = 0         # bytes written so far
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._closed = False
+        if spill and durable:
+            self._open()
+
+    def _open(self) -> None:
+        """Switch to the spill file, move buffered bytes there."""
+        self._file = open(self._spill, 'xb')
+        self._file.write(self._buf)
+        self._file.flush()
+        self._buf = bytearray()
+
+    @property
+    def spilled(self) -> bool:
+        """True if the output went to the spill file."""
+        return self._file is not None
+
+    @property
+    def total(self) -> int:
+        """Number of bytes written so far."""
+        return self._total
+
+    @property
+    def closed(self) -> bool:
+        """True if no more output will arrive."""
+        return self._closed
+
+    def write(self, data) -> int:
+        """Append data, spill or drop old data if the limit is exceeded."""
+        with self._lock:
+            self._total += len(data)
+            if self._file is None and \
+               len(self._buf) + len(data) > self._limit:
+                if self._spill:
+                    self._open()
+                else:
+                    self._buf += data
+                    drop = len(self._buf) - self._limit
+                    del self._buf[:drop]
+                    self._start += drop
+                    self._changed.notify_all()
+                    return len(data)
+            if self._file is not None:
+                self._file.write(data)
+                self._file.flush()
+            else:
+                self._buf += data
+            self._changed.notify_all()
+        return len(data)
+
+    def read(self, offset=0, size=READSIZE) -> tuple:
+        """
+        Read output starting at an absolute byte offset.
+
+        :param offset:   first byte wanted
+        :param size:     max. number of bytes
+        :returns tuple:  offset of the first returned byte (larger than
+                         requested if that part was dropped), data
+        """
+        with self._lock:
+            if self._file is None:
+                offset = max(offset, self._start)
+                pos = offset - self._start
+                return offset, bytes(self._buf[pos:pos + size])
+        return offset, read_file(self._spill, offset, size)
+
+    def wait(self, offset=0, timeout=None) -> bool:
+        """Wait until there is output beyond offset or the buffer closed."""
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self._total > offset or self._closed, timeout)
+
+    def getvalue(self) -> bytes:
+        """Return all retained output."""
+        with self._lock:
+            if self._file is None:
+                return bytes(self._buf)
+        with open(self._spill, 'rb') as file_handle:
+            return file_handle.read()
+
+    def close(self) -> None:
+        """Close the spill file (if any)."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._closed = True
+            self._changed.notify_all()
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    x = RingBuffer(limit=8)
+    x.write(b'hello ')
+    x.write(b'world')
+    print("retained:", x.getvalue(), "of", x.total, "bytes")
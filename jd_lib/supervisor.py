@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Supervisor reaping task processes.
+
+One thread watches all task processes instead of one waiting thread per
+task. On Linux (5.3+) every process gets a pidfd which becomes readable
+when the process exits, all pidfds are watched with one selector. Where
+pidfds aren't available the processes are polled. The exit status is
+collected right away (no zombies), the exit callbacks run in a small
+thread pool as they may block for a moment (e.g. draining output pipes).
+
+Only the registered processes are waited for, never waitpid(-1), so
+subprocess.Popen objects elsewhere in the application keep working.
+
+Processes which aren't children of this process (e.g. tasks started
+before a restart) can be watched by pid as well.
+"""
+
+import os
+import selectors
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+POLLTIME = 0.2      # seconds between polls without pidfd support
+WORKERS = 4         # threads running exit callbacks
+
+# --------- helpers ----------------------------------------------------------
+
+
+def pidfd(pid) -> int:
+    """Open a pidfd for a process, None if not supported or gone."""
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def alive(pid, name=None) -> bool:
+    """
+    Check if a process exists (and belongs to this user).
+
+    :param pid:   process id
+    :param name:  string expected in the command line of the process, to
+                  tell a reused pid apart (Linux /proc only)
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, PermissionError):
+        return False
+    if name:
+        try:
+            with open('/proc/{}/cmdline'.format(pid), 'rb') as file_handle:
+                cmdline = file_handle.read().decode('utf8', 'replace')
+        except FileNotFoundError:
+            # just exited, or no /proc to check against
+            return not os.path.isdir('/proc/self')
+        return name in cmdline
+    return True
+
+# --------- supervisor -------------------------------------------------------
+
+
+class Supervisor():
+    """Watch processes, run a callback once each of them has exited."""
+
+    def __init__(self, workers=WORKERS, verbose=0):
+        """
+        Update internal class default values if needed.
+
+        :param workers:  number of threads running exit callbacks
+        :param verbose:  set verbosity level for debug and logging
+        """
+        self.verbose = verbose
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = os.pipe()
+        os.set_blocking(self._wakeup[0], False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+        self._pending = []
+        self._polled = {}
+        self._lock = threading.Lock()
+        self._stop = False
+        self._thread = None
+        self._workers = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='reaper')
+        self._counters = {'watched': 0, 'exited': 0, 'pidfd': 0,
+                          'polled': 0}
+
+    def watch(self, proc, callback) -> None:
+        """Call callback() after the subprocess.Popen *proc* has exited."""
+        self._add(proc.pid, proc.poll, callback)
+
+    def watch_pid(self, pid, callback, name=None) -> None:
+        """Call callback() after a process (not necessarily a child) exits."""
+        def check():
+            return None if alive(pid, name) else 0
+        self._add(pid, check, callback)
+
+    def _add(self, pid, check, callback) -> None:
+        """Queue a process for the supervisor thread."""
+        with self._lock:
+            self._pending.append((pid, check, callback))
+            self._counters['watched'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop,
+                                                daemon=True,
+                                                name='supervisor')
+                self._thread.start()
+        os.write(self._wakeup[1], b'\0')
+
+    def _register(self) -> None:
+        """Set up watching queued processes, in the supervisor thread."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for pid, check, callback in pending:
+            fd = pidfd(pid)
+            if fd is None:
+                self._polled[pid] = (check, callback)
+                self._counters['polled'] += 1
+            else:
+                self._selector.register(fd, selectors.EVENT_READ,
+                                        (pid, check, callback))
+                self._counters['pidfd'] += 1
+
+    def _exited(self, check, callback) -> None:
+        """Collect the exit status and hand the callback to a worker."""
+        check()
+        self._counters['exited'] += 1
+        self._workers.submit(self._run, callback)
+
+    def _run(self, callback) -> None:
+        try:
+            callback()
+        except Exception as err:
+            # a failing callback must not stop reaping other processes
+            print("Exit callback failed:", repr(err))
+
+    def _loop(self) -> None:
+        while not self._stop:
+            timeout = POLLTIME if self._polled else None
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        os.read(self._wakeup[0], 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._selector.unregister(key.fd)
+                os.close(key.fd)
+                self._exited(*key.data[1:])
+            self._register()
+            for pid, (check, callback) in list(self._polled.items()):
+                if check() is not None:
+                    del self._polled[pid]
+                    self._exited(check, callback)
+
+    def close(self) -> None:
+        """Stop watching (e.g. on shutdown), exit callbacks won't run."""
+        self._stop = True
+        os.write(self._wakeup[1], b'\0')
+        if self._thread is not None:
+            self._thread.join()
+        self._workers.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        """Report number of watched and exited processes."""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['watching'] = len(self._selector.get_map()) - 1 + \
+            len(self._polled)
+        return stats
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    import subprocess
+    x = Supervisor()
+    done = threading.Event()
+    p = subprocess.Popen(['sleep', '0.2'])
+    x.watch(p, done.set)
+    print("exited:  ", done.wait(5), p.returncode)
+    print("stats:   ", x.stats())
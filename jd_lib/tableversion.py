@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+"""
+Change counters for SQLite3 tables.
+
+Triggers bump a per-table version number on every INSERT, UPDATE and
+DELETE, so caches can detect changes with a single primary key lookup -
+including changes made by other processes or the sqlite3 shell.
+"""
+
+VERSIONTABLE = 'tableversion'
+
+# --------- database interactions --------------------------------------------
+
+
+def track(conn, table) -> bool:
+    """Create version table entry and triggers for a table (if needed)."""
+    query = '''CREATE TABLE IF NOT EXISTS {} (
+                name    TEXT PRIMARY KEY NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            );'''.format(VERSIONTABLE)
+    conn.execute(query)
+    query = 'INSERT OR IGNORE INTO {} (name, version) VALUES (?, 0);'.format(
+        VERSIONTABLE)
+    conn.execute(query, [table, ])
+    for action in ('INSERT', 'UPDATE', 'DELETE'):
+        query = '''CREATE TRIGGER IF NOT EXISTS {table}_version_{act}
+                    AFTER {action} ON {table}
+                    BEGIN
+                        UPDATE {vtable} SET version=version+1
+                            WHERE name='{table}';
+                    END;'''.format(table=table, act=action.lower(),
+                                   action=action, vtable=VERSIONTABLE)
+        conn.execute(query)
+    return True
+
+
+def version(conn, table) -> int:
+    """Fetch current version number of a table."""
+    query = 'SELECT version FROM {} WHERE name=?;'.format(VERSIONTABLE)
+    row = conn.execute(query, [table, ]).fetchone()
+    if row is None:
+        return None
+    return row[0]
@@ -9,26 +9,74 @@ CmdTask is executing tasks and fetching results.
 
 import os
 import json
+import heapq
+import sqlite3
+import threading
+from collections import OrderedDict
+from itertools import count
+from time import time, monotonic
 from uuid import uuid4
-# from jd_lib import KeyValueDB, CmdTask
-from .keyvaluedb import KeyValueDB
-from .cmdtask import CmdTask
+# from jd_lib import JobDB, CmdTask
+from .jobdb import JobDB
+from .cmdtask import CmdTask, READSIZE
+from .retention import Retention
+from .resultcache import ResultCache
+from .supervisor import Supervisor, alive
+
+MAXRUNNING = 8      # max. number of tasks running at the same time
+MAXQUEUE = 256      # max. number of tasks waiting for a free slot
+KEEPDONE = 64       # finished tasks kept in memory (captured output)
 
 # -------------- task queue -------------------------------------------------
 
 
+class QueueFullError(Exception):
+    """Raised by TaskMgr.add() if the admission queue is full."""
+
+    def __init__(self, depth):
+        """Keep the queue depth for the caller (e.g. for a 429 reply)."""
+        super().__init__('task queue full ({} tasks waiting)'.format(depth))
+        self.depth = depth
+
+
 class TaskMgr():
     """Task object class for async start/monitor of external jobs."""
 
     verbose = 0
-    joblist = KeyValueDB(table='tasks')
     queue = None
     taskdir = None
 
-    def __init__(self, verbose=None):
-        """Update internal class default values if needed."""
+    def __init__(self, verbose=None, max_running=MAXRUNNING,
+                 max_queue=MAXQUEUE, retention=None, cache=None, uri=None):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:      set verbosity level for debug and logging
+        :param max_running:  max. number of concurrently running tasks
+        :param max_queue:    max. number of queued tasks, then add() fails
+        :param retention:    retention policies (see Retention) for
+                             finished tasks, None keeps everything
+        :param cache:        result cache settings (see ResultCache) for
+                             read-only commands, None disables caching
+        :param uri:          database DSN of the job table
+        """
         if verbose:
             self.verbose = verbose
+        # per instance, i.e. per worker process after the pool is configured
+        self.joblist = JobDB(table='jobs', uri=uri)
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self._active = {}
+        self._done = OrderedDict()
+        self._queue = []
+        self._running = 0
+        self._seq = count()
+        self._stats = {}
+        self._adopted = set()
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._supervisor = Supervisor(verbose=self.verbose)
         # cwd = os.path.abspath(os.getcwd())
         # cwd = os.getcwd()
         cwd = '.'
@@ -41,6 +89,17 @@ class TaskMgr():
             if self.verbose > 2:
                 print(err)
             os.mkdir(self.taskdir)
+        self.retention = None
+        if retention is not None:
+            self.retention = Retention(self.joblist, self.taskdir,
+                                       keep=self._retained,
+                                       verbose=self.verbose, **retention)
+            self.retention.start()
+        self.cache = None
+        if cache is not None:
+            self.cache = ResultCache(valid=self._cacheable, **cache)
+        # pick up tasks still running from before a restart
+        self.fixer()
 
     def _uuid(self) -> str:
         """Create new UUID as string."""
@@ -55,80 +114,414 @@ class TaskMgr():
             return False
         if self.verbose:
             print("Update: ", job)
-        self.joblist.set(job['uuid'], json.dumps(job))
+        if job['status'] not in ('created', 'running') and \
+           not job.get('finished'):
+            job['finished'] = time()
+        self.joblist.set(job)
         return True
 
     def _job_query(self, uuid=None) -> dict:
-        """Query DB for job['uuid']."""
+        """Query DB for job['uuid'], or list uuids of running jobs."""
         if uuid is None:
-            uuids = list()
-            for k in self.joblist.get():
-                # print("K: ",k)
-                result = self.joblist.get(k)
-                # print("R: ",result)
-                if result is None:
-                    return None
-                value = json.loads(result['value'])
-                # print("V: ", value)
-                if value['status'] == 'running':
-                    uuids.append(k)
-            return uuids
+            return self.joblist.uuids('running')
         if self.verbose:
             print("Query: ", uuid)
-        res = self.joblist.get(uuid)
-        if res is None:
-            return None
-        return json.loads(res['value'])
+        return self.joblist.get(uuid)
+
+    def add(self, params=None, task_type='cmd', priority=0,
+            callback=None) -> str:
+        """
+        Add new task to job list.
+
+        The task starts right away if there's a free slot, otherwise it is
+        queued (status 'created'). Lower priority values start first, tasks
+        with the same priority in FIFO order.
 
-    def add(self, params=None, task_type='cmd') -> str:
-        """Add new task to job list."""
+        :param params:     task parameters (command, options, ...)
+        :param task_type:  task type, only 'cmd' is supported
+        :param priority:   queue priority
+        :param callback:   called with the job once the task has ended
+        :returns str:      task uuid, None if the task is invalid
+        :raises QueueFullError: if max_queue tasks are waiting already
+        """
         if params is None:
             return None
         job = {
             "uuid": self._uuid(),
             "type": task_type,
             "params": params,
-            "status": 'created'
+            "status": 'created',
+            "created": time(),
+            "owner": os.getpid()
         }
         job["location"] = os.sep.join([self.taskdir, job['uuid']])
+        if job['type'] != 'cmd':
+            return None
+        cmd_task = CmdTask(job)
+        if not cmd_task.check():
+            return None
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(len(self._queue))
+            self._active[job['uuid']] = cmd_task
+            if callback is not None:
+                self._callbacks[job['uuid']] = callback
+            heapq.heappush(self._queue,
+                           (priority, next(self._seq), job['uuid']))
+            self._count(task_type, 'queued')
         self._job_update(job)
-        if job['type'] == 'cmd':
-            cmd_task = CmdTask(job)
-            pid = cmd_task.run()
+        self._schedule()
+        return job['uuid']
+
+    def run(self, params=None, timeout=None, readonly=False,
+            priority=0) -> dict:
+        """
+        Run a task in the foreground, wait for it and return its status.
+
+        Results of read-only commands come from the result cache (if
+        enabled): concurrent identical requests share one task.
+
+        :param params:    task parameters (command, options, ...)
+        :param timeout:   max. seconds to wait for the task
+        :param readonly:  command has no side effects, may be cached
+        :param priority:  queue priority
+        :returns dict:    task status as from status(verbose=True), None
+                          if the task is invalid
+        :raises QueueFullError: if max_queue tasks are waiting already
+        """
+        if params is None:
+            return None
+        if readonly and self.cache is not None:
+            key = json.dumps(params, sort_keys=True)
+            return self.cache.get(
+                key, lambda: self._run(params, timeout, priority))
+        return self._run(params, timeout, priority)
+
+    def _run(self, params, timeout, priority) -> dict:
+        uuid = self.add(dict(params), priority=priority)
+        if uuid is None:
+            return None
+        return self.wait(uuid, timeout=timeout, verbose=True)
+
+    @staticmethod
+    def _cacheable(status) -> bool:
+        """Cache only results of tasks which finished successfully."""
+        return status is not None and status.get('RC') == '0'
+
+    def _retained(self) -> list:
+        """Uuids of tasks held in memory, retention must not remove them."""
+        with self._lock:
+            return list(self._active) + list(self._done)
+
+    def _count(self, task_type, counter, value=1) -> None:
+        """Update per task type statistics, call with lock held."""
+        stats = self._stats.setdefault(task_type, {
+            'queued': 0, 'started': 0, 'finished': 0, 'failed': 0,
+            'wait_time': 0.0, 'wait_max': 0.0,
+            'run_time': 0.0, 'run_max': 0.0,
+        })
+        if counter.endswith('_time'):
+            stats[counter] += value
+            maxkey = counter.replace('_time', '_max')
+            stats[maxkey] = max(stats[maxkey], value)
         else:
+            stats[counter] += value
+
+    def _schedule(self) -> None:
+        """Start queued tasks while there are free slots."""
+        while True:
+            with self._lock:
+                if self._running >= self.max_running or not self._queue:
+                    return
+                uuid = heapq.heappop(self._queue)[2]
+                cmd_task = self._active[uuid]
+                self._running += 1
+            self._start(cmd_task)
+
+    def _start(self, cmd_task) -> None:
+        """Run a task, the supervisor reaps its process."""
+        job = cmd_task.task
+        try:
+            pid = cmd_task.run()
+        except Exception as err:
+            # the slot must be freed whatever went wrong
+            print("Task start failed:", repr(err))
             pid = None
-        if pid is None:
-            return None
-        if pid:
-            job['status'] = 'running'
+        if not pid:
+            # command not found has an exit code (127, as from a shell)
+            job['status'] = 'finished' if cmd_task.rc is not None \
+                else 'failed'
+            cmd_task.done.set()
+            self._finish(job)
+            return
+        job['status'] = 'running'
+        job['pid'] = pid
+        job['started'] = time()
+        self._job_update(job)
+        with self._lock:
+            self._count(job['type'], 'started')
+            self._count(job['type'], 'wait_time',
+                        job['started'] - job['created'])
+
+        def exited():
+            cmd_task.reap()
+            job['status'] = cmd_task.status()['status']
+            self._finish(job)
+
+        self._supervisor.watch(cmd_task.proc, exited)
+
+    def _finish(self, job) -> None:
+        """Record end of a task, free its slot and start the next one."""
+        try:
             self._job_update(job)
-        return job['uuid']
+        except sqlite3.Error as err:
+            # wake waiters anyway, fixer() repairs the job after a restart
+            print("Job update failed:", repr(err))
+        with self._lock:
+            cmd_task = self._active.pop(job['uuid'], None)
+            if cmd_task is not None:
+                self._done[job['uuid']] = cmd_task
+                while len(self._done) > KEEPDONE:
+                    self._done.popitem(last=False)
+                self._changed.notify_all()
+            self._running -= 1
+            if job['status'] == 'finished':
+                self._count(job['type'], 'finished')
+            else:
+                self._count(job['type'], 'failed')
+            if job.get('started'):
+                self._count(job['type'], 'run_time',
+                            job['finished'] - job['started'])
+            callback = self._callbacks.pop(job['uuid'], None)
+        self._schedule()
+        if callback is not None:
+            callback(job)
+
+    def reserve(self, timeout=0) -> None:
+        """
+        Take a running slot for a process started outside the task list.
+
+        Streamed transfers (e.g. podman save/load through pipes) can't
+        have their output buffered like a task, they still count against
+        max_running. Give the slot back with release().
+
+        :param timeout:  max. seconds to wait for a free slot
+        :raises QueueFullError: if no slot became free in time
+        """
+        with self._changed:
+            if not self._changed.wait_for(
+                    lambda: self._running < self.max_running and
+                    not self._queue, timeout):
+                raise QueueFullError(len(self._queue))
+            self._running += 1
+
+    def release(self) -> None:
+        """Give back a slot taken by reserve(), start the next task."""
+        with self._changed:
+            self._running -= 1
+            self._changed.notify_all()
+        self._schedule()
+
+    def stats(self) -> dict:
+        """Report queue length, running tasks and per type timings."""
+        with self._lock:
+            stats = {
+                'running': self._running,
+                'queued': len(self._queue),
+                'max_running': self.max_running,
+                'max_queue': self.max_queue,
+                'types': {k: dict(v) for k, v in self._stats.items()},
+            }
+        for typestats in stats['types'].values():
+            started = typestats['started'] or 1
+            done = (typestats['finished'] + typestats['failed']) or 1
+            typestats['wait_avg'] = typestats['wait_time'] / started
+            typestats['run_avg'] = typestats['run_time'] / done
+        stats['supervisor'] = self._supervisor.stats()
+        if self.retention is not None:
+            stats['retention'] = self.retention.stats()
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+    def close(self, timeout=None) -> bool:
+        """
+        Shut down, e.g. when a server worker exits.
+
+        Queued tasks are cancelled and new ones refused, running tasks get
+        up to timeout seconds to finish, then the retention sweeper and the
+        supervisor stop. Tasks still running are adopted after a restart.
+
+        :param timeout:  max. seconds to wait, None waits forever
+        :returns bool:   True if no task was left running
+        """
+        with self._lock:
+            self.max_queue = 0
+            cancelled = [self._active[entry[2]] for entry in self._queue]
+            self._queue = []
+        for cmd_task in cancelled:
+            cmd_task.task['status'] = 'cancelled'
+            self._job_update(cmd_task.task)
+        with self._changed:
+            for cmd_task in cancelled:
+                del self._active[cmd_task.task['uuid']]
+                self._callbacks.pop(cmd_task.task['uuid'], None)
+            self._changed.notify_all()
+            idle = self._changed.wait_for(lambda: not self._running, timeout)
+        if self.retention is not None:
+            self.retention.stop()
+        self._supervisor.close()
+        return idle
+
+    def wait(self, uuid=None, timeout=None, verbose=False) -> dict:
+        """
+        Wait until a task has finished, then fetch its status.
+
+        Returns immediately for tasks which aren't running (anymore).
+
+        :param uuid:     task id
+        :param timeout:  max. seconds to wait, None waits forever
+        :param verbose:  include output and job description
+        :returns dict:   task status as from status()
+        """
+        with self._changed:
+            # finished tasks leave _active after the job list update
+            self._changed.wait_for(lambda: uuid not in self._active,
+                                   timeout)
+        return self.status(uuid, verbose=verbose)
+
+    def _task(self, uuid) -> CmdTask:
+        """CmdTask object of a task, from memory or from the job list."""
+        with self._lock:
+            cmd_task = self._active.get(uuid) or self._done.get(uuid)
+        if cmd_task is not None or uuid is None:
+            return cmd_task
+        job = self._job_query(uuid)
+        if job is None or job['type'] != 'cmd':
+            return None
+        return CmdTask(job)
+
+    def output(self, uuid=None, stream='stdout', offset=0,
+               size=READSIZE) -> dict:
+        """
+        Fetch task output from a byte offset on, see CmdTask.output().
+
+        :returns dict:  output chunk, None for unknown tasks
+        """
+        cmd_task = self._task(uuid)
+        if cmd_task is None:
+            return None
+        return cmd_task.output(stream, offset, size)
+
+    def tail(self, uuid=None, stream='stdout', offset=0, size=READSIZE,
+             timeout=None):
+        """
+        Follow task output, yield output chunks until the task finished.
+
+        Chunks without data are yielded every *timeout* seconds while
+        nothing happens (e.g. to send keep-alives).
+
+        :returns generator:  output chunks, None for unknown tasks
+        """
+        cmd_task = self._task(uuid)
+        if cmd_task is None:
+            return None
+
+        def follow(offset):
+            waited = 0.0
+            while True:
+                chunk = cmd_task.output(stream, offset, size)
+                offset = chunk['next']
+                if chunk['data'] or chunk['complete'] or \
+                   (timeout is not None and waited >= timeout):
+                    waited = 0.0
+                    yield chunk
+                if chunk['complete']:
+                    return
+                if chunk['data']:
+                    continue
+                start = monotonic()
+                cmd_task.wait_output(stream, offset, timeout)
+                waited += monotonic() - start
+
+        return follow(offset)
 
     def fixer(self) -> bool:
-        """Go through running tasks in job list and update status."""
-        for uuid in self._job_query():
-            job = self._job_query(uuid)
-            if job['type'] == 'cmd':
-                cmd_task = CmdTask(job)
-                taskstate = cmd_task.status()
+        """
+        Adopt running tasks in the job list which this manager doesn't own.
+
+        Tasks started before a restart are watched by pid until they exit,
+        tasks without a living process get their final status right away.
+        """
+        for job in self.joblist.list('running'):
+            if job.get('owner') not in (None, os.getpid()) and \
+               alive(job['owner']):
+                continue    # another worker process manages this task
+            with self._lock:
+                if job['uuid'] in self._active or \
+                   job['uuid'] in self._adopted:
+                    continue
+                self._adopted.add(job['uuid'])
+            if job['type'] == 'cmd' and alive(job.get('pid'),
+                                              self._cmdline(job)):
+                self._supervisor.watch_pid(
+                    job['pid'], lambda job=job: self._orphan_exit(job),
+                    self._cmdline(job))
             else:
-                taskstate = {'status': 'invalid'}
-            job['status'] = taskstate['status']
-            self._job_update(job)
+                self._orphan_exit(job)
         return True
 
+    @staticmethod
+    def _cmdline(job) -> str:
+        """Part of the command line identifying the process of a task."""
+        params = job.get('params') or {}
+        if params.get('capture') == 'file':
+            return job['location']
+        return params.get('command')
+
+    def _orphan_exit(self, job) -> None:
+        """Record final status of a task this manager didn't start."""
+        if job['type'] == 'cmd':
+            taskstate = CmdTask(job).status()
+        else:
+            taskstate = {'status': 'invalid'}
+        if taskstate['status'] == 'running':
+            # exit code got lost with the previous task manager
+            taskstate['status'] = 'failed'
+        job['status'] = taskstate['status']
+        self._job_update(job)
+        with self._lock:
+            self._adopted.discard(job['uuid'])
+
+    def job(self, uuid=None) -> dict:
+        """Fetch job description (parameters, timestamps) of a task."""
+        with self._lock:
+            cmd_task = self._active.get(uuid) or self._done.get(uuid)
+        if cmd_task is not None:
+            return dict(cmd_task.task)
+        return self._job_query(uuid) if uuid is not None else None
+
+    def jobs(self, status=None) -> list:
+        """List all jobs, or all jobs in a given state."""
+        return self.joblist.list(status)
+
     def status(self, uuid=None, verbose=False) -> dict:
         """Fetch status of a given task from job list."""
         if uuid is None:
             return self._job_query()
         job = self._job_query(uuid)
+        if job is None:
+            return None
         if job['type'] == 'cmd':
-            cmd_task = CmdTask(job)
+            with self._lock:
+                cmd_task = self._active.get(uuid) or self._done.get(uuid)
+            if cmd_task is None:
+                cmd_task = CmdTask(job)
             taskstate = cmd_task.status(verbose=verbose)
         else:
             taskstate = {'status': 'invalid'}
+        # the job list is updated once the task exits, not on every query
         job['status'] = taskstate['status']
-        self._job_update(job)
         if verbose:
             taskstate['job'] = job
         return taskstate
@@ -149,5 +542,6 @@ if __name__ == '__main__':
     print("Tasks running: {}".format(len(x.status())))
     if tid is not None:
         print("Task status:   {}".format(x.status(tid)))
+        print("Task finished: {}".format(x.wait(tid, timeout=5)))
         print("Tasks running: {}".format(len(x.status())))
         print("Task verbose status:\n{}".format(x.status(tid, verbose=True)))
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
 """Import submodules into one namespace."""
-from .items import Items
+from .items import Items, ItemsBatch, ItemsExport
+from .tasks import Tasks, TaskOutput
 # from .podman import Podman
 # from .k8s    import Kubernetes
 
 if True is False:
     TestInit = Items()
+    TestInit = ItemsBatch()
+    TestInit = ItemsExport()
+    TestInit = Tasks()
+    TestInit = TaskOutput()
     # TestInit = Podman()
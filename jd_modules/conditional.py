@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""
+Conditional GET helpers for the Flask resources.
+
+Resources derive a strong entity tag from something cheap - a table
+version counter, an inventory digest - and check If-None-Match before
+doing the expensive part (the SELECT, the podman command). Clients
+revalidating an unchanged listing get a bodyless 304.
+"""
+
+import json
+import calendar
+import hashlib
+from flask import request
+from werkzeug.http import http_date, quote_etag
+
+# --------- helpers ----------------------------------------------------------
+
+
+def make_etag(*parts) -> str:
+    """Entity tag of the given parts (versions, digests, URL, ...)."""
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+
+def not_modified(etag=None, mtime=None) -> bool:
+    """
+    Check the request's validators against the current ones.
+
+    If-None-Match wins over If-Modified-Since (RFC 7232, 3.3). Tags of
+    compressed replies ('<tag>-gzip', see encoding.py) match their tag.
+
+    :param etag:    current entity tag (unquoted)
+    :param mtime:   modification time, seconds since the epoch
+    :returns bool:  True if a 304 reply will do
+    """
+    if request.if_none_match:
+        if etag is None:
+            return False
+        if request.if_none_match.contains_weak(etag):
+            return True
+        return etag in {tag.partition('-')[0] for tag in
+                        request.if_none_match.as_set(include_weak=True)}
+    since = request.if_modified_since
+    if mtime is None or since is None:
+        return False
+    # HTTP dates have a resolution of one second, werkzeug < 2.0 returns
+    # naive UTC datetimes, which timestamp() would take as local time
+    return int(mtime) <= calendar.timegm(since.utctimetuple())
+
+
+def validators(etag=None, mtime=None) -> dict:
+    """Response headers for the current entity tag and modification time."""
+    headers = {}
+    if etag is not None:
+        headers['ETag'] = quote_etag(etag)
+    if mtime is not None:
+        headers['Last-Modified'] = http_date(mtime)
+    return headers
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    print(make_etag(42, '/api/v1.0/items?limit=10'))
+    print(validators(make_etag(42), 1700000000.5))
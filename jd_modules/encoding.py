@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""
+Response encoding: JSON serialisation and content compression.
+
+output_json() replaces the flask-restx JSON representation. It uses
+orjson when installed and serialises long lists piecewise, so a big
+listing is sent while it's still being encoded instead of being built up
+as one string first.
+
+Compression is an after_request hook: the best coding the client accepts
+(zstd and brotli if their modules are installed, gzip always) is applied
+to compressible bodies above a size threshold, streamed bodies are
+compressed chunk by chunk. Compressed responses get the coding appended
+to their ETag ('<tag>-gzip'), see conditional.not_modified().
+"""
+
+import json
+import zlib
+from itertools import chain
+from flask import current_app, request
+try:
+    import orjson
+except ImportError:         # optional, faster JSON encoder
+    orjson = None
+try:
+    import brotli
+except ImportError:         # optional, 'br' content coding
+    brotli = None
+try:
+    import zstandard
+except ImportError:         # optional, 'zstd' content coding
+    zstandard = None
+
+MINSIZE = 1024      # bytes, smaller bodies are sent as they are
+STREAMITEMS = 1000  # list entries serialised per chunk of a streamed body
+CODINGS = ('zstd', 'br', 'gzip')    # server preference on equal quality
+LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/csv',
+                'text/plain', 'text/html')
+
+# --------- JSON serialisation -----------------------------------------------
+
+
+def dumps(data) -> bytes:
+    """Serialise to compact UTF-8 JSON, with orjson if available."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass    # e.g. integers beyond 64 bit, json can do these
+    return json.dumps(data, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf8')
+
+
+def _iter_list(values, size):
+    sep = b'['
+    for start in range(0, len(values), size):
+        yield sep + b','.join(dumps(value)
+                              for value in values[start:start + size])
+        sep = b','
+    yield b']'
+
+
+def streamed(data, size=STREAMITEMS) -> bool:
+    """True if iter_json() splits data into chunks."""
+    if isinstance(data, dict):
+        return any(isinstance(value, list) and len(value) > size
+                   for value in data.values())
+    return isinstance(data, list) and len(data) > size
+
+
+def iter_json(data, size=STREAMITEMS):
+    """
+    Serialise to JSON in pieces, lists longer than size chunk by chunk.
+
+    :param data:    JSON serialisable object
+    :param size:    list entries per chunk
+    :returns:       iterator of bytes
+    """
+    if not streamed(data, size):
+        yield dumps(data)
+    elif isinstance(data, list):
+        yield from _iter_list(data, size)
+    else:
+        sep = b'{'
+        for key, value in data.items():
+            yield sep + dumps(str(key)) + b':'
+            sep = b','
+            if isinstance(value, list) and len(value) > size:
+                yield from _iter_list(value, size)
+            else:
+                yield dumps(value)
+        yield b'}'
+
+
+def output_json(data, code, headers=None):
+    """flask-restx representation for 'application/json'."""
+    if streamed(data):
+        body = chain(iter_json(data), [b'\n'])
+    else:
+        body = dumps(data) + b'\n'
+    response = current_app.response_class(body, status=code,
+                                          mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
+
+# --------- content codings --------------------------------------------------
+
+
+class GzipCoder():
+    """gzip content coding (zlib, always available)."""
+
+    def __init__(self, level=LEVELS['gzip']):
+        """Start a gzip stream."""
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, flush=False) -> bytes:
+        """Compress data, flush for streams so clients see it right away."""
+        out = self._obj.compress(data)
+        if flush:
+            out += self._obj.flush(zlib.Z_SYNC_FLUSH)
+        return out
+
+    def finish(self) -> bytes:
+        """End of the stream."""
+        return self._obj.flush()
+
+
+class BrotliCoder():
+    """br content coding (brotli module)."""
+
+    def __init__(self, level=LEVELS['br']):
+        """Start a brotli stream."""
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data, flush=False) -> bytes:
+        """Compress data, flush for streams so clients see it right away."""
+        out = self._obj.process(data)
+        if flush:
+            out += self._obj.flush()
+        return out
+
+    def finish(self) -> bytes:
+        """End of the stream."""
+        return self._obj.finish()
+
+
+class ZstdCoder():
+    """zstd content coding (zstandard module)."""
+
+    def __init__(self, level=LEVELS['zstd']):
+        """Start a zstd frame."""
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data, flush=False) -> bytes:
+        """Compress data, flush for streams so clients see it right away."""
+        out = self._obj.compress(data)
+        if flush:
+            out += self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return out
+
+    def finish(self) -> bytes:
+        """End of the frame."""
+        return self._obj.flush()
+
+
+CODERS = {'gzip': GzipCoder}
+if brotli is not None:
+    CODERS['br'] = BrotliCoder
+if zstandard is not None:
+    CODERS['zstd'] = ZstdCoder
+
+# --------- after_request hook -----------------------------------------------
+
+
+class Compression():
+    """Compress responses with the best coding the client accepts."""
+
+    def __init__(self, min_size=MINSIZE, codings=CODINGS, levels=None):
+        """
+        Update internal class default values if needed.
+
+        :param min_size:  smaller (not streamed) bodies aren't compressed
+        :param codings:   content codings in order of preference, the
+                          ones without installed module are skipped
+        :param levels:    compression level per coding
+        """
+        self.min_size = min_size
+        self.codings = [coding for coding in codings if coding in CODERS]
+        self.levels = dict(LEVELS)
+        if levels:
+            self.levels.update(levels)
+
+    def _coder(self, response):
+        """Coder for the response, None if it's sent as it is."""
+        if response.status_code < 200 or \
+           response.status_code in (204, 206, 304) or \
+           response.direct_passthrough or \
+           'Content-Encoding' in response.headers or \
+           response.mimetype not in COMPRESSIBLE:
+            return None
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and \
+           response.calculate_content_length() < self.min_size:
+            return None
+        coding = request.accept_encodings.best_match(self.codings)
+        if coding is None:
+            return None
+        return coding, CODERS[coding](self.levels[coding])
+
+    @staticmethod
+    def _stream(chunks, coder):
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf8')
+                data = coder.compress(chunk, flush=True)
+                if data:
+                    yield data
+            yield coder.finish()
+        finally:
+            # e.g. stream_with_context() ends the request context on close
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def response(self, response):
+        """after_request hook, compress the response body."""
+        found = self._coder(response)
+        if found is None:
+            return response
+        coding, coder = found
+        if response.is_streamed:
+            response.response = self._stream(response.response, coder)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(coder.compress(response.get_data()) +
+                              coder.finish())
+        response.headers['Content-Encoding'] = coding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag('{}-{}'.format(etag, coding), weak)
+        return response
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+    items = [{'id': num, 'name': 'name%d' % num, 'value': 'value%d' % num}
+             for num in range(100000)]
+    print("JSON encoder: ", 'orjson' if orjson is not None else 'json')
+    print("codings:      ", ', '.join(CODERS))
+    start = perf_counter()
+    body = b''.join(iter_json({'items': items}))
+    print("serialised:    {} bytes, {:.1f} ms".format(
+        len(body), (perf_counter() - start) * 1000))
+    for name, factory in CODERS.items():
+        start = perf_counter()
+        x = factory()
+        size = len(x.compress(body) + x.finish())
+        print("{:14s}{} bytes, {:.1f} ms".format(
+            name + ':', size, (perf_counter() - start) * 1000))
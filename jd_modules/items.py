@@ -6,10 +6,21 @@ Flask resource class storing items.
 Provided for testing purposes only.
 """
 
-from flask import request
+import io
+import csv
+import json
+from urllib.parse import urlencode
+from flask import Response, request, stream_with_context
 from flask_restx import Resource, reqparse
+from .conditional import make_etag, not_modified, validators
 # from jd_lib import DataDB, TaskMgr
 
+MAXBATCH = 10000    # max. number of items in one batch request
+EXPORTFORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
 # --------- restful class --------------------------------------------------
 
 
@@ -46,22 +57,69 @@ class Items(Resource):
         else:
             self.datadb = None
 
+    def _list(self):
+        """
+        Get one page of the item collection.
+
+        Query parameters: *limit*, *after* (cursor of the next page),
+        *prefix* (name prefix), *sort* ('id' or 'name'), *order* ('asc' or
+        'desc'). The response links to the next page in 'next' and in a
+        'Link' header. Pages are tagged with the table version, an unchanged
+        page is confirmed with 304 without querying it.
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("limit", type=int, location='args')
+        parser.add_argument("after", location='args')
+        parser.add_argument("prefix", location='args')
+        parser.add_argument("sort", default='id', location='args')
+        parser.add_argument("order", default='asc', location='args',
+                            choices=('asc', 'desc'))
+        args = parser.parse_args()
+        etag = make_etag(self.datadb.version(), request.full_path)
+        headers = validators(etag)
+        if not_modified(etag):
+            return {}, 304, headers
+        try:
+            item_list, cursor = self.datadb.data_list(
+                limit=args['limit'], after=args['after'],
+                prefix=args['prefix'], sort=args['sort'],
+                desc=(args['order'] == 'desc'))
+        except ValueError as err:
+            return {"error": "Bad request: {}".format(err)}, 400
+        if not item_list and not args['after']:
+            return {"error": "Not found "+request.url}, 404
+        if cursor is None:
+            return {"items": item_list, "next": None}, 200, headers
+        query = {k: v for k, v in args.items() if v is not None}
+        query['after'] = cursor
+        next_url = request.base_url + '?' + urlencode(query)
+        headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        return {"items": item_list, "next": next_url}, 200, headers
+
     def get(self, item_id=None):
         """
         Get item entry from DB.
 
+        Supports If-None-Match (checked before the DB lookup) and
+        If-Modified-Since (against the item's mtime).
+
         :param item_id:      uniq item *id*
         :returns str:   item value
         """
         if self.verbose:
             print("get id:", item_id, "\nverbose:", self.verbose)
         if item_id is None:
-            item_list = self.datadb.data_get_byid()
-        else:
-            item_list = self.datadb.data_get_byid(item_id)
+            return self._list()
+        etag = make_etag(self.datadb.version(), item_id)
+        if not_modified(etag):
+            return {}, 304, validators(etag)
+        item_list = self.datadb.data_get_byid(item_id)
         if not item_list:
             return {"error": "Not found "+request.url}, 404
-        return {"items": item_list}, 200
+        headers = validators(etag, item_list.get('mtime'))
+        if not_modified(etag, item_list.get('mtime')):
+            return {}, 304, headers
+        return {"items": item_list}, 200, headers
 
     def post(self, item_id=None):
         """Add item entry to DB."""
@@ -72,11 +130,12 @@ class Items(Resource):
 
         if item_id is not None:
             return {"error": "Bad request"}, 400
-        if self.datadb.data_get_byname(args['name']):
-            return {"error": "Conflict"}, 409
+        if args['name'] is None or args['value'] is None:
+            return {"error": "Bad request"}, 400
         item = {"name": args['name'], "value": args['value']}
-        self.datadb.data_add(item)
-        item['id'] = self.datadb.data_get_byname(args['name'])
+        item['id'] = self.datadb.data_create(item)
+        if item['id'] is None:
+            return {"error": "Conflict"}, 409
         return {'item': item}, 201
 
     def put(self, item_id=None):
@@ -96,7 +155,8 @@ class Items(Resource):
             "name": (args['name'] if args['name'] else item['name']),
             "value": (args['value'] if args['value'] else item['value'])
         }
-        self.datadb.data_update(newitem)
+        if self.datadb.data_update(newitem) is None:
+            return {"error": "Conflict"}, 409
         return {'item': newitem}, 200
 
     def delete(self, item_id=None):
@@ -110,6 +170,155 @@ class Items(Resource):
         return {}, 204
 
 
+class ItemsBatch(Resource):
+    """
+    Bulk insert, update and delete for the Items collection.
+
+    Accepts a JSON array (or {"items": [...]}) or an NDJSON body with one
+    item per line. Each batch runs in a single DB transaction, the response
+    lists the status of every entry.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:     set verbosity level for debug and logging
+        :param decorators:  apply decorators for access control
+        :param datadb:      backend database
+        :returns str: An endpoint name
+        """
+        super().__init__(self, *args, **kwargs)
+        if 'verbose' in kwargs:
+            self.verbose = kwargs['verbose']
+        else:
+            self.verbose = 0
+        if self.verbose > 2:
+            print("args", args)
+            print("kwargs", kwargs)
+        if 'decorators' in kwargs:
+            self.method_decorators = kwargs['decorators']
+        else:
+            self.method_decorators = []
+        if 'datadb' in kwargs:
+            self.datadb = kwargs['datadb']
+        else:
+            self.datadb = None
+
+    @staticmethod
+    def _read_batch() -> list:
+        """Parse request body into a list, raise ValueError if invalid."""
+        if 'ndjson' in (request.mimetype or ''):
+            body = request.get_data(as_text=True)
+            batch = [json.loads(line) for line in body.splitlines()
+                     if line.strip()]
+        else:
+            batch = request.get_json(force=True, silent=True)
+            if isinstance(batch, dict):
+                batch = batch.get('items')
+        if not isinstance(batch, list):
+            raise ValueError('expected a list of items')
+        return batch
+
+    def _run(self, func):
+        """Run a batch operation, build the response."""
+        try:
+            batch = self._read_batch()
+        except ValueError as err:
+            return {"error": "Bad request: {}".format(err)}, 400
+        if len(batch) > MAXBATCH:
+            return {"error": "Too many items, max. {}".format(MAXBATCH)}, 413
+        result = func(batch)
+        if self.verbose:
+            print("batch:", len(batch), "items")
+        return {"items": result}, 200
+
+    def post(self):
+        """Add item entries to DB."""
+        return self._run(self.datadb.data_add_many)
+
+    def put(self):
+        """Update item entries in DB, entries need an 'id'."""
+        return self._run(self.datadb.data_update_many)
+
+    def delete(self):
+        """Delete item entries by id, entries are ids or items."""
+        return self._run(lambda batch: self.datadb.data_delete_many(
+            [e.get('id') if isinstance(e, dict) else e for e in batch]))
+
+
+class ItemsExport(Resource):
+    """
+    Streaming export of the Items collection.
+
+    Rows are read from the DB in chunks and written to the response as
+    NDJSON (default) or CSV while reading, so memory use stays flat no
+    matter how big the table is.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:     set verbosity level for debug and logging
+        :param decorators:  apply decorators for access control
+        :param datadb:      backend database
+        :returns str: An endpoint name
+        """
+        super().__init__(self, *args, **kwargs)
+        if 'verbose' in kwargs:
+            self.verbose = kwargs['verbose']
+        else:
+            self.verbose = 0
+        if self.verbose > 2:
+            print("args", args)
+            print("kwargs", kwargs)
+        if 'decorators' in kwargs:
+            self.method_decorators = kwargs['decorators']
+        else:
+            self.method_decorators = []
+        if 'datadb' in kwargs:
+            self.datadb = kwargs['datadb']
+        else:
+            self.datadb = None
+
+    def _ndjson(self):
+        """Generate NDJSON text, one chunk of lines per DB fetch."""
+        for rows in self.datadb.data_iter():
+            yield ''.join(json.dumps(row) + '\n' for row in rows)
+
+    def _csv(self):
+        """Generate CSV text, header first, one chunk per DB fetch."""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        header = None
+        for rows in self.datadb.data_iter():
+            if header is None:
+                header = list(rows[0].keys())
+                writer.writerow(header)
+            writer.writerows([row[col] for col in header] for row in rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    def get(self):
+        """Export all items, query parameter *format*: 'ndjson' or 'csv'."""
+        parser = reqparse.RequestParser()
+        parser.add_argument("format", default='ndjson', location='args',
+                            choices=tuple(EXPORTFORMATS))
+        args = parser.parse_args()
+        if self.verbose:
+            print("export format:", args['format'])
+        if args['format'] == 'csv':
+            generator = self._csv()
+        else:
+            generator = self._ndjson()
+        filename = 'items.{}'.format(args['format'])
+        return Response(stream_with_context(generator),
+                        mimetype=EXPORTFORMATS[args['format']],
+                        headers={'Content-Disposition':
+                                 'attachment; filename=' + filename})
+
 # --------- implemented in main app or in calling class ----------------------
 
 # # creating the flask app
@@ -2,7 +2,17 @@
 
 """Import submodules into one namespace."""
 from .images import Images
+from .archive import ImageArchive
+from .jobs import ImageJobs
+from .engine import EngineClient, EngineError
+from .inventory import Inventory, InventoryError
 # from .k8s    import Kubernetes
 
 if True is False:
     TestInit = Images()
+    TestInit = ImageArchive()
+    TestInit = ImageJobs()
+    TestInit = EngineClient()
+    TestInit = EngineError(0, '')
+    TestInit = Inventory()
+    TestInit = InventoryError()
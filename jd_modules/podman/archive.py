@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+"""
+Podman image archive class.
+
+Streams image archives (podman-save(1), podman-load(1)) between client and
+backend in fixed size chunks, so memory use stays bounded no matter how big
+an image is. The backend is the engine API socket (EngineClient) or the
+podman CLI through pipes.
+
+    GET  /podman/images/archive?name=<image>   download a tar archive
+    POST /podman/images/archive                 upload a tar archive
+    GET  /podman/images/archive                 progress of transfers
+"""
+
+import os
+import re
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from time import time
+from uuid import uuid4
+from flask import Response, request, stream_with_context
+from flask_restx import Resource, reqparse
+from jd_lib import QueueFullError
+from .engine import EngineError, CHUNKSIZE
+from .images import IMAGENAME
+from .inventory import CMDTIMEOUT
+
+KEEPTRANSFERS = 32  # finished transfers kept for the progress report
+SLOTWAIT = 5        # seconds a transfer waits for a free task slot
+TRANSFERTIMEOUT = 3600  # seconds until a podman save/load gets killed
+MSGSIZE = 65536     # bytes of podman load messages reported
+
+# --------- progress ---------------------------------------------------------
+
+
+class Transfers():
+    """Progress of running and recently finished archive transfers."""
+
+    def __init__(self, keep=KEEPTRANSFERS):
+        """Update internal class default values if needed."""
+        self._keep = keep
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, direction, image=None, total=None) -> dict:
+        """Register a new transfer, return its progress record."""
+        transfer = {
+            'id': str(uuid4()),
+            'direction': direction,
+            'image': image,
+            'bytes': 0,
+            'total': total,
+            'started': time(),
+            'finished': None,
+            'status': 'running',
+        }
+        with self._lock:
+            self._entries[transfer['id']] = transfer
+            finished = [key for key, entry in self._entries.items()
+                        if entry['finished']]
+            for key in finished[:max(0, len(finished) - self._keep)]:
+                del self._entries[key]
+        return transfer
+
+    @staticmethod
+    def finish(transfer, status='finished') -> None:
+        """Mark a transfer as done."""
+        transfer['finished'] = time()
+        transfer['status'] = status
+
+    def list(self) -> list:
+        """Progress records with transfer rate."""
+        now = time()
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            seconds = (entry['finished'] or now) - entry['started']
+            entry['rate'] = entry['bytes'] / seconds if seconds else 0.0
+        return entries
+
+# --------- restful class --------------------------------------------------
+
+
+class ImageArchive(Resource):
+    """
+    Image archives.
+
+    Download (save) and upload (load) image archives as tar streams.
+    """
+
+    transfers = Transfers()
+
+    def __init__(self, *args, **kwargs):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:     set verbosity level for debug and logging
+        :param decorators:  apply decorators for access control
+        :param engine:      EngineClient, talk to the API socket instead
+                            of running the podman CLI
+        :param taskmgr:     task manager, transfers take one of its slots
+        :returns str: An endpoint name
+        """
+        super().__init__(self, *args, **kwargs)
+        if 'verbose' in kwargs:
+            self.verbose = kwargs['verbose']
+        else:
+            self.verbose = 0
+        if self.verbose > 2:
+            print("args", args)
+            print("kwargs", kwargs)
+        if 'decorators' in kwargs:
+            self.method_decorators = kwargs['decorators']
+        else:
+            self.method_decorators = []
+        if 'engine' in kwargs:
+            self.engine = kwargs['engine']
+        else:
+            self.engine = None
+        if 'taskmgr' in kwargs:
+            self.taskmgr = kwargs['taskmgr']
+        else:
+            self.taskmgr = None
+
+    def _reserve(self) -> None:
+        """
+        Count the transfer against the task manager's running limit.
+
+        :raises QueueFullError: if no slot becomes free within SLOTWAIT
+        """
+        if self.taskmgr is not None:
+            self.taskmgr.reserve(SLOTWAIT)
+
+    def _release(self) -> None:
+        if self.taskmgr is not None:
+            self.taskmgr.release()
+
+    def _exists(self, name) -> bool:
+        """
+        podman-image-exists(1).
+
+        Check if an image exists in local storage.
+        """
+        if self.engine is not None:
+            return self.engine.image_exists(name)
+        return subprocess.run(['podman', 'image', 'exists', name],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL,
+                              timeout=CMDTIMEOUT,
+                              check=False).returncode == 0
+
+    def _save(self, name, transfer) -> tuple:
+        """
+        podman-save(1).
+
+        Save an image to docker-archive.
+
+        :returns tuple:  generator of chunks, and the function ending the
+                         transfer (called by the generator, and again when
+                         the response closes, e.g. if it was never read)
+        """
+        if self.engine is not None:
+            chunks = self.engine.image_save(name)
+            proc = watchdog = None
+        else:
+            proc = subprocess.Popen(['podman', 'save', name],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+            watchdog = threading.Timer(TRANSFERTIMEOUT, proc.kill)
+            watchdog.daemon = True
+            watchdog.start()
+            chunks = iter(lambda: proc.stdout.read1(CHUNKSIZE), b'')
+
+        def finish(status='aborted'):
+            if transfer['finished'] is not None:
+                return
+            if proc is not None:
+                watchdog.cancel()
+                if proc.poll() is None:
+                    # client went away
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+            self.transfers.finish(transfer, status)
+            self._release()
+
+        def generator():
+            status = 'aborted'
+            try:
+                for chunk in chunks:
+                    transfer['bytes'] += len(chunk)
+                    yield chunk
+                status = 'finished'
+                if proc is not None and proc.wait() != 0:
+                    status = 'failed'
+            finally:
+                finish(status)
+
+        return generator(), finish
+
+    def _load(self, stream, transfer) -> tuple:
+        """
+        podman-load(1).
+
+        Load images from a docker archive read from stream.
+
+        :returns tuple:  success, backend messages
+        """
+        def chunks():
+            for chunk in iter(lambda: stream.read(CHUNKSIZE), b''):
+                transfer['bytes'] += len(chunk)
+                yield chunk
+
+        if self.engine is not None:
+            try:
+                return True, self.engine.image_load(chunks())
+            except (OSError, EngineError) as err:
+                return False, str(err)
+        # messages go to a file, a full pipe would block podman
+        with tempfile.TemporaryFile() as messages:
+            proc = subprocess.Popen(['podman', 'load'],
+                                    stdin=subprocess.PIPE,
+                                    stdout=messages,
+                                    stderr=subprocess.STDOUT)
+            watchdog = threading.Timer(TRANSFERTIMEOUT, proc.kill)
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                for chunk in chunks():
+                    proc.stdin.write(chunk)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass        # podman gave up, report its output
+            except BaseException:
+                proc.kill()
+                raise
+            finally:
+                proc.wait()
+                watchdog.cancel()
+            size = messages.seek(0, os.SEEK_END)
+            messages.seek(max(0, size - MSGSIZE))
+            output = messages.read().decode('utf8', 'replace')
+        return proc.returncode == 0, output
+
+    def get(self):
+        """
+        Download an image archive, or report transfer progress.
+
+        :returns stream:  tar archive of image *name*, without a name the
+                          list of running and recent transfers
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("name", type=str, location='args')
+        args = parser.parse_args()
+        if args['name'] is None:
+            return {"transfers": self.transfers.list()}, 200
+        if not re.match(IMAGENAME, args['name']):
+            return {"error": "Bad request"}, 400
+        if self.verbose:
+            print("save image:", args['name'])
+        try:
+            if not self._exists(args['name']):
+                return {"error": "Not found "+request.url}, 404
+        except (OSError, EngineError, subprocess.TimeoutExpired) as err:
+            return {"error": str(err)}, 502
+        try:
+            self._reserve()
+        except QueueFullError as err:
+            return {"error": "Too many requests",
+                    "queue": err.depth}, 429, {"Retry-After": "1"}
+        transfer = self.transfers.start('save', args['name'])
+        try:
+            generator, finish = self._save(args['name'], transfer)
+        except (OSError, EngineError) as err:
+            self.transfers.finish(transfer, 'failed')
+            self._release()
+            return {"error": str(err)}, 502
+        filename = re.sub(r'[^\w.-]', '_', args['name']) + '.tar'
+        response = Response(stream_with_context(generator),
+                            mimetype='application/x-tar',
+                            headers={'Content-Disposition':
+                                     'attachment; filename=' + filename,
+                                     'X-Transfer-Id': transfer['id']})
+        response.call_on_close(finish)
+        return response
+
+    def post(self):
+        """
+        Upload an image archive (request body, application/x-tar).
+
+        :returns dict:  transfer progress and messages of the backend
+        """
+        try:
+            self._reserve()
+        except QueueFullError as err:
+            return {"error": "Too many requests",
+                    "queue": err.depth}, 429, {"Retry-After": "1"}
+        transfer = self.transfers.start('load',
+                                        total=request.content_length)
+        try:
+            success, output = self._load(request.stream, transfer)
+        except OSError as err:
+            success, output = False, str(err)
+        finally:
+            self._release()
+        self.transfers.finish(transfer, 'finished' if success else 'failed')
+        if self.verbose:
+            print("load image:", transfer, output)
+        if not success:
+            return {"error": output, "transfer": transfer}, 400
+        return {"loaded": output, "transfer": transfer}, 201
+
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    print("class for import into jd_modules framework")
+    # resource_class_kwargs
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+"""
+Docker/Podman Engine API client.
+
+Talks HTTP/1.1 to the API socket of the podman service (or the docker
+daemon) as described in Docker_Engine_API_v1.40.yaml, instead of running
+the podman CLI for every request. Connections are kept alive and pooled,
+responses are decoded from JSON.
+
+    $ systemctl --user start podman.socket
+    $ python3 -m jd_modules.podman.engine      # ping, version, images
+"""
+
+import os
+import json
+import socket
+import http.client
+from queue import LifoQueue, Empty, Full
+from urllib.parse import quote, urlencode
+
+APIVERSION = 'v1.40'
+POOLSIZE = 4        # max. number of idle keep-alive connections
+TIMEOUT = 30        # seconds for connecting and reading a response
+CHUNKSIZE = 1048576  # bytes per chunk of streamed image archives
+SOCKETS = (         # tried in this order if no socket is configured
+    '/run/user/{uid}/podman/podman.sock',
+    '/run/podman/podman.sock',
+    '/var/run/docker.sock',
+)
+
+# --------- helpers ----------------------------------------------------------
+
+
+def find_socket() -> str:
+    """API socket from CONTAINER_HOST/DOCKER_HOST or a default location."""
+    for var in ('CONTAINER_HOST', 'DOCKER_HOST'):
+        value = os.environ.get(var, '')
+        if value.startswith('unix://'):
+            return value[len('unix://'):]
+    for path in SOCKETS:
+        path = path.format(uid=os.getuid())
+        if os.path.exists(path):
+            return path
+    return SOCKETS[1]
+
+
+class EngineError(Exception):
+    """Error reply of the engine API."""
+
+    def __init__(self, status, message):
+        """Keep the HTTP status for the caller (e.g. 404, 409)."""
+        super().__init__('{} {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to a unix domain socket."""
+
+    def __init__(self, path, timeout=TIMEOUT):
+        """Host name 'localhost' is only used in the Host header."""
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self) -> None:
+        """Connect to the unix socket instead of host:port."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+# --------- API client -------------------------------------------------------
+
+
+class EngineClient():
+    """Pooled keep-alive client for the engine API."""
+
+    def __init__(self, path=None, version=APIVERSION, poolsize=POOLSIZE,
+                 timeout=TIMEOUT, verbose=0):
+        """
+        Update internal class default values if needed.
+
+        :param path:      unix socket of the API service
+        :param version:   API version prefix of all paths
+        :param poolsize:  max. number of idle connections kept open
+        :param timeout:   seconds for connecting and reading
+        :param verbose:   set verbosity level for debug and logging
+        """
+        self.path = path or find_socket()
+        self.version = version
+        self.timeout = timeout
+        self.verbose = verbose
+        self._idle = LifoQueue(maxsize=poolsize)
+
+    def _checkout(self) -> tuple:
+        """Idle connection (reused=True) or a new one."""
+        try:
+            return self._idle.get_nowait(), True
+        except Empty:
+            return self._new(), False
+
+    def _checkin(self, conn) -> None:
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def url(self, path, params=None) -> str:
+        """API url of path, with query parameters (None values dropped)."""
+        url = '/{}{}'.format(self.version, path)
+        if params:
+            params = {key: value for key, value in params.items()
+                      if value is not None}
+            for key, value in params.items():
+                if isinstance(value, bool):
+                    params[key] = 'true' if value else 'false'
+                elif isinstance(value, (dict, list)):
+                    params[key] = json.dumps(value)
+            if params:
+                url += '?' + urlencode(params)
+        return url
+
+    def _send(self, method, url, body=None, headers=None) -> tuple:
+        """
+        Send a request, return connection and the unread response.
+
+        A kept-alive connection closed by the server meanwhile is replaced
+        by a new one. Iterable bodies are sent chunked on a new connection.
+        """
+        stream = body is not None and \
+            not isinstance(body, (bytes, str))
+        while True:
+            if stream:
+                conn, reused = self._new(), False
+            else:
+                conn, reused = self._checkout()
+            try:
+                conn.request(method, url, body=body, headers=headers or {},
+                             encode_chunked=stream)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+
+    def _new(self) -> UnixHTTPConnection:
+        return UnixHTTPConnection(self.path, timeout=self.timeout)
+
+    @staticmethod
+    def _decode(resp, data):
+        """Decode a reply, raise EngineError for error replies."""
+        text = data.decode('utf8', 'replace')
+        data = text
+        if resp.getheader('Content-Type', '').startswith('application/json'):
+            try:
+                data = json.loads(text or 'null')
+            except ValueError:
+                pass        # e.g. a stream of JSON messages
+        if resp.status >= 400:
+            if isinstance(data, dict):
+                message = data.get('message', '')
+            else:
+                message = data
+            raise EngineError(resp.status, message)
+        return data
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        """
+        Send a request, return the decoded JSON reply (or text).
+
+        :raises EngineError: for error replies (status >= 400)
+        :raises OSError:     if the socket isn't reachable
+        """
+        url = self.url(path, params)
+        headers = dict(headers or {})
+        if body is not None and not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        conn, resp = self._send(method, url, body, headers)
+        try:
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        if self.verbose > 1:
+            print(method, url, resp.status, len(data))
+        return self._decode(resp, data)
+
+    def download(self, path, params=None, size=CHUNKSIZE):
+        """
+        Stream a binary reply, return a generator of chunks.
+
+        Errors are raised right away, before the first chunk.
+        """
+        conn, resp = self._send('GET', self.url(path, params))
+        if resp.status >= 400:
+            data = resp.read()
+            conn.close()
+            self._decode(resp, data)
+
+        def chunks():
+            try:
+                for chunk in iter(lambda: resp.read(size), b''):
+                    yield chunk
+            finally:
+                conn.close()
+
+        return chunks()
+
+    def upload(self, path, chunks, params=None,
+               content_type='application/x-tar'):
+        """Send an iterable of chunks as request body, return the reply."""
+        conn, resp = self._send('POST', self.url(path, params), chunks,
+                                {'Content-Type': content_type})
+        try:
+            data = resp.read()
+        finally:
+            conn.close()
+        return self._decode(resp, data)
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+    def ping(self) -> bool:
+        """Check if the service is reachable."""
+        try:
+            return self.request('GET', '/_ping') == 'OK'
+        except (OSError, EngineError):
+            return False
+
+    def info_version(self) -> dict:
+        """Version information of the service."""
+        return self.request('GET', '/version')
+
+    def images(self, filters=None, all_images=False) -> list:
+        """List images, filters as in the API: {'label': ['x=y'], ...}."""
+        return self.request('GET', '/images/json',
+                            {'all': all_images, 'filters': filters})
+
+    def image_inspect(self, name) -> dict:
+        """Low level information of an image."""
+        return self.request('GET', '/images/{}/json'.format(quote(name)))
+
+    def image_exists(self, name) -> bool:
+        """Check if an image exists in local storage."""
+        try:
+            self.image_inspect(name)
+        except EngineError as err:
+            if err.status == 404:
+                return False
+            raise
+        return True
+
+    def image_history(self, name) -> list:
+        """History of an image."""
+        return self.request('GET', '/images/{}/history'.format(quote(name)))
+
+    def image_tag(self, name, repo, tag=None) -> bool:
+        """Add a name to an image."""
+        self.request('POST', '/images/{}/tag'.format(quote(name)),
+                     {'repo': repo, 'tag': tag})
+        return True
+
+    def image_save(self, name, size=CHUNKSIZE):
+        """Stream an image as tar archive, generator of chunks."""
+        return self.download('/images/{}/get'.format(quote(name)),
+                             size=size)
+
+    def image_load(self, chunks) -> str:
+        """Load images from a tar archive given as iterable of chunks."""
+        return self.upload('/images/load', chunks, {'quiet': True})
+
+    def image_remove(self, name, force=False) -> list:
+        """Remove an image, return the untagged and deleted items."""
+        return self.request('DELETE', '/images/{}'.format(quote(name)),
+                            {'force': force})
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    from time import perf_counter
+    x = EngineClient()
+    print("socket:  ", x.path)
+    if not x.ping():
+        print("service not reachable")
+    else:
+        print("version: ", x.info_version().get('Version'))
+        print("images:  ", len(x.images()))
+        print("exists:  ", x.image_exists('nope'))
+        start = perf_counter()
+        for _ in range(100):
+            x.images()
+        print("latency:  {:.2f} ms".format((perf_counter() - start) * 10))
+    x.close()
@@ -57,10 +57,62 @@ Provided for educational purposes only.
     └────────┴────────────────────────┴───────────────────────────────────────┘
 """
 
-from time import sleep
+import os
+import re
+import json
+import shlex
 from flask import request
 from flask_restx import Resource, reqparse
-# from jd_lib import DataDB, TaskMgr
+from jd_lib import QueueFullError
+from .engine import EngineError
+from .inventory import InventoryError
+from ..conditional import make_etag, not_modified, validators
+
+CMDTIMEOUT = 30     # seconds to wait for a command run in the foreground
+IMAGENAME = r'^\w[\w.:/@+-]*$'
+CONTEXTDIR = r'^[\w./][\w./-]*$'
+BUILDROOT = os.sep.join(['.', 'contexts'])  # build contexts must be below
+TRANSPORTS = ('containers-storage', 'dir', 'docker', 'docker-archive',
+              'docker-daemon', 'oci', 'oci-archive', 'sif')
+LABELFILTER = r'^\w[\w./-]*(=[\w.:/@+-]*)?$'     # 'key' or 'key=value'
+
+# --------- helpers ----------------------------------------------------------
+
+
+def registry_reference(name) -> str:
+    """
+    Image name or registry reference, without 'docker://' prefix.
+
+    Other transports ('oci-archive:/path', 'dir:/path', ...) read or
+    write local files and are refused.
+
+    :returns str:   the reference, None if it isn't a valid one
+    """
+    if not isinstance(name, str):
+        return None
+    if name.startswith('docker://'):
+        name = name[len('docker://'):]
+    if not re.match(IMAGENAME, name) or \
+       name.split(':', 1)[0] in TRANSPORTS:
+        return None
+    return name
+
+
+def build_context(context, root=BUILDROOT) -> str:
+    """
+    Resolve a build context below the build root directory.
+
+    :param context:  directory relative to root
+    :param root:     directory holding all build contexts
+    :returns str:    absolute path, None if it's outside of root
+    """
+    if not isinstance(context, str) or not re.match(CONTEXTDIR, context):
+        return None
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, context))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
 
 # --------- restful class --------------------------------------------------
 
@@ -79,6 +131,10 @@ class Images(Resource):
         :param verbose:     set verbosity level for debug and logging
         :param decorators:  apply decorators for access control
         :param taskmgr:     task manager for actions
+        :param engine:      EngineClient, talk to the API socket instead
+                            of running the podman CLI
+        :param inventory:   Inventory, answer image queries from memory
+        :param buildroot:   directory holding the build contexts
         :returns str: An endpoint name
         """
         super().__init__(self, *args, **kwargs)
@@ -97,32 +153,59 @@ class Images(Resource):
             self.taskmgr = kwargs['taskmgr']
         else:
             self.taskmgr = None
+        if 'engine' in kwargs:
+            self.engine = kwargs['engine']
+        else:
+            self.engine = None
+        if 'inventory' in kwargs:
+            self.inventory = kwargs['inventory']
+        else:
+            self.inventory = None
+        if 'buildroot' in kwargs:
+            self.buildroot = kwargs['buildroot']
+        else:
+            self.buildroot = BUILDROOT
+
+    def _changed(self) -> None:
+        """Image list changed, don't serve cached listings."""
+        if self.taskmgr is not None and self.taskmgr.cache is not None:
+            self.taskmgr.cache.invalidate()
+        if self.inventory is not None:
+            self.inventory.invalidate()
 
-    def _run_cmd(self, cmd=None) -> list:
+    def _run_cmd(self, cmd=None, options=None, readonly=False) -> list:
         """Run command in foreground, report output."""
+        if self.taskmgr is None:
+            return None, None
+        status = self.taskmgr.run({"command": cmd, "options": options},
+                                  timeout=CMDTIMEOUT, readonly=readonly)
+        if status is None:
+            return None, None
+        return status['output'], status['RC']
+
+    def _start_job(self, options) -> str:
+        """Run podman in the background, return the task uuid."""
         if self.taskmgr is None:
             return None
-        tid = self.taskmgr.add({"command": cmd})
-        if tid is None:
-            return None
-        status = self.taskmgr.status(tid, verbose=True)
-        maxcheck = 5
-        while (status['status'] == 'running') and maxcheck:
-            sleep(0.5)
-            maxcheck -= 1
-            status = self.taskmgr.status(tid, verbose=True)
-        return status['stdout'], status['RC']
 
-    def _build(self, tag=None) -> list:
+        def finished(job):
+            self._changed()
+            if self.verbose:
+                print("image job finished:", job['uuid'], job['status'])
+
+        return self.taskmgr.add({"command": "podman", "options": options},
+                                callback=finished)
+
+    def _build(self, tag=None, context=None) -> str:
         """
         podman-build(1).
 
         Build a container using a Dockerfile.
         """
         if self.verbose > 2:
-            print(tag)
-        item_list = []
-        return item_list
+            print(tag, context)
+        return self._start_job("build -t {} {}".format(
+            tag, shlex.quote(context)))
 
     def _exists(self, uuid=None) -> bool:
         """
@@ -132,6 +215,11 @@ class Images(Resource):
         """
         if self.verbose > 2:
             print(uuid)
+        if self.engine is not None:
+            try:
+                return self.engine.image_exists(uuid)
+            except (OSError, EngineError):
+                return False
         return True
 
     def _history(self) -> str:
@@ -167,21 +255,45 @@ class Images(Resource):
             print(string_)
         return string_
 
-    def _list(self, uuid=None) -> str:
+    def _list(self, uuid=None, labels=None) -> str:
         """
         podman-images(1).
 
         List the container images on the system.(alias ls)
-        """
-        cmd = "podman image list --format json"
+
+        :param uuid:    image id, tag or digest (matching IMAGENAME)
+        :param labels:  list of 'key' or 'key=value' label filters
+                        (matching LABELFILTER)
+        :raises InventoryError: if the inventory can't load the list
+        """
+        if self.inventory is not None:
+            return self.inventory.query(labels=labels, reference=uuid)
+        if self.engine is not None:
+            filters = {}
+            if uuid is not None:
+                filters['reference'] = [uuid]
+            if labels:
+                filters['label'] = labels
+            try:
+                return self.engine.images(filters=filters or None)
+            except (OSError, EngineError) as err:
+                return [{'error': str(err)}]
+        options = "image list --format json"
         if uuid is not None:
-            cmd += "--filter label %s" % uuid
-        res = self._run_cmd(cmd)
+            options += " --filter id={}".format(uuid)
+        for label in labels or []:
+            options += " --filter label={}".format(label)
+        res = self._run_cmd("podman", options, readonly=True)
         if res[0] is None:
             return [{'error': 'internal error'}]
         if res[1] == '':
             return [{'error': 'command still running'}]
-        return res[0]
+        if res[1] != '0':
+            return [{'error': 'command failed', 'RC': res[1]}]
+        try:
+            return json.loads(res[0] or '[]')
+        except ValueError:
+            return [{'error': 'invalid output', 'output': res[0]}]
 
     def _load(self) -> str:
         """
@@ -205,27 +317,29 @@ class Images(Resource):
             print(string_)
         return string_
 
-    def _pull(self) -> str:
+    def _pull(self, name=None) -> str:
         """
         podman-pull(1).
 
         Pull an image from a registry.
         """
-        string_ = ''
         if self.verbose > 2:
-            print(string_)
-        return string_
+            print(name)
+        return self._start_job("pull {}".format(name))
 
-    def _push(self) -> str:
+    def _push(self, name=None, destination=None) -> str:
         """
         podman-push(1).
 
         Push an image from local storage to elsewhere.
+
+        :param destination:  registry reference, pushed as docker://...
         """
-        string_ = ''
         if self.verbose > 2:
-            print(string_)
-        return string_
+            print(name, destination)
+        if destination:
+            destination = 'docker://' + destination
+        return self._start_job("push {} {}".format(name, destination or ''))
 
     def _rm(self, uuid=None) -> str:
         """
@@ -236,6 +350,12 @@ class Images(Resource):
         string_ = ''
         if self.verbose > 2:
             print(string_, uuid)
+        if self.engine is not None:
+            try:
+                self.engine.image_remove(uuid)
+            except (OSError, EngineError) as err:
+                string_ = str(err)
+            self._changed()
         return string_
 
     def _save(self, uuid=None) -> str:
@@ -311,7 +431,10 @@ class Images(Resource):
         """
         Get item entry from DB.
 
-        :param item_id:    unique image *id*
+        Listings carry an ETag. With an inventory it's derived from the
+        inventory digest, so If-None-Match is answered before the lookup.
+
+        :param item_id:    image *id* (or unique prefix), tag or digest
         :returns str:   image status
         """
         if self.verbose:
@@ -319,28 +442,79 @@ class Images(Resource):
 
         parser = reqparse.RequestParser()
         parser.add_argument("action")
+        parser.add_argument("label", action='append', location='args')
         args = parser.parse_args()
 
         item_list = None
-        if 'action' not in args:
-            item_list = self._list(uuid=item_id)
+        if args['action'] is None:
+            # both end up as podman CLI arguments
+            if (item_id is not None and not re.match(IMAGENAME, item_id)) or \
+               not all(re.match(LABELFILTER, label)
+                       for label in args['label'] or []):
+                return {"error": "Bad request"}, 400
+            etag = None
+            try:
+                if self.inventory is not None:
+                    etag = make_etag(self.inventory.digest(),
+                                     request.full_path)
+                    if not_modified(etag):
+                        return {}, 304, validators(etag)
+                item_list = self._list(uuid=item_id, labels=args['label'])
+            except QueueFullError as err:
+                return {"error": "Too many requests",
+                        "queue": err.depth}, 429, {"Retry-After": "1"}
+            except InventoryError as err:
+                return {"images": [{'error': str(err)}]}, 200
+            if item_id is not None and self.inventory is not None:
+                if not item_list:
+                    return {"error": "Not found "+request.url}, 404
+                return {"image": item_list[0]}, 200, validators(etag)
+            if etag is None:
+                # no inventory: the listing ran anyway, saves the transfer
+                etag = make_etag(item_list)
+                if not_modified(etag):
+                    return {}, 304, validators(etag)
+            return {"images": item_list}, 200, validators(etag)
         return {"images": item_list or []}, 200
 
     def post(self, item_id=None):
-        """Add item entry to DB."""
+        """
+        Pull, push or build an image in the background.
+
+        :returns dict:  task *uuid*, progress at /podman/images/jobs/<uuid>
+        """
         parser = reqparse.RequestParser()
-        parser.add_argument("action")
-        parser.add_argument("name")
+        parser.add_argument("action", required=True,
+                            choices=('pull', 'push', 'build'))
+        parser.add_argument("name", required=True)
+        parser.add_argument("destination")
+        parser.add_argument("context")
         args = parser.parse_args()
 
         if item_id is not None:
             return {"error": "Bad request"}, 400
-        if 'action' not in args:
+        name = registry_reference(args['name'])
+        destination = registry_reference(args['destination'])
+        if name is None or (args['destination'] and destination is None):
+            return {"error": "Bad request"}, 400
+        try:
+            if args['action'] == 'pull':
+                uuid = self._pull(name)
+            elif args['action'] == 'push':
+                uuid = self._push(name, destination)
+            else:
+                context = build_context(args['context'], self.buildroot)
+                if context is None:
+                    return {"error": "Bad request"}, 400
+                uuid = self._build(name, context)
+        except QueueFullError as err:
+            return {"error": "Too many requests",
+                    "queue": err.depth}, 429, {"Retry-After": "1"}
+        if uuid is None:
             return {"error": "Bad request"}, 400
-        item = {"name": args['name'], "value": args['value']}
-        if args['action'] == 'build':
-            self._build(item)
-        return {'images': [item]}, 201
+        location = '{}/jobs/{}'.format(request.base_url.rstrip('/'), uuid)
+        return {"task": uuid, "action": args['action'],
+                "progress": location}, 202, {"Location": location}
 
     def put(self, item_id=None):
         """Update item entry in DB."""
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""
+Image inventory.
+
+Keeps the image list in memory, indexed by id (and unique id prefix),
+repository tag, digest and label, so single images and filtered lists are
+answered without running podman. The list is reloaded after a time to
+live or when invalidated (e.g. after a pull), only images which changed
+are re-indexed. A digest of the whole list serves as entity tag.
+"""
+
+import json
+import bisect
+import hashlib
+import threading
+from time import monotonic
+from .engine import EngineError
+
+INVENTORYTTL = 30   # seconds until the image list is reloaded
+CMDTIMEOUT = 30     # seconds to wait for 'podman image list'
+LISTOPTIONS = "image list --format json"
+MINPREFIX = 4       # min. length of an image id prefix
+
+# --------- helpers ----------------------------------------------------------
+
+
+class InventoryError(RuntimeError):
+    """Loading the image list failed."""
+
+
+def short_id(image_id) -> str:
+    """Image id without 'sha256:' prefix."""
+    image_id = image_id or ''
+    if image_id.startswith('sha256:'):
+        image_id = image_id[len('sha256:'):]
+    return image_id
+
+
+def tag_names(tag) -> list:
+    """All names a tag can be referred to: 'alpine', 'alpine:latest', ..."""
+    names = [tag]
+    name, _, version = tag.rpartition(':')
+    if '/' in version or not name:
+        name, version = tag, None
+    if version == 'latest':
+        names.append(name)
+    for prefix in ('docker.io/library/', 'docker.io/', 'localhost/'):
+        if tag.startswith(prefix):
+            names.extend(tag_names(tag[len(prefix):]))
+    return names
+
+
+def normalize(image) -> dict:
+    """Index keys of an image from podman CLI or engine API output."""
+    digests = list(image.get('RepoDigests') or [])
+    if image.get('Digest'):
+        digests.append(image['Digest'])
+    for digest in list(digests):
+        if '@' in digest:
+            digests.append(digest.split('@', 1)[1])
+    return {
+        'id': short_id(image.get('Id') or image.get('ID')),
+        'tags': list(image.get('RepoTags') or image.get('Names') or []),
+        'digests': digests,
+        'labels': dict(image.get('Labels') or {}),
+    }
+
+# --------- inventory --------------------------------------------------------
+
+
+class Inventory():
+    """Indexed in-memory image list."""
+
+    def __init__(self, taskmgr=None, engine=None, ttl=INVENTORYTTL,
+                 loader=None, verbose=0):
+        """
+        Update internal class default values if needed.
+
+        :param taskmgr:  task manager to run 'podman image list'
+        :param engine:   EngineClient, used instead of the podman CLI
+        :param ttl:      seconds until the list is reloaded
+        :param loader:   callable returning the image list (overrides
+                         taskmgr and engine)
+        :param verbose:  set verbosity level for debug and logging
+        """
+        self.taskmgr = taskmgr
+        self.engine = engine
+        self.ttl = ttl
+        self.verbose = verbose
+        self._loader = loader or self._load
+        self._images = {}       # id -> (fingerprint, raw image, keys)
+        self._ids = []          # sorted ids, for prefix lookups
+        self._tags = {}
+        self._digests = {}
+        self._labels = {}       # label -> value -> set of ids
+        self._digest = None     # sha1 of all fingerprints
+        self._loaded = None
+        self._lock = threading.Lock()
+        self._reload = threading.Lock()
+        self._counters = {'reloads': 0, 'added': 0, 'removed': 0,
+                          'errors': 0}
+
+    def _load(self) -> list:
+        """Fetch the image list from the engine API or the podman CLI."""
+        if self.engine is not None:
+            return self.engine.images()
+        status = self.taskmgr.run({"command": "podman",
+                                   "options": LISTOPTIONS},
+                                  timeout=CMDTIMEOUT)
+        if status is None or status.get('RC') != '0':
+            raise RuntimeError('podman image list failed: {}'.format(
+                status and (status.get('errors') or status.get('RC'))))
+        return json.loads(status['output'] or '[]')
+
+    def invalidate(self) -> None:
+        """Reload the list on the next query."""
+        with self._lock:
+            self._loaded = None
+
+    def _fresh(self) -> bool:
+        return self._loaded is not None and \
+            monotonic() - self._loaded < self.ttl
+
+    def refresh(self, force=False) -> bool:
+        """
+        Reload the image list if expired (or forced), update the indexes.
+
+        Only one thread reloads, others keep using the current list - or
+        wait for the reload if there's none yet.
+
+        :raises InventoryError: if the list can't be loaded
+        :raises QueueFullError: if podman can't be started right now
+        """
+        if not force and self._fresh():
+            return True
+        if self._loaded is not None and not force:
+            if not self._reload.acquire(blocking=False):
+                return True     # being reloaded, serve the current list
+        else:
+            self._reload.acquire()
+        try:
+            if not force and self._fresh():
+                return True
+            try:
+                images = self._loader()
+            except (OSError, ValueError, RuntimeError, EngineError) as err:
+                with self._lock:
+                    self._counters['errors'] += 1
+                if self.verbose:
+                    print("Image list failed:", err)
+                raise InventoryError(
+                    'image list failed: {}'.format(err)) from err
+            self._update(images)
+            return True
+        finally:
+            self._reload.release()
+
+    def _update(self, images) -> None:
+        """Re-index added, changed and removed images."""
+        current = {}
+        for image in images:
+            keys = normalize(image)
+            if keys['id']:
+                current[keys['id']] = (json.dumps(image, sort_keys=True),
+                                       image, keys)
+        with self._lock:
+            changed = self._digest is None
+            for image_id, entry in list(self._images.items()):
+                if image_id not in current or \
+                   current[image_id][0] != entry[0]:
+                    self._unindex(image_id, entry[2])
+                    self._counters['removed'] += 1
+                    changed = True
+            for image_id, entry in current.items():
+                if image_id not in self._images:
+                    self._index(image_id, entry)
+                    self._counters['added'] += 1
+                    changed = True
+            if changed:
+                digest = hashlib.sha1()
+                for image_id in self._ids:
+                    digest.update(self._images[image_id][0].encode('utf8'))
+                self._digest = digest.hexdigest()
+            self._loaded = monotonic()
+            self._counters['reloads'] += 1
+
+    def _index(self, image_id, entry) -> None:
+        keys = entry[2]
+        self._images[image_id] = entry
+        bisect.insort(self._ids, image_id)
+        for tag in keys['tags']:
+            for name in tag_names(tag):
+                self._tags.setdefault(name, image_id)
+        for digest in keys['digests']:
+            self._digests[digest] = image_id
+        for label, value in keys['labels'].items():
+            self._labels.setdefault(label, {}).setdefault(
+                value, set()).add(image_id)
+
+    def _unindex(self, image_id, keys) -> None:
+        del self._images[image_id]
+        del self._ids[bisect.bisect_left(self._ids, image_id)]
+        for tag in keys['tags']:
+            for name in tag_names(tag):
+                if self._tags.get(name) == image_id:
+                    del self._tags[name]
+        for digest in keys['digests']:
+            if self._digests.get(digest) == image_id:
+                del self._digests[digest]
+        for label, value in keys['labels'].items():
+            ids = self._labels[label][value]
+            ids.discard(image_id)
+            if not ids:
+                del self._labels[label][value]
+                if not self._labels[label]:
+                    del self._labels[label]
+
+    def _resolve(self, ref) -> str:
+        """Image id for an id, unique id prefix, tag or digest."""
+        ref = short_id(ref) if ref.startswith('sha256:') and \
+            ref not in self._digests else ref
+        if ref in self._images:
+            return ref
+        for index in (self._tags, self._digests):
+            if ref in index:
+                return index[ref]
+        if len(ref) >= MINPREFIX:
+            pos = bisect.bisect_left(self._ids, ref)
+            if pos < len(self._ids) and self._ids[pos].startswith(ref) and \
+               (pos + 1 == len(self._ids) or
+                    not self._ids[pos + 1].startswith(ref)):
+                return self._ids[pos]
+        return None
+
+    def get(self, ref) -> dict:
+        """Image by id, unique id prefix, tag or digest, None if unknown."""
+        self.refresh()
+        with self._lock:
+            image_id = self._resolve(ref)
+            if image_id is None:
+                return None
+            return self._images[image_id][1]
+
+    def query(self, labels=None, reference=None) -> list:
+        """
+        Images matching all filters.
+
+        :param labels:     list of 'key' or 'key=value' label filters
+        :param reference:  image id, tag or digest
+        """
+        self.refresh()
+        with self._lock:
+            if reference is not None:
+                image_id = self._resolve(reference)
+                ids = {image_id} if image_id else set()
+            else:
+                ids = None
+            for label in labels or []:
+                key, sep, value = label.partition('=')
+                values = self._labels.get(key, {})
+                if sep:
+                    found = set(values.get(value, ()))
+                else:
+                    found = set().union(*values.values())
+                ids = found if ids is None else ids & found
+            if ids is None:
+                ids = self._ids
+            return [self._images[image_id][1] for image_id in sorted(ids)]
+
+    def digest(self) -> str:
+        """Digest of the image list, changes whenever an image does."""
+        self.refresh()
+        with self._lock:
+            return self._digest
+
+    def stats(self) -> dict:
+        """Report size and reload counters."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['images'] = len(self._images)
+            stats['age'] = None
+            if self._loaded is not None:
+                stats['age'] = monotonic() - self._loaded
+        return stats
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    from time import perf_counter
+    x = Inventory(loader=lambda: [
+        {'Id': 'sha256:' + '%064x' % num,
+         'RepoTags': ['docker.io/library/img%d:latest' % num],
+         'Labels': {'app': 'demo%d' % (num % 10)}} for num in range(1000)])
+    print("by tag:  ", x.get('img7')['Id'])
+    start = perf_counter()
+    for _ in range(1000):
+        x.query(labels=['app=demo3'], reference='img3')
+    print("query:    {:.1f} us".format((perf_counter() - start) * 1000))
+    print("digest:  ", x.digest())
+    print("stats:   ", x.stats())
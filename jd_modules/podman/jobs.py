@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Podman image job class.
+
+Reports progress of image pull, push and build tasks started through
+POST /podman/images, as one summary or as server-sent events.
+"""
+
+import json
+from flask import Response, request, stream_with_context
+from flask_restx import Resource, reqparse
+from .progress import Progress
+
+KEEPALIVE = 15      # seconds between keep-alive comments of event streams
+
+# --------- restful class --------------------------------------------------
+
+
+class ImageJobs(Resource):
+    """
+    Image job progress.
+
+    GET /podman/images/jobs/<uuid> parses the task output into a progress
+    summary, with *follow* (or Accept: text/event-stream) progress events
+    are streamed until the task has finished.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:     set verbosity level for debug and logging
+        :param decorators:  apply decorators for access control
+        :param taskmgr:     task manager running the image jobs
+        :returns str: An endpoint name
+        """
+        super().__init__(self, *args, **kwargs)
+        if 'verbose' in kwargs:
+            self.verbose = kwargs['verbose']
+        else:
+            self.verbose = 0
+        if self.verbose > 2:
+            print("args", args)
+            print("kwargs", kwargs)
+        if 'decorators' in kwargs:
+            self.method_decorators = kwargs['decorators']
+        else:
+            self.method_decorators = []
+        if 'taskmgr' in kwargs:
+            self.taskmgr = kwargs['taskmgr']
+        else:
+            self.taskmgr = None
+
+    def _read(self, uuid, stream, progress) -> None:
+        """Feed the complete output of a stream into progress."""
+        offset = 0
+        while True:
+            chunk = self.taskmgr.output(uuid, stream, offset)
+            progress.feed(chunk['data'])
+            offset = chunk['next']
+            if chunk['complete'] or not chunk['data']:
+                break
+
+    def get(self, uuid=None):
+        """
+        Get progress of an image job.
+
+        :param uuid:    task *uuid* as returned by POST /podman/images
+        :returns dict:  task status and progress summary
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("follow", type=int, default=0, location='args')
+        args = parser.parse_args()
+        job = self.taskmgr.job(uuid)
+        if job is None or job.get('params', {}).get('command') != 'podman':
+            return {"error": "Not found "+request.url}, 404
+        action = job['params']['options'].split()[0]
+        # podman prints pull/push progress to stderr, build steps to stdout
+        main, other = 'stderr', 'stdout'
+        if action == 'build':
+            main, other = other, main
+        if args['follow'] or \
+           request.accept_mimetypes.best == 'text/event-stream':
+            chunks = self.taskmgr.tail(uuid, main, timeout=KEEPALIVE)
+            return Response(stream_with_context(
+                self._events(uuid, action, chunks, other)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache',
+                         'X-Accel-Buffering': 'no'})
+        progress = Progress()
+        self._read(uuid, main, progress)
+        self._read(uuid, other, progress)
+        progress.close()
+        return {"task": self.taskmgr.status(uuid), "action": action,
+                "progress": progress.summary()}, 200
+
+    def _events(self, uuid, action, chunks, other):
+        """Turn output chunks into progress events."""
+        progress = Progress()
+        last = None
+        for chunk in chunks:
+            if not chunk['data'] and not chunk['complete']:
+                yield ': keep-alive\n\n'
+                continue
+            progress.feed(chunk['data'])
+            summary = progress.summary()
+            if summary != last:
+                last = summary
+                yield 'event: progress\ndata: {}\n\n'.format(
+                    json.dumps(summary))
+        self._read(uuid, other, progress)
+        progress.close()
+        yield 'event: complete\ndata: {}\n\n'.format(json.dumps({
+            'task': self.taskmgr.wait(uuid, timeout=KEEPALIVE),
+            'action': action,
+            'progress': progress.summary(),
+        }))
+
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    print("class for import into jd_modules framework")
+    # resource_class_kwargs
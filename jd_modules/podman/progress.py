@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+Progress of podman pull, push and build.
+
+Parses the output of the podman CLI ("Copying blob ...", "STEP 2/5: ...")
+as well as the JSON message stream of the engine API ({"status":
+"Downloading", "progressDetail": {...}, "id": ...}) into one summary:
+layers seen and done, bytes transferred, build step and errors.
+"""
+
+import re
+import json
+
+UNITS = {
+    'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+    'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4,
+}
+BLOB = re.compile(r'^Copying (blob|config) (?:sha256:)?([0-9a-f]+)\s*(.*)$')
+SIZES = re.compile(r'([\d.]+)\s*([KMGT]?i?B)\s*/\s*([\d.]+)\s*([KMGT]?i?B)',
+                   re.IGNORECASE)
+STEP = re.compile(r'^STEP (\d+)(?:/(\d+))?\s*:\s*(.*)$', re.IGNORECASE)
+IMAGEID = re.compile(r'^(?:sha256:)?[0-9a-f]{64}$')
+LAYERDONE = ('done', 'skipped', 'already exists', 'pull complete',
+             'download complete', 'pushed', 'layer already exists')
+
+# --------- helpers ----------------------------------------------------------
+
+
+def to_bytes(value, unit) -> int:
+    """Convert '1.5', 'MiB' to bytes."""
+    return int(float(value) * UNITS.get(unit.upper(), 1))
+
+# --------- progress ---------------------------------------------------------
+
+
+class Progress():
+    """Accumulate progress information from command output."""
+
+    def __init__(self):
+        """Update internal class default values if needed."""
+        self._partial = ''
+        self.layers = {}
+        self.step = None
+        self.steps = None
+        self.message = None
+        self.error = None
+        self.image = None
+
+    def feed(self, text) -> None:
+        """Parse the next piece of output (may end with a partial line)."""
+        text = self._partial + text
+        lines = re.split(r'[\r\n]', text)
+        self._partial = lines.pop()
+        for line in lines:
+            self.line(line)
+
+    def close(self) -> None:
+        """Parse a remaining partial line at the end of the output."""
+        if self._partial:
+            self.line(self._partial)
+            self._partial = ''
+
+    def line(self, line) -> None:
+        """Parse one line of output."""
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith('{'):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            if isinstance(message, dict):
+                self._message(message)
+                return
+        self._text(line)
+
+    def _layer(self, layer, status=None, current=None, total=None) -> None:
+        entry = self.layers.setdefault(layer, {
+            'status': None, 'current': 0, 'total': None, 'done': False})
+        if status:
+            entry['status'] = status
+            if status.lower().startswith(LAYERDONE):
+                entry['done'] = True
+        if total:
+            entry['total'] = total
+        if current is not None:
+            entry['current'] = current
+        if entry['done'] and entry['total']:
+            entry['current'] = entry['total']
+
+    def _text(self, line) -> None:
+        """Podman CLI output."""
+        self.message = line
+        match = BLOB.match(line)
+        if match:
+            sizes = SIZES.search(match.group(3))
+            current = total = None
+            if sizes:
+                current = to_bytes(*sizes.group(1, 2))
+                total = to_bytes(*sizes.group(3, 4))
+            self._layer(match.group(2)[:12], match.group(3) or 'copying',
+                        current, total)
+            return
+        match = STEP.match(line)
+        if match:
+            self.step = int(match.group(1))
+            if match.group(2):
+                self.steps = int(match.group(2))
+            return
+        if line.startswith('Writing manifest'):
+            # all blobs copied
+            for layer in self.layers:
+                self._layer(layer, 'done')
+        elif line.lower().startswith('error'):
+            self.error = line
+        elif IMAGEID.match(line):
+            self.image = line
+
+    def _message(self, message) -> None:
+        """Engine API JSON message."""
+        if message.get('error'):
+            self.error = message['error']
+            self.message = message['error']
+            return
+        if 'stream' in message:
+            for line in str(message['stream']).splitlines():
+                self.line(line)
+            return
+        status = message.get('status')
+        if status:
+            self.message = status
+        if message.get('id') and status:
+            detail = message.get('progressDetail') or {}
+            self._layer(message['id'], status, detail.get('current'),
+                        detail.get('total'))
+        if message.get('aux', {}).get('ID'):
+            self.image = message['aux']['ID']
+
+    def summary(self) -> dict:
+        """Progress summary, percent is None as long as nothing is known."""
+        current = sum(layer['current'] or 0 for layer in self.layers.values())
+        total = sum(layer['total'] or 0 for layer in self.layers.values())
+        done = sum(1 for layer in self.layers.values() if layer['done'])
+        percent = None
+        if total:
+            percent = round(100.0 * current / total, 1)
+        elif self.steps:
+            percent = round(100.0 * (self.step or 0) / self.steps, 1)
+        elif self.layers:
+            # non-interactive podman output has no sizes
+            percent = round(100.0 * done / len(self.layers), 1)
+        return {
+            'layers': len(self.layers),
+            'layers_done': done,
+            'current': current,
+            'total': total or None,
+            'percent': percent,
+            'step': self.step,
+            'steps': self.steps,
+            'message': self.message,
+            'error': self.error,
+            'image': self.image,
+        }
+
+
+# --------- main -------------------------------------------------------------
+
+if __name__ == '__main__':
+    x = Progress()
+    x.feed('Trying to pull docker.io/library/alpine:latest...\n'
+           'Getting image source signatures\n'
+           'Copying blob 59bf1c3509f3 [=====>------] 1.2MiB / 2.7MiB\r'
+           'Copying blob 59bf1c3509f3 done\n'
+           'Copying config c059bfaa84 done\n'
+           'Writing manifest to image destination\n')
+    x.feed('{"status": "Downloading", "id": "a1b2", '
+           '"progressDetail": {"current": 512, "total": 1024}}\n')
+    print("progress:", x.summary())
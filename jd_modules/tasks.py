@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""
+Flask resource class for the task manager.
+
+Lists running tasks with scheduler statistics and reports task status.
+Task output can be fetched incrementally by byte offset, or followed as a
+server-sent event stream.
+"""
+
+import json
+from flask import Response, request, stream_with_context
+from flask_restx import Resource, reqparse
+
+MAXWAIT = 60        # max. seconds a status request may wait for a task
+MAXREAD = 1048576   # max. bytes of output returned by one request
+KEEPALIVE = 15      # seconds between keep-alive comments of event streams
+
+# --------- restful class --------------------------------------------------
+
+
+class Tasks(Resource):
+    """
+    Task manager status.
+
+    GET /tasks lists running tasks and scheduler statistics, GET
+    /tasks/<uuid> the status of one task, optionally waiting for it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:     set verbosity level for debug and logging
+        :param decorators:  apply decorators for access control
+        :param taskmgr:     task manager
+        :returns str: An endpoint name
+        """
+        super().__init__(self, *args, **kwargs)
+        if 'verbose' in kwargs:
+            self.verbose = kwargs['verbose']
+        else:
+            self.verbose = 0
+        if self.verbose > 2:
+            print("args", args)
+            print("kwargs", kwargs)
+        if 'decorators' in kwargs:
+            self.method_decorators = kwargs['decorators']
+        else:
+            self.method_decorators = []
+        if 'taskmgr' in kwargs:
+            self.taskmgr = kwargs['taskmgr']
+        else:
+            self.taskmgr = None
+
+    def get(self, uuid=None):
+        """
+        Get task list or status of a task.
+
+        :param uuid:    task *uuid*
+        :returns dict:  task status, query parameter *wait* waits up to the
+                        given number of seconds for the task to finish
+        """
+        if self.verbose:
+            print("get task:", uuid)
+        if uuid is None:
+            return {"tasks": self.taskmgr.status(),
+                    "scheduler": self.taskmgr.stats()}, 200
+        parser = reqparse.RequestParser()
+        parser.add_argument("wait", type=float, default=0, location='args')
+        parser.add_argument("verbose", type=int, default=0, location='args')
+        args = parser.parse_args()
+        timeout = max(0.0, min(args['wait'], MAXWAIT))
+        if timeout:
+            status = self.taskmgr.wait(uuid, timeout=timeout,
+                                       verbose=bool(args['verbose']))
+        else:
+            status = self.taskmgr.status(uuid, verbose=bool(args['verbose']))
+        if status is None:
+            return {"error": "Not found "+request.url}, 404
+        return {"task": status}, 200
+
+
+class TaskOutput(Resource):
+    """
+    Task output.
+
+    GET /tasks/<uuid>/output?stream=stdout&offset=0 returns the output
+    from the given byte offset on and the offset to continue with. With
+    *follow* (or Accept: text/event-stream) the output is streamed as
+    server-sent events until the task has finished.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Update internal class default values if needed.
+
+        :param verbose:     set verbosity level for debug and logging
+        :param decorators:  apply decorators for access control
+        :param taskmgr:     task manager
+        :returns str: An endpoint name
+        """
+        super().__init__(self, *args, **kwargs)
+        if 'verbose' in kwargs:
+            self.verbose = kwargs['verbose']
+        else:
+            self.verbose = 0
+        if self.verbose > 2:
+            print("args", args)
+            print("kwargs", kwargs)
+        if 'decorators' in kwargs:
+            self.method_decorators = kwargs['decorators']
+        else:
+            self.method_decorators = []
+        if 'taskmgr' in kwargs:
+            self.taskmgr = kwargs['taskmgr']
+        else:
+            self.taskmgr = None
+
+    def get(self, uuid=None):
+        """
+        Get task output from a byte offset on.
+
+        :param uuid:    task *uuid*
+        :returns dict:  output chunk: *data*, *offset* of the data, *next*
+                        offset to ask for and *complete* once the task has
+                        finished and all output was read
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("stream", type=str, default='stdout',
+                            choices=('stdout', 'stderr'), location='args')
+        parser.add_argument("offset", type=int, default=0, location='args')
+        parser.add_argument("size", type=int, default=MAXREAD,
+                            location='args')
+        parser.add_argument("follow", type=int, default=0, location='args')
+        args = parser.parse_args()
+        if self.verbose:
+            print("get task output:", uuid, args)
+        size = max(1, min(args['size'], MAXREAD))
+        offset = max(0, args['offset'])
+        if args['follow'] or \
+           request.accept_mimetypes.best == 'text/event-stream':
+            # reconnecting clients continue where they stopped
+            last = request.headers.get('Last-Event-ID', '')
+            if last.isdigit():
+                offset = int(last)
+            chunks = self.taskmgr.tail(uuid, args['stream'], offset, size,
+                                       timeout=KEEPALIVE)
+            if chunks is None:
+                return {"error": "Not found "+request.url}, 404
+            return Response(stream_with_context(self._events(chunks)),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     'X-Accel-Buffering': 'no'})
+        chunk = self.taskmgr.output(uuid, args['stream'], offset, size)
+        if chunk is None:
+            return {"error": "Not found "+request.url}, 404
+        return {"output": chunk}, 200
+
+    @staticmethod
+    def _events(chunks):
+        """Format output chunks as server-sent events."""
+        for chunk in chunks:
+            if chunk['data']:
+                lines = chunk['data'].split('\n')
+                yield 'id: {}\nevent: output\n{}\n\n'.format(
+                    chunk['next'],
+                    '\n'.join('data: ' + line for line in lines))
+            elif not chunk['complete']:
+                yield ': keep-alive\n\n'
+            if chunk['complete']:
+                yield 'id: {}\nevent: complete\ndata: {}\n\n'.format(
+                    chunk['next'], json.dumps({'next': chunk['next']}))
+
+
+# --------- main -------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    print("class for import into jd_modules framework")
+    # resource_class_kwargs
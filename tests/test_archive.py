@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Image archives through the podman CLI: streaming, admission, messages."""
+
+import base64
+
+import pytest
+
+import jd_app
+from jd_modules.podman import archive
+
+PODMAN = '''#!/bin/sh
+case "$1" in
+image) exit 0 ;;
+save) head -c 300000 /dev/zero ;;
+load)
+    # lots of messages before reading the archive
+    i=0
+    while [ $i -lt 2000 ]; do
+        echo "Getting image source signatures, blob $i of many"
+        i=$((i + 1))
+    done
+    cat > /dev/null
+    echo "Loaded image: localhost/stub:latest" ;;
+esac
+'''
+AUTH = {'Authorization': 'Basic ' +
+        base64.b64encode(b'admin:password').decode('ascii')}
+URL = '/api/v1.0/podman/images/archive'
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App in an empty directory, podman replaced by a shell script."""
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    (bindir / 'podman').write_text(PODMAN)
+    (bindir / 'podman').chmod(0o755)
+    monkeypatch.setenv('PATH', '{}:{}'.format(bindir, '/usr/bin:/bin'))
+    monkeypatch.chdir(tmp_path)
+    app = jd_app.create_app(threads=2)
+    yield app
+    jd_app.shutdown_app(app, timeout=5)
+
+
+def test_save_and_load(app):
+    client = app.test_client()
+    reply = client.get(URL + '?name=stub:latest', headers=AUTH)
+    assert reply.status_code == 200
+    assert len(reply.data) == 300000
+    # more than a pipe buffer each way
+    reply = client.post(URL, headers=AUTH, data=b'\0' * 1000000,
+                        content_type='application/x-tar')
+    assert reply.status_code == 201
+    assert reply.json['loaded'].endswith('localhost/stub:latest\n')
+    assert len(reply.json['loaded']) <= archive.MSGSIZE
+    transfers = client.get(URL, headers=AUTH).json['transfers']
+    assert [entry['status'] for entry in transfers] == ['finished'] * 2
+    assert app.extensions['jd_app']['taskmgr'].stats()['running'] == 0
+
+
+def test_transfers_take_task_slots(app, monkeypatch):
+    monkeypatch.setattr(archive, 'SLOTWAIT', 0)
+    taskmgr = app.extensions['jd_app']['taskmgr']
+    for _ in range(taskmgr.max_running):
+        taskmgr.reserve()
+    client = app.test_client()
+    try:
+        reply = client.get(URL + '?name=stub:latest', headers=AUTH)
+        assert reply.status_code == 429
+        reply = client.post(URL, headers=AUTH, data=b'\0',
+                            content_type='application/x-tar')
+        assert reply.status_code == 429
+    finally:
+        for _ in range(taskmgr.max_running):
+            taskmgr.release()
+    # a download closed unread gives its slot back
+    reply = client.get(URL + '?name=stub:latest', headers=AUTH,
+                       buffered=False)
+    assert taskmgr.stats()['running'] == 1
+    reply.close()
+    assert taskmgr.stats()['running'] == 0
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""ASGI app and AsyncTaskMgr: startup, error replies, queue accounting."""
+
+import json
+import base64
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import jd_asgi
+from jd_lib import AsyncTaskMgr
+
+AUTH = b'Basic ' + base64.b64encode(b'admin:password')
+
+
+async def call(app, path, query=b'', method='GET', chunks=(b'',),
+               auth=AUTH):
+    """Send a request to the app, return status and decoded body."""
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query, 'headers': [(b'authorization', auth)]}
+    messages = []
+    chunks = list(chunks)
+
+    async def receive():
+        app.received += 1
+        body = chunks.pop(0)
+        return {'type': 'http.request', 'body': body,
+                'more_body': bool(chunks)}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App in an empty directory, started by its first requests."""
+    monkeypatch.chdir(tmp_path)
+    starts = []
+    startup = jd_asgi.App.startup
+
+    async def counted(self):
+        starts.append(1)
+        await startup(self)
+
+    monkeypatch.setattr(jd_asgi.App, 'startup', counted)
+    app = jd_asgi.create_app()
+    app.starts = starts
+    app.received = 0
+    return app
+
+
+def test_lazy_startup_once(app):
+    async def run():
+        replies = await asyncio.gather(
+            *[call(app, '/api/v1.0/tasks') for _ in range(5)])
+        await app.shutdown()
+        return replies
+
+    replies = asyncio.run(run())
+    assert [status for status, _ in replies] == [200] * 5
+    assert len(app.starts) == 1
+
+
+def test_unexpected_error_is_500(app, monkeypatch):
+    async def run():
+        await call(app, '/api/v1.0/tasks')
+
+        def broken():
+            raise sqlite3.OperationalError('database is locked')
+
+        monkeypatch.setattr(app.taskmgr, 'stats', broken)
+        return await call(app, '/api/v1.0/tasks')
+
+    assert asyncio.run(run()) == (500, {"error": "Internal server error"})
+
+
+@pytest.mark.parametrize('path, query', [
+    ('/api/v1.0/podman/images/--quiet', b''),
+    ('/api/v1.0/podman/images', b'label=a%20--format%20x'),
+    ('/api/v1.0/podman/images', b'label=ok&label=-x'),
+])
+def test_images_rejects_filters(app, path, query):
+    assert asyncio.run(call(app, path, query))[0] == 400
+
+
+def test_body_read_after_authentication(app, monkeypatch):
+    monkeypatch.setattr(jd_asgi, 'MAXBODY', 1000)
+    chunks = [b'x' * 600] * 4
+    path = '/api/v1.0/podman/images'
+
+    async def run():
+        status = [(await call(app, path, method='POST', chunks=chunks,
+                              auth=b'Basic bm9ib2R5Og=='))[0]]
+        received = app.received
+        status.append((await call(app, path, method='POST',
+                                  chunks=chunks))[0])
+        return status, received
+
+    status, received = asyncio.run(run())
+    assert status == [401, 413]
+    assert received == 0
+
+
+def test_auth_cache_off_loop(app, monkeypatch):
+    async def run():
+        await call(app, '/api/v1.0/tasks')
+        loop_thread = threading.get_ident()
+        threads = []
+        version = app.authdb.version
+
+        def recorded():
+            threads.append(threading.get_ident())
+            return version()
+
+        monkeypatch.setattr(app.authcache, '_version', recorded)
+        monkeypatch.setattr(app.authcache, '_checked', 0.0)
+        assert (await call(app, '/api/v1.0/tasks'))[0] == 200
+        return loop_thread, threads
+
+    loop_thread, threads = asyncio.run(run())
+    assert threads and loop_thread not in threads
+
+
+def test_cancel_while_waiting(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        x = AsyncTaskMgr(max_running=1, max_queue=1)
+        first = await x.add({'command': 'sleep', 'options': '0.5'})
+        await asyncio.sleep(0.1)
+        runners = set(x._runners)
+        await x.add({'command': 'sleep', 'options': '0.5'})
+        (waiting,) = x._runners - runners
+        await asyncio.sleep(0)
+        assert x.stats()['queued'] == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert x.stats()['queued'] == 0
+        # the queue has room again
+        third = await x.add({'command': 'true', 'options': ''})
+        await x.wait(first)
+        return (await x.wait(third))['status'], x.stats()
+
+    status, stats = asyncio.run(run())
+    assert status == 'finished'
+    assert (stats['running'], stats['queued']) == (0, 0)
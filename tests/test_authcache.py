@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+"""AuthCache: entries of expiring tokens don't outlive the token."""
+
+from jd_lib import AuthCache, AuthDB
+from jd_lib import authcache as authcachemod
+
+
+def test_entry_ttl_capped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(authcachemod, 'monotonic', lambda: now[0])
+    x = AuthCache(ttl=300)
+    x.put('long', 'admin')
+    x.put('short', 'admin', ttl=10)
+    x.put('longer', 'admin', ttl=3600)
+    x.put('expired', 'admin', ttl=0)
+    now[0] += 11
+    assert x.get('short') is None
+    assert x.get('long') == 'admin'
+    assert x.get('expired') is None
+    now[0] += 290
+    assert x.get('long') is None and x.get('longer') is None
+
+
+def test_token_remaining(tmp_path):
+    authdb = AuthDB(str(tmp_path / 'auth.db'), token_ttl=60)
+    data = authdb.token_get(authdb.token_set('admin'))
+    assert 55 < authdb.token_remaining(data) <= 60
+    assert authdb.token_remaining(dict(data, token_ts='garbage')) == 0
+    forever = AuthDB(str(tmp_path / 'auth.db'))
+    assert forever.token_remaining(data) is None
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+"""Conditional GET: If-Modified-Since against the modification time."""
+
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from jd_modules import conditional
+
+SINCE = datetime(2023, 11, 14, 22, 13, 20)     # 1700000000, naive UTC
+
+
+@pytest.fixture
+def local_tz(monkeypatch):
+    """Run with a local time zone far from UTC."""
+    monkeypatch.setenv('TZ', 'America/Los_Angeles')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+# werkzeug 1.0 parses HTTP dates to naive UTC datetimes, 2.0 to aware ones
+@pytest.mark.parametrize('since', [SINCE,
+                                   SINCE.replace(tzinfo=timezone.utc)])
+@pytest.mark.parametrize('mtime, expected', [(1700000000, True),
+                                             (1700000001, False)])
+def test_if_modified_since_is_utc(local_tz, monkeypatch, since, mtime,
+                                  expected):
+    monkeypatch.setattr(conditional, 'request', SimpleNamespace(
+        if_none_match=None, if_modified_since=since))
+    assert conditional.not_modified(mtime=mtime) is expected
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""Connection pool: units of work and group commit sharing a small pool."""
+
+import base64
+import threading
+
+import jd_app
+from jd_lib import ConnPool
+
+
+def test_units_write_with_group_commit(tmp_path):
+    """Threads holding all connections can still write."""
+    pool = ConnPool(str(tmp_path / 'pool.db'), size=2, timeout=5)
+    pool.group_commit()
+    pool.write('CREATE TABLE t (n INTEGER);')
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def worker(num):
+        unit = pool.unit_of_work()
+        try:
+            with pool.connection() as conn:
+                conn.execute('SELECT count(*) FROM t;').fetchone()
+            barrier.wait()      # both threads hold a connection now
+            pool.write('INSERT INTO t (n) VALUES (?);', [num])
+        except Exception as err:
+            errors.append(err)
+        finally:
+            unit.end()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    with pool.connection() as conn:
+        assert conn.execute('SELECT count(*) FROM t;').fetchone()[0] == 2
+    pool.close()
+
+
+def test_more_requests_than_connections(tmp_path, monkeypatch):
+    """More concurrent requests than pooled connections, group commit on."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jd_app, 'GROUPCOMMIT', 0.005)
+    app = jd_app.create_app(threads=2)
+    size = app.extensions['jd_app']['dbpool'].stats()['size']
+    requests = 3 * size
+    auth = {'Authorization': 'Basic ' +
+            base64.b64encode(b'admin:password').decode('ascii')}
+    barrier = threading.Barrier(requests)
+    status = []
+
+    def request(num):
+        client = app.test_client()
+        barrier.wait()
+        reply = client.post('/api/v1.0/items', headers=auth,
+                            json={'name': 'item{}'.format(num),
+                                  'value': str(num)})
+        status.append(reply.status_code)
+        reply = client.get('/api/v1.0/items?limit=5', headers=auth)
+        status.append(reply.status_code)
+
+    threads = [threading.Thread(target=request, args=(n,), daemon=True)
+               for n in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        # a starved pool makes requests wait for the pool timeout (30 s)
+        thread.join(timeout=20)
+        assert not thread.is_alive()
+    jd_app.shutdown_app(app, timeout=5)
+    assert sorted(set(status)) == [200, 201]
+    assert len(status) == 2 * requests
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""DataDB: batch operations, pagination and input validation."""
+
+import pytest
+
+from jd_lib import DataDB
+from jd_lib.datadb import encode_cursor, prefix_range
+
+
+@pytest.fixture
+def datadb(tmp_path):
+    """DataDB on an empty database with three rows."""
+    db = DataDB(str(tmp_path / 'data.db'), 'resource')
+    db.data_add_many([{'name': 'name{}'.format(num), 'value': str(num)}
+                      for num in range(1, 4)])
+    return db
+
+
+def test_update_many_rejects_non_strings(datadb):
+    result = datadb.data_update_many([
+        {'id': 1, 'name': 5},
+        {'id': 2, 'value': ['x']},
+        {'id': 3, 'value': 'new'},
+    ])
+    assert [entry['status'] for entry in result] == [400, 400, 200]
+    assert datadb.data_get_byid(1)['name'] == 'name1'
+    assert datadb.data_get_byid(2)['value'] == '2'
+    assert datadb.data_get_byid(3)['value'] == 'new'
+
+
+def test_cursor_type_must_match_sort(datadb):
+    _, cursor = datadb.data_list(limit=1, sort='name')
+    datadb.data_list(limit=1, sort='name', after=cursor)
+    with pytest.raises(ValueError):
+        datadb.data_list(limit=1, sort='name',
+                         after=encode_cursor([1, 2], 1))
+    with pytest.raises(ValueError):
+        datadb.data_list(limit=1, sort='id', after=cursor)
+
+
+@pytest.mark.parametrize('prefix', ['name', '\U0010ffff', 'a\U0010ffff',
+                                    '\ud7ff', 'x\ud7ff\U0010ffff'])
+def test_prefix_range_edges(prefix):
+    lower, upper = prefix_range(prefix)
+    assert lower == prefix
+    if upper is not None:
+        assert prefix < upper and prefix + '\U0010ffff' < upper
+        upper.encode('utf8')
+
+
+def test_prefix_of_last_code_point(datadb):
+    datadb.data_create({'name': '\U0010ffffz', 'value': 'last'})
+    rows, _ = datadb.data_list(prefix='\U0010ffff')
+    assert [row['value'] for row in rows] == ['last']
+
+
+def test_update_many_empty_strings(datadb):
+    result = datadb.data_update_many([
+        {'id': 1, 'value': ''},
+        {'id': 2, 'name': '', 'value': None},
+    ])
+    assert [entry['status'] for entry in result] == [200, 200]
+    row = datadb.data_get_byid(1)
+    assert (row['name'], row['value']) == ('name1', '')
+    row = datadb.data_get_byid(2)
+    assert (row['name'], row['value']) == ('', '2')
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""EngineClient against a stub engine API on a unix socket."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingUnixStreamServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pytest
+
+from jd_modules.podman import (EngineClient, EngineError, Inventory,
+                               InventoryError)
+from jd_modules.podman import engine as enginemod
+
+IMAGES = [{'Id': 'sha256:0', 'RepoTags': ['stub:latest'],
+           'Labels': {'app': 'jd'}}]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Minimal engine API: ping, image list and inspect, errors."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body, ctype='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Answer GET requests."""
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        self.server.requests.append((path, parse_qs(url.query)))
+        if path == '/v1.40/_ping':
+            self._reply(200, b'OK', 'text/plain')
+        elif path == '/v1.40/images/json':
+            self._reply(200, IMAGES)
+        elif path == '/v1.40/images/stub:latest/json':
+            self._reply(200, dict(IMAGES[0], Os='linux'))
+        elif path == '/v1.40/images/broken/json':
+            self._reply(500, {'message': 'storage corrupted'})
+        elif path == '/v1.40/images/garbled/json':
+            self._reply(502, b'bad gateway', 'text/plain')
+        else:
+            self._reply(404, {'message': 'no such image'})
+
+    def log_message(self, *args):
+        """Be quiet."""
+
+
+@pytest.fixture
+def stub_server(tmp_path_factory):
+    """Stub engine API server (socket in server_address)."""
+    sockpath = str(tmp_path_factory.mktemp('engine') / 'engine.sock')
+    server = ThreadingUnixStreamServer(sockpath, StubHandler)
+    server.daemon_threads = True
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join(5)
+
+
+@pytest.fixture
+def client(stub_server):
+    """EngineClient talking to the stub server."""
+    x = EngineClient(stub_server.server_address, timeout=5)
+    yield x
+    x.close()
+
+
+def test_list_and_inspect(stub_server, client):
+    assert client.ping() is True
+    assert client.images(filters={'label': ['app=jd']}) == IMAGES
+    _, query = stub_server.requests[-1]
+    assert json.loads(query['filters'][0]) == {'label': ['app=jd']}
+    assert query['all'] == ['false']
+    assert client.image_inspect('stub:latest')['Os'] == 'linux'
+    assert client.image_exists('stub:latest') is True
+    assert client.image_exists('nope') is False
+    # all requests went over one kept-alive connection
+    assert client._idle.qsize() == 1
+
+
+@pytest.mark.parametrize('name, status, message', [
+    ('broken', 500, 'storage corrupted'),
+    ('garbled', 502, 'bad gateway'),
+])
+def test_server_error(client, name, status, message):
+    with pytest.raises(EngineError) as err:
+        client.image_inspect(name)
+    assert (err.value.status, err.value.message) == (status, message)
+    with pytest.raises(EngineError):
+        client.image_exists(name)
+    # the connection stays usable after an error reply
+    assert client.ping() is True
+
+
+def test_missing_socket(tmp_path):
+    x = EngineClient(str(tmp_path / 'missing.sock'), timeout=5)
+    assert x.ping() is False
+    with pytest.raises(OSError):
+        x.images()
+    inventory = Inventory(engine=x)
+    with pytest.raises(InventoryError):
+        inventory.query()
+
+
+def test_find_socket(tmp_path, monkeypatch):
+    monkeypatch.delenv('CONTAINER_HOST', raising=False)
+    monkeypatch.setenv('DOCKER_HOST', 'unix:///srv/docker.sock')
+    assert enginemod.find_socket() == '/srv/docker.sock'
+    monkeypatch.delenv('DOCKER_HOST')
+    present = tmp_path / 'podman.sock'
+    present.touch()
+    monkeypatch.setattr(enginemod, 'SOCKETS', (
+        str(tmp_path / 'user.sock'), str(present)))
+    assert enginemod.find_socket() == str(present)
+    present.unlink()
+    # nothing found: the system socket, connecting reports the error
+    assert enginemod.find_socket() == str(present)
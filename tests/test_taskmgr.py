@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""TaskMgr and AsyncTaskMgr: status of tasks whose command can't start."""
+
+import asyncio
+
+from jd_lib import AsyncTaskMgr, CmdTask, TaskMgr
+
+MISSING = {'command': 'no_such_command_here', 'options': ''}
+
+
+def test_command_not_found(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    x = TaskMgr()
+    status = x.run(MISSING, timeout=5)
+    assert (status['status'], status['RC']) == ('finished', '127')
+    assert x.joblist.get(status['job']['uuid'])['status'] == 'finished'
+    assert x.stats()['types']['cmd']['finished'] == 1
+    x.close(timeout=5)
+
+
+def test_command_not_found_async(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        x = AsyncTaskMgr()
+        status = await x.run(MISSING, timeout=5)
+        job = await asyncio.to_thread(x.joblist.get, status['job']['uuid'])
+        return status, job, x.stats()
+
+    status, job, stats = asyncio.run(run())
+    assert (status['status'], status['RC']) == ('finished', '127')
+    assert job['status'] == 'finished'
+    assert (stats['finished'], stats['failed']) == (1, 0)
+
+
+def test_unbalanced_quotes_rejected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    x = TaskMgr()
+    assert x.add({'command': 'echo', 'options': "'abc"}) is None
+    assert x.stats()['running'] == 0
+    x.close(timeout=5)
+
+
+def test_start_failure_frees_slot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def broken(self):
+        raise OSError('no space left on device')
+
+    monkeypatch.setattr(CmdTask, 'run', broken)
+    x = TaskMgr(max_running=1)
+    uuid = x.add({'command': 'echo', 'options': 'hello'})
+    assert x.wait(uuid, timeout=5)['status'] == 'failed'
+    assert x.joblist.get(uuid)['status'] == 'failed'
+    assert x.stats()['running'] == 0
+    x.close(timeout=5)
+
+
+def test_bad_options_async(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bad = {'command': 'echo', 'options': "'abc"}
+
+    async def run():
+        x = AsyncTaskMgr(max_running=1)
+        assert await x.add(bad) is None
+        # options check() let through fail in the spawn path
+        monkeypatch.setattr(CmdTask, 'check', lambda self: True)
+        uuid = await x.add(bad)
+        runners = set(x._runners)
+        status = await x.wait(uuid, timeout=5)
+        await asyncio.gather(*runners)      # the runner ended cleanly
+        return status, x.stats()
+
+    status, stats = asyncio.run(run())
+    assert status['status'] == 'failed'
+    assert (stats['running'], stats['queued'], stats['failed']) == (0, 0, 1)